@@ -1,17 +1,84 @@
 
 from django.contrib import admin
-from .models import Message, Profile
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .analytics import DASHBOARD_DAYS, dashboard_summary
+from .export import export_response
+from .models import ArchivedMessage, Message, MessageRollup, Profile
+from .search import fts_available, matching_ids_sql
+
+@admin.action(description="Export selected messages (NDJSON, gzip)")
+def export_ndjson(modeladmin, request, queryset):
+    return export_response(request, [queryset], fmt="ndjson", gzip=True, filename="messages")
+
+@admin.action(description="Export selected messages (CSV)")
+def export_csv(modeladmin, request, queryset):
+    return export_response(request, [queryset], fmt="csv", filename="messages")
+
+@admin.action(description="Export these users' full history (NDJSON, gzip)")
+def export_user_history(modeladmin, request, queryset):
+    user_ids = queryset.values("user_id")
+    return export_response(
+        request,
+        [ArchivedMessage.objects.filter(user_id__in=user_ids), Message.objects.filter(user_id__in=user_ids)],
+        fmt="ndjson", gzip=True, filename="history",
+    )
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "sender", "short_message", "created_at")
     list_filter = ("sender", "created_at")
     search_fields = ("user__username", "message")
+    actions = [export_ndjson, export_csv]
 
     def short_message(self, obj):
         return (obj.message[:60] + "…") if len(obj.message) > 60 else obj.message
 
+    def get_search_results(self, request, queryset, search_term):
+        # Message text goes through the FTS index instead of LIKE '%term%'.
+        match = matching_ids_sql(search_term) if fts_available() else None
+        if match is None:
+            return super().get_search_results(request, queryset, search_term)
+        sql, params = match
+        queryset = queryset.filter(Q(user__username__icontains=search_term.strip()) | Q(id__in=RawSQL(sql, params)))
+        return queryset, False
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ("user", "preferred_name", "created_at", "updated_at")
-    search_fields = ("user__username", "preferred_name")
\ No newline at end of file
+    search_fields = ("user__username", "preferred_name")
+    actions = [export_user_history]
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "sender", "short_message", "created_at")
+    list_filter = ("sender",)
+    actions = [export_ndjson, export_csv]
+    short_message = MessageAdmin.short_message
+
+
+@admin.register(MessageRollup)
+class MessageRollupAdmin(admin.ModelAdmin):
+    """Traffic dashboard: summary tables above the rollup rows, no message scans."""
+    list_display = ("day", "user", "intent", "user_messages", "bot_messages")
+    list_filter = ("intent",)
+    date_hierarchy = "day"
+    list_select_related = ("user",)
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        # ?days= sizes the summary window; the changelist would read it as a filter
+        params = request.GET.copy()
+        try:
+            days = max(1, int(params.pop("days", [DASHBOARD_DAYS])[-1]))
+        except ValueError:
+            days = DASHBOARD_DAYS
+        request.GET = params
+        extra_context = {**(extra_context or {}), "summary": dashboard_summary(days)}
+        return super().changelist_view(request, extra_context=extra_context)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,116 @@
+"""Message rollups: counts per (day, user, intent) for the admin dashboard.
+
+Every stored Message carries a transient ``intent`` attribute (which bot
+step or name command answered it). ``record_messages`` folds a batch of
+rows into per-key deltas and applies them with one increment-upsert per
+key, in the same transaction as the insert (or the write-behind flush), so
+the dashboard reads a handful of rollup rows instead of scanning
+chat_message. ``backfill_rollups`` rebuilds them from history.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .bot_logic import bot_reply_with_intent, extract_name, is_asking_name, is_reset
+from .models import Message, MessageRollup
+
+# Intents decided by the views before the bot engine is asked.
+NAME_SET_INTENT = "name_set"
+NAME_RESET_INTENT = "name_reset"
+NAME_ASK_INTENT = "name_ask"
+ERROR_INTENT = "error"
+UNKNOWN_INTENT = "unknown"
+
+RollupKey = Tuple  # (day, user_id, intent)
+
+
+def message_day(created_at):
+    return timezone.localdate(created_at) if timezone.is_aware(created_at) else created_at.date()
+
+
+def rollup_deltas(rows: Iterable) -> Dict[RollupKey, List[int]]:
+    """{(day, user_id, intent): [user_messages, bot_messages]} for `rows`."""
+    deltas: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0])
+    for row in rows:
+        key = (message_day(row.created_at), row.user_id, getattr(row, "intent", None) or UNKNOWN_INTENT)
+        deltas[key][0 if row.sender == Message.USER else 1] += 1
+    return deltas
+
+
+def _upsert_sql(connection) -> str:
+    table = connection.ops.quote_name(MessageRollup._meta.db_table)
+    return (
+        f"INSERT INTO {table} (day, user_id, intent, user_messages, bot_messages) "
+        f"VALUES (%s, %s, %s, %s, %s) "
+        f"ON CONFLICT (day, user_id, intent) DO UPDATE SET "
+        f"user_messages = {table}.user_messages + excluded.user_messages, "
+        f"bot_messages = {table}.bot_messages + excluded.bot_messages"
+    )
+
+
+def apply_deltas(deltas: Dict[RollupKey, List[int]]) -> None:
+    if not deltas:
+        return
+    alias = router.db_for_write(MessageRollup)
+    connection = connections[alias]
+    if connection.vendor in ("sqlite", "postgresql"):
+        params = [
+            (connection.ops.adapt_datefield_value(day), user_id, intent, n_user, n_bot)
+            for (day, user_id, intent), (n_user, n_bot) in deltas.items()
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(_upsert_sql(connection), params)
+        return
+    for (day, user_id, intent), (n_user, n_bot) in deltas.items():
+        counts = dict(user_messages=F("user_messages") + n_user, bot_messages=F("bot_messages") + n_bot)
+        rollups = MessageRollup.objects.using(alias).filter(day=day, user_id=user_id, intent=intent)
+        if rollups.update(**counts):
+            continue
+        try:
+            with transaction.atomic(using=alias):
+                MessageRollup.objects.using(alias).create(
+                    day=day, user_id=user_id, intent=intent, user_messages=n_user, bot_messages=n_bot)
+        except IntegrityError:
+            rollups.update(**counts)
+
+
+def record_messages(rows: Iterable) -> None:
+    """Count freshly stored rows (call inside the transaction that wrote them)."""
+    apply_deltas(rollup_deltas(rows))
+
+
+def classify_send(text: str) -> str:
+    """The intent the send views record for `text` (used by backfill_rollups)."""
+    if is_reset(text):
+        return NAME_RESET_INTENT
+    if extract_name(text):
+        return NAME_SET_INTENT
+    if is_asking_name(text):
+        return NAME_ASK_INTENT
+    try:
+        return bot_reply_with_intent(text)[0]
+    except Exception:
+        return ERROR_INTENT
+
+
+DASHBOARD_DAYS = 30
+TOP_USERS = 10
+
+
+def dashboard_summary(days: int = DASHBOARD_DAYS) -> dict:
+    """Totals for the last `days` days, read from the rollups only."""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    window = MessageRollup.objects.filter(day__gte=since).order_by()
+    sums = dict(user_messages=Sum("user_messages"), bot_messages=Sum("bot_messages"))
+    return {
+        "days": days,
+        "since": since,
+        "totals": window.aggregate(**sums),
+        "by_day": list(window.values("day").annotate(**sums).order_by("-day")),
+        "by_intent": list(window.values("intent").annotate(**sums).order_by("-user_messages")),
+        "top_users": list(window.values("user__username").annotate(**sums).order_by("-user_messages")[:TOP_USERS]),
+    }
@@ -1,6 +1,49 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import bot_logic, write_behind
+        from .db import apply_sqlite_pragmas
+        from .metrics import install_db_timer
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid="chat.apply_sqlite_pragmas")
+        connection_created.connect(install_db_timer, dispatch_uid="chat.install_db_timer")
+
+        wb_opts = getattr(settings, "CHAT_WRITE_BEHIND", None)
+        if wb_opts is not None:
+            write_behind.configure(wb_opts)
+
+        cache_opts = getattr(settings, "CHAT_REPLY_CACHE", None)
+        if cache_opts is not None:
+            bot_logic.configure_reply_cache(**cache_opts)
+
+        engine = getattr(settings, "CHAT_KB_ENGINE", "jaccard")
+        matcher_factory = None
+        if engine == "vector":
+            try:
+                from .kb_vectors import VectorKnowledgeIndex
+            except ImportError as exc:
+                raise ImproperlyConfigured("CHAT_KB_ENGINE='vector' requires numpy") from exc
+            vector_opts = getattr(settings, "CHAT_KB_VECTOR_OPTIONS", {})
+            matcher_factory = lambda content: VectorKnowledgeIndex(content.kb, **vector_opts)  # noqa: E731
+        elif engine != "jaccard":
+            raise ImproperlyConfigured(f"Unknown CHAT_KB_ENGINE: {engine!r}")
+
+        kb_source = getattr(settings, "CHAT_KB_SOURCE", None)
+        kb_artifact = getattr(settings, "CHAT_KB_ARTIFACT", None)
+        if kb_source or kb_artifact:
+            from . import kb_loader
+            try:
+                kb_loader.configure(kb_source, kb_artifact, getattr(settings, "CHAT_KB_RELOAD_INTERVAL", 5),
+                                    matcher_factory)
+            except kb_loader.KBLoadError as exc:
+                raise ImproperlyConfigured(f"Cannot load the chat KB: {exc}") from exc
+        elif matcher_factory is not None:
+            bot_logic.set_kb_matcher(matcher_factory(bot_logic.CONTENT))
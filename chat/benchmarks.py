@@ -0,0 +1,333 @@
+"""Benchmarks for the bot engine and the chat API (run with `manage.py chat_bench`).
+
+* micro: ``tokenize``, ``jaccard``, ``_match_project_q``, ``calculator_intent``
+  and ``generate_bot_reply`` over a synthetic message corpus, plus KB lookups
+  (in-memory and kb_mmap) and replies against synthetic KBs of increasing
+  size. Each round runs the whole corpus; the stats are over the per-op time
+  of each round.
+* macro: ``api_send``, ``api_history`` and ``api_messages`` (with the session
+  and with a poll token) through the Django test client against a seeded
+  test database; the stats are over single requests, with the median number
+  of DB queries per request.
+
+Results are plain dicts (JSON-ready), all times in seconds per operation.
+``compare`` checks them against a stored baseline by median.
+"""
+import gc
+import platform
+import random
+import statistics
+import string
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import django
+
+from . import bot_logic
+from .bot_logic import (
+    KB, PROJECT_QA, KnowledgeIndex, SpellCorrector, _match_project_q, calculator_intent, generate_bot_reply,
+    jaccard, tokenize,
+)
+from .kb_mmap import MappedKnowledgeIndex, build_index
+from .polltoken import issue_token
+
+DEFAULT_KB_SIZES = (100, 1000, 10000)
+DEFAULT_THRESHOLD = 0.15
+
+_FILLER = ("please", "quick", "question", "really", "maybe", "today", "again", "thanks",
+           "friend", "actually", "curious", "wondering", "just", "now")
+_SMALL_TALK = ("hi there", "hello!", "good morning", "hey, how are you?", "thanks a lot",
+               "what time is it", "what's the date today", "tell me a joke", "give me a quote",
+               "which month is it", "what year is it")
+_CALCS = ("calculate {a}*({b}+{c})", "what is {a} + {b}", "compute {a}^2 - {b}", "{a} / {c}",
+          "evaluate ({a}+{b})*{c}", "calc {a} % {c}")
+
+
+# ------------------------------------------------------------
+# Synthetic data
+# ------------------------------------------------------------
+MESSAGE_KINDS = ("kb", "project", "smalltalk", "calc", "noise")
+DEFAULT_MIX = {"kb": 0.35, "project": 0.15, "smalltalk": 0.2, "calc": 0.15, "noise": 0.15}
+
+
+def synthetic_message(rng: random.Random, kind: str) -> str:
+    """One message of the given kind (see MESSAGE_KINDS)."""
+    if kind == "kb":
+        words = rng.choice(KB)[0].split() + rng.sample(_FILLER, 2)
+        rng.shuffle(words)
+        return " ".join(words)
+    if kind == "project":
+        return rng.choice(rng.choice(list(PROJECT_QA.values())))
+    if kind == "smalltalk":
+        return rng.choice(_SMALL_TALK)
+    if kind == "calc":
+        return rng.choice(_CALCS).format(a=rng.randint(1, 999), b=rng.randint(1, 99), c=rng.randint(1, 9))
+    return " ".join(rng.choice(_FILLER) + str(rng.randint(0, 50)) for _ in range(rng.randint(3, 12)))
+
+
+def synthetic_corpus(n: int, seed: int = 0, mix: Optional[Dict[str, float]] = None) -> List[str]:
+    """A mix of KB questions, project questions, small talk, sums and noise."""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = list(mix), list(mix.values())
+    return [synthetic_message(rng, rng.choices(kinds, weights)[0]) for _ in range(n)]
+
+
+def synthetic_kb(size: int, seed: int = 0, vocabulary: int = 5000) -> List[Tuple[str, str]]:
+    """The real KB plus generated entries over a Zipf-ish vocabulary."""
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(vocabulary)]
+    weights = [1.0 / (i + 1) for i in range(vocabulary)]
+    entries = list(KB)
+    while len(entries) < size:
+        question = " ".join(rng.choices(words, weights, k=rng.randint(2, 6)))
+        entries.append((question, f"Answer {len(entries)}"))
+    return entries[:size]
+
+
+def spell_words(size: int, seed: int = 0) -> List[str]:
+    """`size` random letters-only words for the spelling corrector to search."""
+    rng = random.Random(seed)
+    return ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10))) for _ in range(size)]
+
+
+# ------------------------------------------------------------
+# Measurement
+# ------------------------------------------------------------
+def summarize(samples: Sequence[float], ops: int) -> dict:
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+    return {
+        "ops": ops,
+        "samples": len(ordered),
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "min": ordered[0],
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+    }
+
+
+def measure(fn: Callable, inputs: Sequence, repeat: int = 5, warmup: int = 1) -> dict:
+    """Per-op time of fn(x) over every input, once per round."""
+    for _ in range(warmup):
+        for x in inputs:
+            fn(x)
+    rounds = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for x in inputs:
+                fn(x)
+            rounds.append((time.perf_counter() - start) / len(inputs))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return summarize(rounds, len(inputs) * repeat)
+
+
+@contextmanager
+def _reply_cache(maxsize: int):
+    saved = bot_logic.REPLY_CACHE
+    bot_logic.configure_reply_cache(maxsize=maxsize)
+    try:
+        yield
+    finally:
+        bot_logic.REPLY_CACHE = saved
+
+
+@contextmanager
+def _kb_matcher(matcher):
+    saved = bot_logic.KB_MATCHER
+    bot_logic.set_kb_matcher(matcher)
+    try:
+        yield
+    finally:
+        bot_logic.set_kb_matcher(saved)
+
+
+def _vector_index():
+    try:
+        from .kb_vectors import VectorKnowledgeIndex
+    except ImportError:
+        return None
+    return VectorKnowledgeIndex
+
+
+# ------------------------------------------------------------
+# Suites
+# ------------------------------------------------------------
+def run_micro(corpus_size: int = 2000, repeat: int = 5, kb_sizes: Iterable[int] = DEFAULT_KB_SIZES,
+              selected: Optional[str] = None, seed: int = 0) -> Dict[str, dict]:
+    corpus = synthetic_corpus(corpus_size, seed)
+    token_sets = [tokenize(t) for t in corpus]
+    pairs = list(zip(token_sets, token_sets[1:] + token_sets[:1]))
+    results: Dict[str, dict] = {}
+
+    def bench(name, fn, inputs):
+        if selected is None or selected in name:
+            results[name] = measure(fn, inputs, repeat)
+
+    bench("micro.tokenize", tokenize, corpus)
+    bench("micro.jaccard", lambda p: jaccard(*p), pairs)
+    bench("micro.match_project_q", _match_project_q, corpus)
+    bench("micro.calculator_intent", calculator_intent, corpus)
+    with _reply_cache(0):
+        bench("micro.generate_bot_reply.uncached", generate_bot_reply, corpus)
+    with _reply_cache(4096):
+        bench("micro.generate_bot_reply.cached", generate_bot_reply, corpus)
+
+    vector_cls = _vector_index()
+    for size in kb_sizes:
+        entries = synthetic_kb(size, seed)
+        # the same corpus with one generated KB term per message, so lookups
+        # touch postings that grow with the KB
+        texts = [f"{t} term{i % 50}" for i, t in enumerate(corpus)]
+        queries = [tokenize(t) for t in texts]
+        bench(f"micro.kb_build[{size}]", KnowledgeIndex, [entries])
+        index = KnowledgeIndex(entries)
+        bench(f"micro.kb_best_answer[{size}]", index.best_answer, queries)
+        mapped = MappedKnowledgeIndex(build_index(index.entries, index.token_sets))
+        bench(f"micro.kb_mapped_best_answer[{size}]", mapped.best_answer, queries)
+        # the speller skips tokens with digits, so give it `size` extra words to search
+        extra = spell_words(size, seed)
+        words = list(index.vocabulary()) + [(w, 1) for w in extra]
+        bench(f"micro.spell_build[{size}]", SpellCorrector, [words])
+        speller = SpellCorrector(words)
+        typos = ["pyhton", "djnago", "javscript"] + [w[:2] + w[3:] for w in extra[:50]]
+        bench(f"micro.spell_correct[{size}]", speller.correct, [typos[i % len(typos)] for i in range(len(corpus))])
+        with _kb_matcher(index), _reply_cache(0):
+            bench(f"micro.generate_bot_reply.kb[{size}]", generate_bot_reply, texts)
+        if vector_cls is not None:
+            vindex = vector_cls(entries)
+            bench(f"micro.kb_vector_best_answer[{size}]", vindex.best_answer, queries)
+    return results
+
+
+def _seed(users: int, messages_per_user: int, batch: int = 5000):
+    from django.contrib.auth.models import User
+    from .models import Message, Profile
+
+    corpus = synthetic_corpus(1000)
+    accounts = []
+    for i in range(users):
+        user = User.objects.create_user(f"bench{i:03d}", password="bench1")
+        Profile.objects.create(user=user)
+        accounts.append(user)
+    for user in accounts:
+        rows = []
+        for j in range(messages_per_user):
+            sender = Message.USER if j % 2 == 0 else Message.BOT
+            rows.append(Message(user=user, sender=sender, message=corpus[j % len(corpus)]))
+            if len(rows) >= batch:
+                Message.objects.bulk_create(rows)
+                rows = []
+        Message.objects.bulk_create(rows)
+    return accounts
+
+
+def _requests(client, requests, call) -> dict:
+    from django.db import connections
+    from django.test.utils import CaptureQueriesContext
+
+    latencies, queries, errors = [], [], 0
+    for i in range(requests):
+        # every alias: reads may go to the replica
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(c)) for c in connections.all()]
+            start = time.perf_counter()
+            response = call(client, i)
+            latencies.append(time.perf_counter() - start)
+        queries.append(sum(len(ctx.captured_queries) for ctx in captured))
+        if response.status_code >= 400:
+            errors += 1
+    result = summarize(latencies, requests)
+    result.update(queries=statistics.median(queries), errors=errors, throughput=requests / sum(latencies))
+    return result
+
+
+def run_macro(users: int = 10, messages_per_user: int = 2000, requests: int = 200,
+              selected: Optional[str] = None) -> Dict[str, dict]:
+    """Run inside a test database (chat_bench sets one up)."""
+    import json
+    from django.db.models import Max
+    from django.test import Client, override_settings
+    from .models import Message
+
+    accounts = _seed(users, messages_per_user)
+    user = accounts[0]
+    client = Client()
+    client.force_login(user)
+    client.get("/")
+    corpus = synthetic_corpus(requests, seed=1)
+    results: Dict[str, dict] = {}
+
+    def latest():
+        return Message.objects.filter(user=user).aggregate(m=Max("id"))["m"]
+
+    def bench(name, call):
+        if selected is None or selected in name:
+            call(client, 0)  # warm up
+            results[name] = _requests(client, requests, call)
+
+    # one user calls each endpoint in a tight loop: measure the handlers, not
+    # the rate limiter
+    with override_settings(CHAT_RATE_LIMITS={}):
+        with override_settings(CHAT_TYPING_DELAY=0):
+            bench("macro.api_send", lambda c, i: c.post(
+                "/api/send", json.dumps({"message": corpus[i % len(corpus)]}), content_type="application/json"))
+        bench("macro.api_history.newest", lambda c, i: c.get("/api/history"))
+        oldest = Message.objects.filter(user=user).order_by("id").values_list("id", flat=True)[200]
+        bench("macro.api_history.deep", lambda c, i: c.get("/api/history", {"before": oldest}))
+        newest = latest()
+        bench("macro.api_messages.empty", lambda c, i: c.get("/api/messages", {"after": newest}))
+        token = issue_token(user.id)
+        bench("macro.api_messages.empty_token", lambda c, i: c.get(
+            "/api/messages", {"after": newest}, headers={"X-Poll-Token": token}))
+        bench("macro.api_messages.recent", lambda c, i: c.get("/api/messages", {"after": newest - 20}))
+    return results
+
+
+# ------------------------------------------------------------
+# Reports
+# ------------------------------------------------------------
+def environment() -> dict:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "django": django.get_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict],
+            threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    """One row per benchmark: median ratio current/baseline and a status."""
+    rows = []
+    for name in sorted(set(current) | set(baseline)):
+        now, before = current.get(name), baseline.get(name)
+        if now is None or before is None:
+            rows.append({"name": name, "status": "missing" if now is None else "new"})
+            continue
+        ratio = now["median"] / before["median"] if before["median"] else float("inf")
+        status = "regression" if ratio > 1 + threshold else "improved" if ratio < 1 - threshold else "ok"
+        rows.append({"name": name, "baseline": before["median"], "current": now["median"],
+                     "ratio": ratio, "status": status})
+    return rows
+
+
+def format_seconds(value: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if value >= scale:
+            return f"{value / scale:.2f}{unit}"
+    return f"{value / 1e-9:.0f}ns"
@@ -1,9 +1,18 @@
 
 import re
 import ast
+import heapq
+import math
 import random
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
 from datetime import datetime, timezone
-from typing import Optional, Set, Tuple, List, Dict, Iterable
+from functools import lru_cache
+from typing import Callable, Optional, Set, FrozenSet, Tuple, List, Dict, Iterable, NamedTuple
+
+from .metrics import BOT_REPLY_SECONDS, BOT_STAGE_SECONDS
 
 # ------------------------------------------------------------
 # Stopwords and a Knowledge Base (general tech FAQs)
@@ -198,16 +207,10 @@ PROJECT_ANSWERS: Dict[str, str] = {
     "security": PROJECT_SECURITY,
 }
 
+PROJECT_FLEX_WORDS = ("about", "overview", "describe", "details", "explain")
+
 def _match_project_q(text: str) -> Optional[str]:
-    t = text.lower().strip()
-    for key, patterns in PROJECT_QA.items():
-        for p in patterns:
-            if p in t:
-                return PROJECT_ANSWERS[key]
-    # Extra flexible catch: “project ...” + common words
-    if "project" in t and any(w in t for w in ["about", "overview", "describe", "details", "explain"]):
-        return PROJECT_OVERVIEW
-    return None
+    return ROUTER.route(text, stages=("project",))
 
 # ------------------------------------------------------------
 # Tokenizer & Jaccard (used in KB fuzzy)
@@ -223,82 +226,323 @@ def jaccard(a: Set[str], b: Set[str]) -> float:
     union = len(a | b)
     return inter / union if union else 0.0
 
+# ------------------------------------------------------------
+# KB index: question token sets + postings, built once
+# ------------------------------------------------------------
+KB_MATCH_THRESHOLD = 0.22
+
+class KBMatch(NamedTuple):
+    score: float
+    question: str
+    answer: str
+
+class KnowledgeIndex:
+    """Inverted index over KB questions for Jaccard scoring.
+
+    Questions are tokenized once; a query only scores entries that share at
+    least one token with it, so lookup cost follows the postings touched
+    rather than the size of the KB.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str]]):
+        self.entries: List[Tuple[str, str]] = list(entries)
+        self.token_sets: List[FrozenSet[str]] = [frozenset(tokenize(q)) for q, _ in self.entries]
+        self.postings: Dict[str, List[int]] = {}
+        for idx, toks in enumerate(self.token_sets):
+            for tok in toks:
+                self.postings.setdefault(tok, []).append(idx)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def vocabulary(self) -> Iterable[Tuple[str, int]]:
+        """(token, number of questions containing it)."""
+        return ((tok, len(ids)) for tok, ids in self.postings.items())
+
+    def search(self, tokens: Set[str], k: int = 1) -> List[KBMatch]:
+        """Top-k entries by Jaccard score; ties keep KB order."""
+        overlap: Dict[int, int] = {}
+        for tok in tokens:
+            for idx in self.postings.get(tok, ()):
+                overlap[idx] = overlap.get(idx, 0) + 1
+        if not overlap:
+            return []
+        qlen = len(tokens)
+        scored = [
+            (inter / (qlen + len(self.token_sets[idx]) - inter), idx)
+            for idx, inter in overlap.items()
+        ]
+        best = heapq.nsmallest(k, scored, key=lambda p: (-p[0], p[1]))
+        return [KBMatch(score, *self.entries[idx]) for score, idx in best]
+
+    def best_answer(self, tokens: Set[str], threshold: float = KB_MATCH_THRESHOLD) -> Optional[str]:
+        top = self.search(tokens, k=1)
+        if top and top[0].score >= threshold:
+            return top[0].answer
+        return None
+
+    def best_answers(self, token_sets: Iterable[Set[str]], threshold: float = KB_MATCH_THRESHOLD) -> List[Optional[str]]:
+        return [self.best_answer(toks, threshold) for toks in token_sets]
+
+KB_INDEX = KnowledgeIndex(KB)
+
+# Engine used by generate_bot_reply; anything with best_answer(tokens) and
+# best_answers(token_sets) works
+# (e.g. kb_vectors.VectorKnowledgeIndex, selected by settings.CHAT_KB_ENGINE).
+KB_MATCHER = KB_INDEX
+
+def set_kb_matcher(matcher) -> None:
+    install_content(CONTENT.with_matcher(matcher))
+
+# ------------------------------------------------------------
+# Reply cache (deterministic answers only)
+# ------------------------------------------------------------
+# Project Q&A, calculator results and KB answers depend only on the text, so
+# they are memoized on the text lowercased, stripped and with whitespace runs
+# collapsed (the router and tokenizer lowercase anyway, and the calculator
+# only reads digits/operators). Time/date,
+# greetings, jokes/quotes and follow-ups are time-dependent or random and
+# never stored. Neither are the calculator's refusals. `name` is part of
+# the key for callers that cache a name-dependent reply; none of the
+# built-in cacheable stages are.
+CACHEABLE_STAGES: Set[str] = {"project", "calculator", "kb"}
+
+def _cacheable(stage: Optional[str], reply: str) -> bool:
+    return stage in CACHEABLE_STAGES and reply not in CALC_REFUSALS
+
+class ReplyCache:
+    """Bounded LRU with optional TTL (seconds) and hit/miss/eviction counters.
+
+    `generation` goes up on every clear(); a put() tagged with an older
+    generation is dropped, so a reply computed from content that has since
+    been swapped out never lands in the fresh cache.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # values are (intent, reply) pairs
+        self._data: "OrderedDict[Tuple[str, Optional[str]], Tuple[float, Tuple[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.generation = 0
+
+    @staticmethod
+    def key(text: str, name: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        return " ".join(text.lower().split()), name
+
+    def get(self, text: str, name: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        k = self.key(text, name)
+        with self._lock:
+            item = self._data.get(k)
+            if item is not None and self.ttl is not None and time.monotonic() - item[0] > self.ttl:
+                del self._data[k]
+                self.evictions += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(k)
+            self.hits += 1
+            return item[1]
+
+    def put(self, text: str, reply: Tuple[str, str], name: Optional[str] = None,
+            generation: Optional[int] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        k = self.key(text, name)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[k] = (time.monotonic(), reply)
+            self._data.move_to_end(k)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+REPLY_CACHE = ReplyCache()
+
+def configure_reply_cache(maxsize: int = 2048, ttl: Optional[float] = None) -> None:
+    global REPLY_CACHE
+    REPLY_CACHE = ReplyCache(maxsize=maxsize, ttl=ttl)
+
 # ------------------------------------------------------------
 # Dynamic intents: time/date, jokes/quotes, calculator
 # ------------------------------------------------------------
+def _utc_time_reply(_t: str) -> str:
+    return "UTC time is " + datetime.now(timezone.utc).strftime("%H:%M:%S") + "."
+
+def _time_reply(_t: str) -> str:
+    return "The current time is " + datetime.now().strftime("%I:%M %p") + "."
+
+def _date_reply(_t: str) -> str:
+    return "Today is " + datetime.now().strftime("%A, %d %B %Y") + "."
+
+def _weekday_reply(_t: str) -> str:
+    return "It’s " + datetime.now().strftime("%A") + "."
+
+def _month_reply(_t: str) -> str:
+    return "We are in " + datetime.now().strftime("%B") + "."
+
+def _year_reply(_t: str) -> str:
+    return "It’s " + datetime.now().strftime("%Y") + "."
+
+def _choice_reply(items: Tuple[str, ...]) -> Callable[[str], Optional[str]]:
+    return lambda _t: random.choice(items) if items else None
+
 def time_date_intents(t: str) -> Optional[str]:
-    t_low = t.lower()
-    if "utc" in t_low and "time" in t_low:
-        return "UTC time is " + datetime.now(timezone.utc).strftime("%H:%M:%S") + "."
-    if "time" in t_low or "clock" in t_low:
-        return "The current time is " + datetime.now().strftime("%I:%M %p") + "."
-    if "date" in t_low or "today" in t_low:
-        return "Today is " + datetime.now().strftime("%A, %d %B %Y") + "."
-    if "day" in t_low and "week" in t_low:
-        return "It’s " + datetime.now().strftime("%A") + "."
-    if "month" in t_low:
-        return "We are in " + datetime.now().strftime("%B") + "."
-    if "year" in t_low:
-        return "It’s " + datetime.now().strftime("%Y") + "."
-    return None
+    return ROUTER.route(t, stages=("time_date",))
 
 def joke_quote_intents(t: str) -> Optional[str]:
-    t_low = t.lower()
-    if any(k in t_low for k in ["joke", "funny", "laugh"]):
-        return random.choice(JOKES)
-    if any(k in t_low for k in ["quote", "motivate", "inspire"]):
-        return random.choice(QUOTES)
-    return None
+    return ROUTER.route(t, stages=("joke_quote",))
 
 # Safe calculator
-_ALLOWED_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow)
-_ALLOWED_UNARY = (ast.UAdd, ast.USub)
-
-def _eval_ast(node: ast.AST) -> float:
-    if isinstance(node, ast.Expression):
-        return _eval_ast(node.body)
-    if isinstance(node, ast.BinOp) and isinstance(node.op, _ALLOWED_BINOPS):
-        left = _eval_ast(node.left)
-        right = _eval_ast(node.right)
-        if isinstance(node.op, ast.Div) and right == 0:
-            raise ZeroDivisionError
-        return {
-            ast.Add: lambda a,b: a+b,
-            ast.Sub: lambda a,b: a-b,
-            ast.Mult: lambda a,b: a*b,
-            ast.Div: lambda a,b: a/b,
-            ast.Mod: lambda a,b: a%b,
-            ast.Pow: lambda a,b: a**b,
-        }[type(node.op)](left, right)
-    if isinstance(node, ast.UnaryOp) and isinstance(node.op, _ALLOWED_UNARY):
-        val = _eval_ast(node.operand)
-        return +val if isinstance(node.op, ast.UAdd) else -val
-    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
-        return float(node.value)
-    if hasattr(ast, "Num") and isinstance(node, ast.Num):  # py<3.8
-        return float(node.n)
-    raise ValueError("Unsafe expression")
+# Expressions are parsed once into a flat postfix program (cached in an LRU
+# by expression text) and run on a small stack machine. Numbers are floats,
+# as before. Each multiplication and power is checked up front with
+# logarithms and refused if the result would pass CALC_MAX_LOG10. Anything
+# else that overflows is caught after the fact. Every step is O(1) on
+# floats, so capping input length and program size bounds the work: a
+# hostile message costs microseconds and never a stalled worker.
+CALC_MAX_CHARS = 200
+CALC_MAX_OPS = 200              # at most one op per input character
+CALC_MAX_LOG10 = 308.0          # float range: ~1.8e308
+CALC_CACHE_SIZE = 1024
+
+CALC_TOO_LARGE = "That number is too large for me to calculate."
+CALC_TOO_LONG = "That expression is too long for me to calculate."
+CALC_REFUSALS = frozenset({CALC_TOO_LARGE, CALC_TOO_LONG})
+
+class CalcLimitError(ArithmeticError):
+    """The expression is valid but its result is too large to evaluate."""
+
+class CalcTooLongError(CalcLimitError):
+    """The expression compiles to more than CALC_MAX_OPS steps."""
+
+_PUSH, _NEG, _ADD, _SUB, _MUL, _DIV, _MOD, _POW = range(8)
+_BINOP_CODES = {ast.Add: _ADD, ast.Sub: _SUB, ast.Mult: _MUL, ast.Div: _DIV, ast.Mod: _MOD, ast.Pow: _POW}
+_UNARY_CODES = {ast.UAdd: None, ast.USub: _NEG}
+
+def _emit(node: ast.AST, program: List[Tuple[int, float]]) -> None:
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINOP_CODES:
+        _emit(node.left, program)
+        _emit(node.right, program)
+        program.append((_BINOP_CODES[type(node.op)], 0.0))
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_CODES:
+        _emit(node.operand, program)
+        code = _UNARY_CODES[type(node.op)]
+        if code is not None:
+            program.append((code, 0.0))
+    elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        value = node.value
+        if type(value) is int and value.bit_length() > 1024:
+            raise CalcLimitError  # int → float would overflow
+        program.append((_PUSH, float(value)))
+    else:
+        raise ValueError("Unsafe expression")
+    if len(program) > CALC_MAX_OPS:
+        raise CalcTooLongError
+
+_TOO_LONG_PROGRAM: Tuple[Tuple[int, float], ...] = ((_PUSH, math.nan),)
+
+@lru_cache(maxsize=CALC_CACHE_SIZE)
+def _compile_expression(expr: str) -> Optional[Tuple[Tuple[int, float], ...]]:
+    """Postfix program for `expr`; None if it is not a plain arithmetic
+    expression, _TOO_LONG_PROGRAM if it has too many steps."""
+    try:
+        tree = ast.parse(expr, mode="eval")
+        program: List[Tuple[int, float]] = []
+        _emit(tree.body, program)
+    except CalcTooLongError:
+        return _TOO_LONG_PROGRAM
+    except CalcLimitError:
+        return ((_PUSH, math.inf),)  # evaluates to "too large"
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return None
+    return tuple(program)
+
+def _log10(x: float) -> float:
+    return math.log10(abs(x)) if x else -math.inf
+
+def _check_pow(a: float, b: float) -> None:
+    if a < 0 and b != int(b):
+        raise ValueError("complex result")
+    if a and b * _log10(a) > CALC_MAX_LOG10:
+        raise CalcLimitError
+
+def _run_program(program: Tuple[Tuple[int, float], ...]) -> float:
+    stack: List[float] = []
+    push, pop = stack.append, stack.pop
+    for code, value in program:
+        if code == _PUSH:
+            push(value)
+            continue
+        if code == _NEG:
+            push(-pop())
+            continue
+        b = pop()
+        a = pop()
+        if code == _ADD:
+            r = a + b
+        elif code == _SUB:
+            r = a - b
+        elif code == _MUL:
+            if _log10(a) + _log10(b) > CALC_MAX_LOG10:
+                raise CalcLimitError
+            r = a * b
+        elif code == _DIV:
+            r = a / b
+        elif code == _MOD:
+            r = a % b
+        else:
+            _check_pow(a, b)
+            r = a ** b
+        if not math.isfinite(r):
+            raise CalcLimitError
+        push(r)
+    if len(stack) != 1 or not math.isfinite(stack[0]):
+        raise CalcLimitError
+    return stack[0]
 
 _CALC_TRIGGER = re.compile(r"\b(calculate|calc|compute|evaluate|what\s+is|whats)\b", re.I)
 _EXPR_CAPTURE = re.compile(r"([-+/*%\d\.\(\)\s\^]+)")
 
-def calculator_intent(t: str) -> Optional[str]:
-    if not _CALC_TRIGGER.search(t) and not any(ch.isdigit() for ch in t):
-        return None
+def _calculate(t: str) -> Optional[str]:
     m = _EXPR_CAPTURE.search(t)
     if not m:
         return None
     expr = m.group(1).strip().replace("^", "**")
-    if not re.fullmatch(r"[0-9\.\s\+\-\*\/\%\(\)\*]*", expr):
+    if len(expr) > CALC_MAX_CHARS or not re.fullmatch(r"[0-9\.\s\+\-\*\/\%\(\)\*]*", expr):
+        return None
+    program = _compile_expression(expr)
+    if not program:
         return None
+    if program is _TOO_LONG_PROGRAM:
+        return CALC_TOO_LONG
     try:
-        node = ast.parse(expr, mode="eval")
-        val = _eval_ast(node)
+        val = _run_program(program)
         return f"{expr} = {val:g}"
     except ZeroDivisionError:
         return "Division by zero is not allowed."
-    except Exception:
+    except CalcLimitError:
+        return CALC_TOO_LARGE
+    except (ValueError, OverflowError, IndexError):
+        return None
+
+def calculator_intent(t: str) -> Optional[str]:
+    if not _CALC_TRIGGER.search(t) and not any(ch.isdigit() for ch in t):
         return None
+    return _calculate(t)
 
 # ------------------------------------------------------------
 # Follow‑ups when unknown
@@ -311,45 +555,474 @@ FOLLOWUPS = [
 def followup_question() -> str:
     return random.choice(FOLLOWUPS)
 
+# ------------------------------------------------------------
+# Intent router: every trigger compiled into one scanner
+# ------------------------------------------------------------
+# A rule is (stage, groups, handler). It fires when every group has at least
+# one keyword present in the message; rules are tried in table order and the
+# first handler returning a reply wins. Keywords are plain substrings (same
+# semantics as the old `p in t` checks); gates are regexes that light up a
+# pseudo-keyword of the same name.
+Rule = Tuple[str, Tuple[Tuple[str, ...], ...], Callable[[str], Optional[str]]]
+
+CALC_GATE = "<calc>"
+
+def build_intent_rules(project_qa: Dict[str, Iterable[str]], project_answers: Dict[str, str],
+                       jokes: Iterable[str], quotes: Iterable[str]) -> List[Rule]:
+    """The rule table for one set of content (project Q&A, jokes, quotes)."""
+    rules: List[Rule] = [
+        ("project", (tuple(patterns),), lambda _t, a=project_answers[key]: a)
+        for key, patterns in project_qa.items()
+    ]
+    # Extra flexible catch: “project ...” + common words
+    overview = project_answers.get("about_project", PROJECT_OVERVIEW)
+    rules.append(("project", (("project",), PROJECT_FLEX_WORDS), lambda _t: overview))
+    return rules + [
+        ("time_date", (("utc",), ("time",)), _utc_time_reply),
+        ("time_date", (("time", "clock"),), _time_reply),
+        ("time_date", (("date", "today"),), _date_reply),
+        ("time_date", (("day",), ("week",)), _weekday_reply),
+        ("time_date", (("month",),), _month_reply),
+        ("time_date", (("year",),), _year_reply),
+        ("calculator", ((CALC_GATE,),), _calculate),
+        ("joke_quote", (("joke", "funny", "laugh"),), _choice_reply(tuple(jokes))),
+        ("joke_quote", (("quote", "motivate", "inspire"),), _choice_reply(tuple(quotes))),
+    ]
+
+INTENT_RULES: List[Rule] = build_intent_rules(PROJECT_QA, PROJECT_ANSWERS, JOKES, QUOTES)
+
+INTENT_GATES: Dict[str, str] = {
+    CALC_GATE: r"(?i:" + _CALC_TRIGGER.pattern + r")|\d",
+}
+
+class IntentRouter:
+    """Routes a message to the first matching intent handler in one regex scan.
+
+    All literal keywords go into a single lookahead alternation, longest first,
+    so each match reports the longest keyword starting at that position; the
+    shorter keywords that are prefixes of it are added from a table built here.
+    Those tables can be passed in precomputed (see tables() and chat.kb_loader);
+    they must come from the same rules and gates.
+    """
+
+    def __init__(self, rules: Iterable[Rule], gates: Optional[Dict[str, str]] = None,
+                 tables: Optional[Tuple[Dict[str, Tuple[str, ...]], Dict[str, List[int]], Optional[str]]] = None):
+        self.rules: List[Rule] = list(rules)
+        gates = dict(gates or {})
+        if tables is None:
+            tables = self._build_tables(self.rules, gates)
+        self._prefixes, self._rules_by_keyword, pattern = tables
+        self._gate_names = list(gates)
+        self._gates = [re.compile(p) for p in gates.values()]
+        self._has_keywords = bool(self._prefixes)
+        self._scanner = re.compile(pattern) if pattern is not None else None
+
+    @staticmethod
+    def _build_tables(rules: List[Rule], gates: Dict[str, str]):
+        keywords = {
+            k for _stage, groups, _h in rules for g in groups for k in g
+            if k and k not in gates
+        }
+        prefixes = {
+            k: tuple(k[:i] for i in range(1, len(k) + 1) if k[:i] in keywords)
+            for k in keywords
+        }
+        rules_by_keyword: Dict[str, List[int]] = {}
+        for idx, (_stage, groups, _h) in enumerate(rules):
+            for k in {k for g in groups for k in g}:
+                rules_by_keyword.setdefault(k, []).append(idx)
+        alts = []
+        if keywords:
+            alts.append("(?P<kw>" + "|".join(
+                re.escape(k) for k in sorted(keywords, key=len, reverse=True)) + ")")
+        alts += [f"(?P<g{i}>{p})" for i, p in enumerate(gates.values())]
+        pattern = "(?=" + "|".join(alts) + ")" if alts else None
+        return prefixes, rules_by_keyword, pattern
+
+    def vocabulary(self) -> Set[str]:
+        """The words of every keyword (gates excluded)."""
+        return {w for k in self._prefixes for w in _SPELL_WORD_RE.findall(k)}
+
+    def tables(self):
+        """(prefixes, rules_by_keyword, scanner pattern): everything derived from the rules."""
+        return self._prefixes, self._rules_by_keyword, self._scanner.pattern if self._scanner else None
+
+    def scan(self, text: str) -> Set[str]:
+        """Return every keyword and gate name present in `text`."""
+        hits: Set[str] = set()
+        if self._scanner is None:
+            return hits
+        t = text.lower()
+        for m in self._scanner.finditer(t):
+            kw = m.group("kw") if self._has_keywords else None
+            if kw is None:
+                hits.add(self._gate_names[int(m.lastgroup[1:])])
+                continue
+            hits.update(self._prefixes[kw])
+            # a gate starting at the same position is hidden by the keyword
+            for name, gate in zip(self._gate_names, self._gates):
+                if name not in hits and gate.match(t, m.start()):
+                    hits.add(name)
+        return hits
+
+    def route(self, text: str, stages: Optional[Iterable[str]] = None) -> Optional[str]:
+        return self.resolve(text, stages)[1]
+
+    def resolve(self, text: str, stages: Optional[Iterable[str]] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Like route(), but returns (stage, reply) so callers know who answered."""
+        hits = self.scan(text)
+        wanted = set(stages) if stages is not None else None
+        candidates = sorted({i for k in hits for i in self._rules_by_keyword.get(k, ())})
+        for idx in candidates:
+            stage, groups, handler = self.rules[idx]
+            if wanted is not None and stage not in wanted:
+                continue
+            if all(any(k in hits for k in g) for g in groups):
+                out = handler(text)
+                if out:
+                    return stage, out
+        return None, None
+
+ROUTER = IntentRouter(INTENT_RULES, INTENT_GATES)
+
+# ------------------------------------------------------------
+# Name commands (answered by the views, which own the user's profile)
+# ------------------------------------------------------------
+def extract_name(text: str) -> Optional[str]:
+    m = re.search(r"\b(?:my name is|i am|i'm|call me)\s+([A-Za-z][A-Za-z\s'-]{0,40})\b", text, re.I)
+    if not m:
+        return None
+    name = m.group(1).strip()
+    name = re.sub(r"[^\w\s'-]", "", name).strip()
+    return " ".join(w.capitalize() for w in re.split(r"\s+", name))
+
+def is_asking_name(text: str) -> bool:
+    t = text.lower()
+    return bool(re.search(r"\b(what('?s| is)\s+my\s+name|who\s+am\s+i|do\s+you\s+remember\s+my\s+name)\b", t))
+
+def is_reset(text: str) -> bool:
+    t = text.lower()
+    return any(p in t for p in ["reset", "clear chat", "clear history", "forget my name"])
+
+# ------------------------------------------------------------
+# Greeting (with time‑of‑day; personalized if name known)
+# ------------------------------------------------------------
+GREETING_WORDS: Set[str] = {"hello", "hi", "hey", "yo", "greetings", "good", "morning", "afternoon", "evening"}
+
+def _greeting_reply(utoks: Set[str], name: Optional[str]) -> Optional[str]:
+    if not utoks & GREETING_WORDS:
+        return None
+    hour = datetime.now().hour
+    period = "morning" if 5 <= hour < 12 else "afternoon" if 12 <= hour < 17 else "evening"
+    if name:
+        return f"Good {period}, {name}! How can I help you today?"
+    return f"Good {period}! How can I help you today?"
+
+# ------------------------------------------------------------
+# Spelling correction (SymSpell-style deletion dictionary)
+# ------------------------------------------------------------
+# Every KB question token is stored under each string left after deleting
+# up to SPELL_MAX_DISTANCE letters. A misspelled token generates its own
+# deletes; words sharing one are the only candidates, and the closest by edit
+# distance (transpositions count as one) wins, then the more frequent, then
+# the alphabetically first. The cost per token follows its length, not the
+# vocabulary size. Tokens shorter than SPELL_MIN_LENGTH, with digits, or
+# already known are left alone, and short tokens get one edit only: at two
+# edits most short English words are a "typo" of some keyword ("gear" ->
+# "year", "test" -> "rest"). Router keywords are not correction targets for
+# the same reason. The dictionary is large (about twenty deletes per word),
+# so BotContent builds it on first use, and chat.kb_loader precompiles it
+# into the artifact (kb_mmap.MappedSpellCorrector).
+SPELL_MIN_LENGTH = 5
+SPELL_MAX_DISTANCE = 2
+SPELL_SHORT_LENGTH = 7          # tokens shorter than this allow one edit
+
+_SPELL_WORD_RE = re.compile(r"[a-z0-9]+")
+
+def _deletes(word: str, distance: int) -> Set[str]:
+    out, frontier = {word}, {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, or limit + 1 once it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+def spelling_frequencies(vocabulary: Iterable[Tuple[str, int]]) -> Dict[str, int]:
+    """{word: frequency} for the words worth correcting to; repeated words add up."""
+    frequency: Dict[str, int] = {}
+    for word, count in vocabulary:
+        if word.isalpha():
+            frequency[word] = frequency.get(word, 0) + count
+    return frequency
+
+class SpellCorrector:
+    def __init__(self, vocabulary: Iterable[Tuple[str, int]]):
+        """`vocabulary` is (word, frequency) pairs."""
+        self.frequency = spelling_frequencies(vocabulary)
+        self._candidates: Dict[str, List[str]] = {}
+        for word in self.frequency:
+            for key in _deletes(word, SPELL_MAX_DISTANCE):
+                self._candidates.setdefault(key, []).append(word)
+
+    def _known(self, token: str) -> bool:
+        return token in self.frequency
+
+    def _words_for(self, key: str) -> Iterable[Tuple[str, int]]:
+        """(word, frequency) for the words with `key` among their deletes."""
+        return ((word, self.frequency[word]) for word in self._candidates.get(key, ()))
+
+    def correct(self, token: str) -> str:
+        """The closest known word, or `token` itself."""
+        if (len(token) < SPELL_MIN_LENGTH or not token.isalpha()
+                or token in STOPWORDS or self._known(token)):
+            return token
+        limit = 1 if len(token) < SPELL_SHORT_LENGTH else SPELL_MAX_DISTANCE
+        best, best_key = token, None
+        seen: Set[str] = set()
+        for key in _deletes(token, limit):
+            for word, frequency in self._words_for(key):
+                if word in seen:
+                    continue
+                seen.add(word)
+                d = _edit_distance(token, word, limit)
+                if d <= limit:
+                    rank = (d, -frequency, word)
+                    if best_key is None or rank < best_key:
+                        best, best_key = word, rank
+        return best
+
+    def correct_text(self, text: str) -> Optional[str]:
+        """`text` lowercased with misspelled words fixed, or None if none were."""
+        changed = False
+
+        def fix(m):
+            nonlocal changed
+            word = self.correct(m.group())
+            changed = changed or word != m.group()
+            return word
+
+        fixed = _SPELL_WORD_RE.sub(fix, text.lower())
+        return fixed if changed else None
+
+# ------------------------------------------------------------
+# Content snapshot (swapped as a whole on KB reload)
+# ------------------------------------------------------------
+class BotContent:
+    """One consistent set of bot content with its KB index, matcher and router.
+
+    Replies read CONTENT once and use only that snapshot, so install_content()
+    can swap in new content (chat.kb_loader does on reload) while requests are
+    in flight: each one sees either the old content or the new, never a mix.
+    """
+
+    def __init__(self, kb: Iterable[Tuple[str, str]], project_qa: Dict[str, Iterable[str]],
+                 project_answers: Dict[str, str], jokes: Iterable[str], quotes: Iterable[str],
+                 version: str = "builtin", index=None,
+                 router: Optional[IntentRouter] = None, matcher=None, speller=None):
+        # a Sequence is kept as is: kb_mmap entries must stay in the mapping
+        self.kb: Sequence[Tuple[str, str]] = kb if isinstance(kb, Sequence) else list(kb)
+        self.project_qa = project_qa
+        self.project_answers = project_answers
+        self.jokes: List[str] = list(jokes)
+        self.quotes: List[str] = list(quotes)
+        self.version = version
+        self.index = index if index is not None else KnowledgeIndex(self.kb)
+        self.router = router if router is not None else IntentRouter(
+            build_intent_rules(project_qa, project_answers, self.jokes, self.quotes), INTENT_GATES)
+        self.matcher = matcher if matcher is not None else self.index
+        self._speller = speller
+
+    def spelling_vocabulary(self) -> List[Tuple[str, int]]:
+        """(word, frequency) pairs the speller corrects to: the KB question tokens."""
+        return list(self.index.vocabulary())
+
+    @property
+    def speller(self):
+        # built on the first reply that needs it; two racing builds are harmless
+        if self._speller is None:
+            self._speller = SpellCorrector(self.spelling_vocabulary())
+        return self._speller
+
+    def with_matcher(self, matcher) -> "BotContent":
+        return BotContent(self.kb, self.project_qa, self.project_answers, self.jokes, self.quotes,
+                          self.version, self.index, self.router, matcher, self._speller)
+
+# the literals above; chat.kb_loader falls back to them for missing sections
+BUILTIN_CONTENT = BotContent(KB, PROJECT_QA, PROJECT_ANSWERS, JOKES, QUOTES, index=KB_INDEX, router=ROUTER)
+CONTENT = BUILTIN_CONTENT
+
+def install_content(content: BotContent) -> None:
+    """Make `content` current; the module-level names follow it."""
+    global CONTENT, KB, PROJECT_QA, PROJECT_ANSWERS, JOKES, QUOTES, KB_INDEX, KB_MATCHER, ROUTER
+    # CONTENT first, then clear the cache: a reply that started before the
+    # swap holds the old cache generation and its put() is dropped.
+    CONTENT = content
+    KB, PROJECT_QA, PROJECT_ANSWERS = content.kb, content.project_qa, content.project_answers
+    JOKES, QUOTES = content.jokes, content.quotes
+    KB_INDEX, KB_MATCHER, ROUTER = content.index, content.matcher, content.router
+    REPLY_CACHE.clear()
+
 # ------------------------------------------------------------
 # Main function
 # ------------------------------------------------------------
-def generate_bot_reply(user_text: str, name: Optional[str] = None) -> str:
-    # 0) Project Q&A (long answers)
-    proj = _match_project_q(user_text)
-    if proj:
-        return proj
+# Intents reported with each reply (router stages plus the steps below);
+# analytics counts messages by these.
+GREETING_INTENT = "greeting"
+KB_INTENT = "kb"
+FALLBACK_INTENT = "followup"
 
-    # 1) Real‑time intents
-    out = time_date_intents(user_text)
-    if out:
-        return out
+def bot_reply_with_intent(user_text: str, name: Optional[str] = None) -> Tuple[str, str]:
+    """Return (intent, reply): the reply plus which step produced it.
 
-    out = calculator_intent(user_text)
-    if out:
-        return out
+    Step latencies (the router's under the stage that answered, else
+    "router") and the answering intent are recorded in chat.metrics.
+    """
+    clock = time.perf_counter
+    start = clock()
+    intent, reply = _reply_with_intent(user_text, name, clock, start)
+    BOT_REPLY_SECONDS.observe(clock() - start, intent)
+    return intent, reply
 
-    out = joke_quote_intents(user_text)
+def _reply_with_intent(user_text: str, name: Optional[str], clock, t0: float) -> Tuple[str, str]:
+    # cache generation before content (install_content's order, reversed)
+    cache = REPLY_CACHE
+    generation = cache.generation
+    content = CONTENT
+    cached = cache.get(user_text)
+    t1 = clock()
+    BOT_STAGE_SECONDS.observe(t1 - t0, "cache")
+    if cached is not None:
+        return cached
+
+    # 0) Project Q&A (long answers), then real‑time intents — one scan
+    stage, out = content.router.resolve(user_text)
+    t0 = clock()
+    BOT_STAGE_SECONDS.observe(t0 - t1, stage or "router")
     if out:
-        return out
+        if _cacheable(stage, out):
+            cache.put(user_text, (stage, out), generation=generation)
+        return stage, out
 
-    # 2) Greeting (with time‑of‑day; personalized if name known)
+    # 2) Greeting
     utoks = tokenize(user_text)
-    if utoks & {"hello", "hi", "hey", "yo", "greetings", "good", "morning", "afternoon", "evening"}:
-        hour = datetime.now().hour
-        period = "morning" if 5 <= hour < 12 else "afternoon" if 12 <= hour < 17 else "evening"
-        if name:
-            return f"Good {period}, {name}! How can I help you today?"
-        return f"Good {period}! How can I help you today?"
+    out = _greeting_reply(utoks, name)
+    t1 = clock()
+    BOT_STAGE_SECONDS.observe(t1 - t0, GREETING_INTENT)
+    if out:
+        return GREETING_INTENT, out
 
     # 3) Fuzzy KB match (general tech)
-    best_score, best_answer = 0.0, None
-    for q, a in KB:
-        score = jaccard(utoks, tokenize(q))
-        if score > best_score:
-            best_score, best_answer = score, a
-    if best_score >= 0.22:
-        return best_answer
-
-    # 4) Unknown → ask a question back
-    return followup_question()
\ No newline at end of file
+    answer = content.matcher.best_answer(utoks)
+    t0 = clock()
+    BOT_STAGE_SECONDS.observe(t0 - t1, KB_INTENT)
+    if answer:
+        cache.put(user_text, (KB_INTENT, answer), generation=generation)
+        return KB_INTENT, answer
+
+    # 4) Typos: the steps above again with misspelled words corrected
+    retry = _spelling_retry(content, user_text)
+    t1 = clock()
+    BOT_STAGE_SECONDS.observe(t1 - t0, "spelling")
+    if retry is not None:
+        if _cacheable(*retry):
+            cache.put(user_text, retry, generation=generation)
+        return retry
+
+    # 5) Unknown → ask a question back
+    out = followup_question()
+    BOT_STAGE_SECONDS.observe(clock() - t1, FALLBACK_INTENT)
+    return FALLBACK_INTENT, out
+
+# Router stages retried on corrected text. Corrections only add KB words, so
+# a time/date keyword in the result came from a guess, not from the user.
+SPELLING_RETRY_STAGES = ("project", "calculator", "joke_quote")
+
+def _spelling_retry(content: BotContent, text: str) -> Optional[Tuple[str, str]]:
+    """(intent, reply) for `text` with its typos fixed, or None."""
+    corrected = content.speller.correct_text(text)
+    if corrected is None:
+        return None
+    stage, out = content.router.resolve(corrected, SPELLING_RETRY_STAGES)
+    if out:
+        return stage, out
+    answer = content.matcher.best_answer(tokenize(corrected))
+    return (KB_INTENT, answer) if answer else None
+
+def generate_bot_reply(user_text: str, name: Optional[str] = None) -> str:
+    return bot_reply_with_intent(user_text, name)[1]
+
+def bot_replies_with_intents(texts: Iterable[str], name: Optional[str] = None) -> List[Tuple[str, str]]:
+    """(intent, reply) for many messages at once, same rules as bot_reply_with_intent.
+
+    Repeated texts are tokenized once and every message that reaches the KB
+    step is looked up in a single batch, deduplicated by token set.
+    """
+    start = time.perf_counter()
+    texts = list(texts)
+    replies: List[Optional[Tuple[str, str]]] = [None] * len(texts)
+    token_cache: Dict[str, FrozenSet[str]] = {}
+    pending: Dict[FrozenSet[str], List[int]] = {}
+    cache = REPLY_CACHE
+    generation = cache.generation
+    content = CONTENT
+    for i, text in enumerate(texts):
+        cached = cache.get(text)
+        if cached is not None:
+            replies[i] = cached
+            continue
+        stage, out = content.router.resolve(text)
+        if out:
+            if _cacheable(stage, out):
+                cache.put(text, (stage, out), generation=generation)
+            replies[i] = stage, out
+            continue
+        utoks = token_cache.get(text)
+        if utoks is None:
+            utoks = token_cache[text] = frozenset(tokenize(text))
+        out = _greeting_reply(utoks, name)
+        if out:
+            replies[i] = GREETING_INTENT, out
+            continue
+        pending.setdefault(utoks, []).append(i)
+
+    if pending:
+        keys = list(pending)
+        for key, answer in zip(keys, content.matcher.best_answers(keys)):
+            for i in pending[key]:
+                if answer:
+                    cache.put(texts[i], (KB_INTENT, answer), generation=generation)
+                    replies[i] = KB_INTENT, answer
+                    continue
+                retry = _spelling_retry(content, texts[i])
+                if retry is None:
+                    replies[i] = FALLBACK_INTENT, followup_question()
+                    continue
+                if _cacheable(*retry):
+                    cache.put(texts[i], retry, generation=generation)
+                replies[i] = retry
+    if replies:
+        # batched work has no per-message timing; record the average
+        each = (time.perf_counter() - start) / len(replies)
+        for intent, _ in replies:
+            BOT_REPLY_SECONDS.observe(each, intent)
+    return replies
+
+def generate_bot_replies(texts: Iterable[str], name: Optional[str] = None) -> List[str]:
+    return [reply for _, reply in bot_replies_with_intents(texts, name)]
@@ -0,0 +1,76 @@
+"""Database tuning for the chat app.
+
+* ``apply_sqlite_pragmas`` runs on every new SQLite connection
+  (``connection_created``) and applies ``CHAT_SQLITE_PRAGMAS``: WAL
+  journaling so pollers no longer block the writer, a relaxed fsync policy,
+  a larger page cache, memory-mapped reads and a busy timeout.
+* ``ReadReplicaRouter`` sends reads made inside ``reads_from_replica`` views
+  to the ``CHAT_READ_REPLICA`` alias; everything else uses ``default``.
+"""
+import contextvars
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,       # KiB when negative: ~20 MB
+    "mmap_size": 268435456,     # 256 MB
+    "busy_timeout": 5000,       # ms
+    "temp_store": "MEMORY",
+}
+
+_use_replica = contextvars.ContextVar("chat_use_replica", default=False)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    pragmas = getattr(settings, "CHAT_SQLITE_PRAGMAS", DEFAULT_SQLITE_PRAGMAS)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            try:
+                cursor.execute(f"PRAGMA {name} = {value}")
+            except Exception as exc:
+                # e.g. journal_mode on a read-only or in-memory database
+                log.debug("PRAGMA %s = %s skipped on %s: %s", name, value, connection.alias, exc)
+
+
+def replica_alias():
+    alias = getattr(settings, "CHAT_READ_REPLICA", None)
+    return alias if alias and alias in connections.databases else None
+
+
+def reads_from_replica(view):
+    """Route the ORM reads of an async, read-only view to the replica."""
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        token = _use_replica.set(True)
+        try:
+            return await view(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get():
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
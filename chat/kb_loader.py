@@ -0,0 +1,337 @@
+"""Bot content loaded from files, with a precompiled artifact and hot reload.
+
+``CHAT_KB_SOURCE`` points at a JSON or SQLite file (``.sqlite``, ``.sqlite3``
+or ``.db``) holding any of the sections below; sections it leaves out keep
+the built-in content of chat/bot_logic.py.
+
+* JSON: ``{"version": "...", "kb": [[question, answer], ...],
+  "project_qa": {key: [pattern, ...]}, "project_answers": {key: answer},
+  "jokes": [...], "quotes": [...]}`` (KB items may also be
+  ``{"question": ..., "answer": ...}`` objects).
+* SQLite: tables ``kb(question, answer)``, ``project_qa(key, pattern)``,
+  ``project_answers(key, answer)``, ``jokes(text)``, ``quotes(text)`` and an
+  optional ``meta(key, value)`` with a ``version`` row. Rows are read in
+  rowid order.
+
+``CHAT_KB_ARTIFACT`` is the precompiled form, tagged with the sha256 of the
+source it was built from. It holds a pickled header (project Q&A, jokes,
+quotes and the router's keyword tables), then the KB itself as a
+chat.kb_mmap index, then the spelling corrector's deletion dictionary.
+Workers load it instead of tokenizing the KB and building the router and
+the dictionary again. Both indexes are memory-mapped, not read, so every
+worker on the host shares one copy of them in the page cache. A worker
+that finds the artifact missing or stale builds from the source, writes
+the artifact back and maps it. ``manage.py build_kb`` writes it ahead of
+time. The header is a pickle: only load artifacts you built. Artifacts are
+written to a temporary file and renamed into place, so readers never see a
+partial file, and a mapping of the old file stays valid after the rename.
+
+With ``CHAT_KB_RELOAD_INTERVAL`` set, a daemon thread checks the source and
+artifact (mtime and size) that often. A change is loaded off to the side
+and installed with ``bot_logic.install_content()``, a single reference swap,
+so in-flight replies finish on the content they started with. A file that
+fails to load is logged and the current content stays in place.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import sqlite3
+import tempfile
+import struct
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from . import bot_logic
+from .bot_logic import BotContent, IntentRouter, INTENT_GATES, build_intent_rules, spelling_frequencies
+from .kb_mmap import MappedKnowledgeIndex, MappedSpellCorrector, build_index, build_spell_index
+
+log = logging.getLogger(__name__)
+
+ARTIFACT_MAGIC = b"CHATKB03"
+_ARTIFACT_HEADER = struct.Struct("<8sQ")   # magic, pickled header length
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+SECTIONS = ("kb", "project_qa", "project_answers", "jokes", "quotes")
+SMALL_SECTIONS = SECTIONS[1:]   # pickled; the KB goes in the mapped index
+
+Stamp = Optional[Tuple[int, int]]
+
+
+class KBLoadError(ValueError):
+    """The source or artifact is unreadable or malformed."""
+
+
+def _stamp(path: Optional[str]) -> Stamp:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+# ------------------------------------------------------------
+# Sources
+# ------------------------------------------------------------
+def _read_json(data: bytes) -> dict:
+    try:
+        doc = json.loads(data.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as exc:
+        raise KBLoadError(f"invalid JSON: {exc}") from exc
+    if not isinstance(doc, dict):
+        raise KBLoadError("the JSON source must be an object")
+    kb = doc.get("kb")
+    if isinstance(kb, list):
+        doc["kb"] = [(i["question"], i["answer"]) if isinstance(i, dict) else i for i in kb]
+    return doc
+
+
+def _read_sqlite(path: str) -> dict:
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error as exc:
+        raise KBLoadError(f"cannot open {path}: {exc}") from exc
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        doc: dict = {}
+        if "kb" in tables:
+            doc["kb"] = conn.execute("SELECT question, answer FROM kb ORDER BY rowid").fetchall()
+        if "project_qa" in tables:
+            project_qa: Dict[str, list] = {}
+            for key, pattern in conn.execute("SELECT key, pattern FROM project_qa ORDER BY rowid"):
+                project_qa.setdefault(key, []).append(pattern)
+            doc["project_qa"] = project_qa
+        if "project_answers" in tables:
+            doc["project_answers"] = dict(conn.execute("SELECT key, answer FROM project_answers ORDER BY rowid"))
+        for name in ("jokes", "quotes"):
+            if name in tables:
+                doc[name] = [row[0] for row in conn.execute(f"SELECT text FROM {name} ORDER BY rowid")]
+        if "meta" in tables:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is not None:
+                doc["version"] = row[0]
+        return doc
+    except sqlite3.Error as exc:
+        raise KBLoadError(f"cannot read {path}: {exc}") from exc
+    finally:
+        conn.close()
+
+
+def _strings(value, what: str) -> list:
+    if not isinstance(value, (list, tuple)) or not all(isinstance(v, str) for v in value):
+        raise KBLoadError(f"{what} must be a list of strings")
+    return list(value)
+
+
+def _normalize(doc: dict) -> dict:
+    """Fill missing sections from the built-ins and check the shapes."""
+    builtin = bot_logic.BUILTIN_CONTENT
+    content = {name: doc.get(name, getattr(builtin, name)) for name in SECTIONS}
+    content["jokes"] = _strings(content["jokes"], "jokes")
+    content["quotes"] = _strings(content["quotes"], "quotes")
+    kb = []
+    for item in content["kb"]:
+        if not (isinstance(item, (list, tuple)) and len(item) == 2 and all(isinstance(v, str) for v in item)):
+            raise KBLoadError(f"bad KB entry: {item!r}")
+        kb.append((item[0], item[1]))
+    content["kb"] = kb
+    if not isinstance(content["project_qa"], dict) or not isinstance(content["project_answers"], dict):
+        raise KBLoadError("project_qa and project_answers must be objects")
+    content["project_qa"] = {k: _strings(v, f"project_qa[{k!r}]") for k, v in content["project_qa"].items()}
+    missing = set(content["project_qa"]) - set(content["project_answers"])
+    if missing:
+        raise KBLoadError(f"project_qa keys without an answer: {', '.join(sorted(missing))}")
+    return content
+
+
+def _read_bytes(path: str) -> Tuple[bytes, str]:
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except OSError as exc:
+        raise KBLoadError(f"cannot read {path}: {exc}") from exc
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def _parse_source(path: str, data: bytes, digest: str) -> Tuple[dict, str]:
+    doc = _read_sqlite(path) if path.endswith(SQLITE_SUFFIXES) else _read_json(data)
+    return _normalize(doc), str(doc.get("version") or digest[:12])
+
+
+def read_source(path: str) -> Tuple[dict, str, str]:
+    """(content sections, version, sha256 of the file) for a JSON or SQLite source."""
+    data, digest = _read_bytes(path)
+    return (*_parse_source(path, data, digest), digest)
+
+
+# ------------------------------------------------------------
+# Artifact
+# ------------------------------------------------------------
+def write_artifact(path: str, content: BotContent, source_digest: str) -> None:
+    """Write `content` (freshly built, so its index is a KnowledgeIndex) to `path`."""
+    index = build_index(content.index.entries, content.index.token_sets)
+    spelling = build_spell_index(spelling_frequencies(content.spelling_vocabulary()))
+    header = pickle.dumps({
+        "source_sha256": source_digest,
+        "version": content.version,
+        "content": {name: getattr(content, name) for name in SMALL_SECTIONS},
+        "router": content.router.tables(),
+        "spelling_offset": len(index),   # from the start of the KB index; both are 8-byte aligned
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    start = _ARTIFACT_HEADER.size + len(header)
+    padding = b"\0" * (-start % 8)  # keeps the index arrays aligned in the mapping
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".kb-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(_ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, len(header)))
+            fh.write(header + padding)
+            fh.write(index)
+            fh.write(spelling)
+        os.chmod(tmp, 0o644)  # mkstemp creates it 0600
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def read_artifact(path: str) -> Tuple[BotContent, str]:
+    """(content, sha256 of the source it was built from), with the KB and spelling indexes mapped."""
+    try:
+        with open(path, "rb") as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = _ARTIFACT_HEADER.unpack_from(mapped)
+        if magic != ARTIFACT_MAGIC:
+            raise KBLoadError(f"{path} is not a KB artifact (or was built by an older version)")
+        start = _ARTIFACT_HEADER.size
+        payload = pickle.loads(mapped[start:start + header_len])
+        start += header_len
+        start += -start % 8
+        spelling_start = start + payload["spelling_offset"]
+        index = MappedKnowledgeIndex(memoryview(mapped)[start:spelling_start])
+        speller = MappedSpellCorrector(memoryview(mapped)[spelling_start:])
+        sections = payload["content"]
+    except KBLoadError:
+        raise
+    except Exception as exc:  # empty, truncated or foreign files
+        raise KBLoadError(f"cannot read artifact {path}: {exc!r}") from exc
+    rules = build_intent_rules(sections["project_qa"], sections["project_answers"],
+                               sections["jokes"], sections["quotes"])
+    router = IntentRouter(rules, INTENT_GATES, tables=payload["router"])
+    content = BotContent(index.entries, version=payload["version"], index=index, router=router,
+                         speller=speller, **sections)
+    return content, payload["source_sha256"]
+
+
+# ------------------------------------------------------------
+# Loading
+# ------------------------------------------------------------
+def load(source: Optional[str] = None, artifact: Optional[str] = None) -> Tuple[BotContent, str]:
+    """(content, source sha256) from the artifact when it is current, else the source.
+
+    A rebuilt artifact is written back and mapped when `artifact` is set.
+    """
+    if not source and not artifact:
+        raise KBLoadError("neither a KB source nor an artifact is configured")
+    if not source:
+        return read_artifact(artifact)
+    data, digest = _read_bytes(source)
+    if artifact and os.path.exists(artifact):
+        try:
+            content, built_from = read_artifact(artifact)
+        except KBLoadError as exc:
+            log.warning("ignoring KB artifact: %s", exc)
+        else:
+            if built_from == digest:
+                return content, built_from
+    sections, version = _parse_source(source, data, digest)
+    content = BotContent(version=version, **sections)
+    if artifact:
+        try:
+            write_artifact(artifact, content, digest)
+        except OSError as exc:
+            log.warning("cannot write KB artifact %s: %s", artifact, exc)
+        else:
+            # serve from the shared mapping rather than this private copy
+            return read_artifact(artifact)
+    return content, digest
+
+
+class KBReloader:
+    """Loads the configured content and keeps it current."""
+
+    def __init__(self, source: Optional[str] = None, artifact: Optional[str] = None,
+                 interval: Optional[float] = 5.0,
+                 matcher_factory: Optional[Callable[[BotContent], object]] = None):
+        self.source = str(source) if source else None
+        self.artifact = str(artifact) if artifact else None
+        self.interval = interval
+        self.matcher_factory = matcher_factory
+        self.digest: Optional[str] = None
+        self._stamps: Tuple[Stamp, Stamp] = (None, None)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def reload(self, force: bool = False) -> bool:
+        """Load now; install unless the source digest is unchanged. Raises KBLoadError."""
+        source_stamp = _stamp(self.source)
+        content, digest = load(self.source, self.artifact)
+        # the artifact stamp after load, which may have rewritten it
+        self._stamps = (source_stamp, _stamp(self.artifact))
+        if digest == self.digest and not force:
+            return False
+        if self.matcher_factory is not None:
+            content = content.with_matcher(self.matcher_factory(content))
+        bot_logic.install_content(content)
+        self.digest = digest
+        log.info("KB content %s installed (%d entries)", content.version, len(content.kb))
+        return True
+
+    def check(self) -> bool:
+        """Reload if the source or artifact changed since the last load."""
+        if (_stamp(self.source), _stamp(self.artifact)) == self._stamps:
+            return False
+        try:
+            return self.reload()
+        except Exception as exc:
+            # keep serving the current content; retry on the next change
+            self._stamps = (_stamp(self.source), _stamp(self.artifact))
+            if isinstance(exc, KBLoadError):
+                log.error("KB reload failed, keeping %s: %s", bot_logic.CONTENT.version, exc)
+            else:
+                log.exception("KB reload failed, keeping %s", bot_logic.CONTENT.version)
+            return False
+
+    def start(self) -> None:
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chat-kb-reloader", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+RELOADER: Optional[KBReloader] = None
+
+
+def configure(source: Optional[str], artifact: Optional[str], interval: Optional[float] = 5.0,
+              matcher_factory: Optional[Callable[[BotContent], object]] = None) -> KBReloader:
+    """Load the content now (raising KBLoadError if that fails) and start watching it."""
+    global RELOADER
+    if RELOADER is not None:
+        RELOADER.stop()
+    RELOADER = KBReloader(source, artifact, interval, matcher_factory)
+    RELOADER.reload(force=True)
+    RELOADER.start()
+    return RELOADER
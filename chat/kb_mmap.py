@@ -0,0 +1,310 @@
+"""Flat, read-only KB index that is used in place from a memory-mapped file.
+
+chat.kb_loader appends this index to its artifact and maps it, so every
+worker on a host reads the same page-cache pages instead of holding its
+own copy of the KB. Lookups index straight into the mapped buffer through
+memoryviews. Only the entry that wins is decoded into Python strings.
+
+Layout (little-endian, arrays 8-byte aligned, offsets relative to the
+start of the index):
+
+    header     magic, version, entry/token/slot counts, section offsets
+    slots      u32[n_slots]        open-addressing table: crc32(token) -> token id + 1
+    tok_offs   u32[n_tokens + 1]   token i is tok_blob[tok_offs[i]:tok_offs[i + 1]]
+    tok_blob   UTF-8 tokens, sorted
+    post_offs  u32[n_tokens + 1]   postings of token i
+    postings   u32[...]            entry ids, ascending within each token
+    qlens      u32[n_entries]      size of each question's token set
+    str_offs   u64[2 * n_entries + 1]   question i is string 2i, answer i is 2i + 1
+    str_blob   UTF-8 questions and answers
+
+Scores, thresholds and tie-breaking match bot_logic.KnowledgeIndex.
+
+The spelling corrector's deletion dictionary is mapped the same way
+(build_spell_index / MappedSpellCorrector):
+
+    header       magic, version, word/slot/bucket counts, section offsets
+    word_slots   u32[n_word_slots]   crc32(word) -> word id + 1
+    word_offs    u32[n_words + 1]    word i is word_blob[word_offs[i]:word_offs[i + 1]]
+    word_blob    UTF-8 words, sorted
+    freqs        u32[n_words]
+    bucket_offs  u32[n_buckets + 1]  entries of bucket b
+    bucket_hash  u32[...]            crc32 of the delete
+    bucket_words u32[...]            id of the word it came from
+
+A delete lands in bucket crc32(delete) & (n_buckets - 1). Only its hash is
+stored, not the delete itself: a crc32 collision only adds a candidate, and
+every candidate is checked by edit distance anyway.
+"""
+import heapq
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Sequence
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from .bot_logic import KB_MATCH_THRESHOLD, SPELL_MAX_DISTANCE, KBMatch, SpellCorrector, _deletes
+
+MAGIC = b"CHKBMAP1"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIII9Q")
+SPELL_MAGIC = b"CHSPMAP1"
+SPELL_VERSION = 2
+_SPELL_HEADER = struct.Struct("<8sIIII8Q")
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _le(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _slots_for(n: int) -> int:
+    slots = 8
+    while slots < 2 * n:
+        slots *= 2
+    return slots
+
+
+def _pack(header: struct.Struct, prefix: tuple, sections: List[bytes]) -> bytes:
+    offsets, pos = [], _align(header.size)
+    for data in sections:
+        offsets.append(pos)
+        pos = _align(pos + len(data))
+    out = bytearray(pos)
+    out[:header.size] = header.pack(*prefix, *offsets, pos)
+    for offset, data in zip(offsets, sections):
+        out[offset:offset + len(data)] = data
+    return bytes(out)
+
+
+def _string_table(strings: List[str], n_slots: int) -> Tuple[array, array, bytearray]:
+    """(crc32 slots, offsets, blob) for looking strings up by their UTF-8 bytes."""
+    slots = array("I", bytes(4 * n_slots))
+    offs, blob = array("I", [0]), bytearray()
+    for i, text in enumerate(strings):
+        key = text.encode("utf-8")
+        blob += key
+        offs.append(len(blob))
+        slot = zlib.crc32(key) & (n_slots - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = i + 1
+    return slots, offs, blob
+
+
+def _lookup(key: bytes, slots, offs, blob, mask: int) -> int:
+    """Id of `key` in a _string_table, or -1."""
+    slot = zlib.crc32(key) & mask
+    while True:
+        sid = slots[slot] - 1
+        if sid < 0:
+            return -1
+        if blob[offs[sid]:offs[sid + 1]] == key:
+            return sid
+        slot = (slot + 1) & mask
+
+
+def build_index(entries: Iterable[Tuple[str, str]], token_sets: Iterable[FrozenSet[str]]) -> bytes:
+    """Serialize entries and their question token sets (as KnowledgeIndex builds them)."""
+    entries = list(entries)
+    token_sets = list(token_sets)
+    tokens = sorted({t for toks in token_sets for t in toks})
+    ids = {t: i for i, t in enumerate(tokens)}
+    postings: List[List[int]] = [[] for _ in tokens]
+    for idx, toks in enumerate(token_sets):
+        for tok in toks:
+            postings[ids[tok]].append(idx)
+
+    n_slots = _slots_for(len(tokens))
+    slots, tok_offs, tok_blob = _string_table(tokens, n_slots)
+    post_offs, flat = array("I", [0]), array("I")
+    for ids_ in postings:
+        flat.extend(ids_)
+        post_offs.append(len(flat))
+    qlens = array("I", [len(toks) for toks in token_sets])
+    str_offs, str_blob = array("Q", [0]), bytearray()
+    for question, answer in entries:
+        for text in (question, answer):
+            str_blob += text.encode("utf-8")
+            str_offs.append(len(str_blob))
+
+    sections = [_le(slots), _le(tok_offs), bytes(tok_blob), _le(post_offs), _le(flat),
+                _le(qlens), _le(str_offs), bytes(str_blob)]
+    return _pack(_HEADER, (MAGIC, VERSION, len(entries), len(tokens), n_slots), sections)
+
+
+class MappedEntries(Sequence):
+    """The (question, answer) pairs of a MappedKnowledgeIndex, decoded on access."""
+
+    def __init__(self, index: "MappedKnowledgeIndex"):
+        self._index = index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._index.entry(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._index.entry(i)
+
+
+class MappedKnowledgeIndex:
+    """KnowledgeIndex over a buffer written by build_index (an mmap, or bytes).
+
+    Holds memoryviews into `buffer`, so the buffer must outlive the index;
+    nothing is copied at open time.
+    """
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size:
+            raise ValueError("KB index is truncated")
+        (magic, version, self._n_entries, n_tokens, n_slots, slots, tok_offs, tok_blob, post_offs,
+         postings, qlens, str_offs, str_blob, end) = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a version {VERSION} KB index")
+        if len(view) < end:
+            raise ValueError("KB index is truncated")
+        if sys.byteorder != "little":
+            raise ValueError("mapped KB indexes need a little-endian host")
+        self._mask = n_slots - 1
+        self._slots = view[slots:slots + 4 * n_slots].cast("I")
+        self._tok_offs = view[tok_offs:tok_offs + 4 * (n_tokens + 1)].cast("I")
+        self._tok_blob = view[tok_blob:post_offs]
+        self._post_offs = view[post_offs:post_offs + 4 * (n_tokens + 1)].cast("I")
+        self._postings = view[postings:postings + 4 * self._post_offs[n_tokens]].cast("I")
+        self._qlens = view[qlens:qlens + 4 * self._n_entries].cast("I")
+        self._str_offs = view[str_offs:str_offs + 8 * (2 * self._n_entries + 1)].cast("Q")
+        self._str_blob = view[str_blob:end]
+        self.entries = MappedEntries(self)
+
+    def __len__(self) -> int:
+        return self._n_entries
+
+    def _string(self, i: int) -> str:
+        return str(self._str_blob[self._str_offs[i]:self._str_offs[i + 1]], "utf-8")
+
+    def entry(self, idx: int) -> Tuple[str, str]:
+        return self._string(2 * idx), self._string(2 * idx + 1)
+
+    def vocabulary(self) -> Iterable[Tuple[str, int]]:
+        """(token, number of questions containing it), read from the mapping."""
+        tok_offs, post_offs = self._tok_offs, self._post_offs
+        for tid in range(len(tok_offs) - 1):
+            yield str(self._tok_blob[tok_offs[tid]:tok_offs[tid + 1]], "utf-8"), post_offs[tid + 1] - post_offs[tid]
+
+    def _token_id(self, tok: str) -> int:
+        return _lookup(tok.encode("utf-8"), self._slots, self._tok_offs, self._tok_blob, self._mask)
+
+    def search(self, tokens: Set[str], k: int = 1) -> List[KBMatch]:
+        """Top-k entries by Jaccard score; ties keep KB order."""
+        overlap: Dict[int, int] = {}
+        post_offs, postings = self._post_offs, self._postings
+        for tok in tokens:
+            tid = self._token_id(tok)
+            if tid < 0:
+                continue
+            for idx in postings[post_offs[tid]:post_offs[tid + 1]]:
+                overlap[idx] = overlap.get(idx, 0) + 1
+        if not overlap:
+            return []
+        qlen, qlens = len(tokens), self._qlens
+        scored = [
+            (inter / (qlen + qlens[idx] - inter), idx)
+            for idx, inter in overlap.items()
+        ]
+        best = heapq.nsmallest(k, scored, key=lambda p: (-p[0], p[1]))
+        return [KBMatch(score, *self.entry(idx)) for score, idx in best]
+
+    def best_answer(self, tokens: Set[str], threshold: float = KB_MATCH_THRESHOLD) -> Optional[str]:
+        top = self.search(tokens, k=1)
+        if top and top[0].score >= threshold:
+            return top[0].answer
+        return None
+
+    def best_answers(self, token_sets: Iterable[Set[str]], threshold: float = KB_MATCH_THRESHOLD) -> List[Optional[str]]:
+        return [self.best_answer(toks, threshold) for toks in token_sets]
+
+
+def build_spell_index(frequency: Dict[str, int]) -> bytes:
+    """Serialize a spelling dictionary ({word: frequency}, as spelling_frequencies builds it)."""
+    words = sorted(frequency)
+    n_slots = _slots_for(len(words))
+    slots, word_offs, word_blob = _string_table(words, n_slots)
+    freqs = array("I", [min(frequency[w], 0xFFFFFFFF) for w in words])
+    # at most 1 + n + n(n - 1)/2 deletes per word: size the buckets up front
+    n_buckets = _slots_for(sum(1 + len(w) + len(w) * (len(w) - 1) // 2 for w in words) // 2)
+    mask = n_buckets - 1
+    pairs = array("Q")   # crc32(delete) << 32 | word id
+    counts = array("I", bytes(4 * n_buckets))
+    for wid, word in enumerate(words):
+        for h in {zlib.crc32(d.encode("utf-8")) for d in _deletes(word, SPELL_MAX_DISTANCE)}:
+            pairs.append(h << 32 | wid)
+            counts[h & mask] += 1
+    bucket_offs = array("I", [0]) * (n_buckets + 1)
+    for b in range(n_buckets):
+        bucket_offs[b + 1] = bucket_offs[b] + counts[b]
+    fill = array("I", bucket_offs[:-1])
+    bucket_hash = array("I", bytes(4 * len(pairs)))
+    bucket_words = array("I", bytes(4 * len(pairs)))
+    for pair in pairs:
+        h = pair >> 32
+        i = fill[h & mask]
+        bucket_hash[i], bucket_words[i] = h, pair & 0xFFFFFFFF
+        fill[h & mask] = i + 1
+    sections = [_le(slots), _le(word_offs), bytes(word_blob), _le(freqs), _le(bucket_offs),
+                _le(bucket_hash), _le(bucket_words)]
+    return _pack(_SPELL_HEADER, (SPELL_MAGIC, SPELL_VERSION, len(words), n_slots, n_buckets), sections)
+
+
+class MappedSpellCorrector(SpellCorrector):
+    """SpellCorrector over a buffer written by build_spell_index; builds nothing."""
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if len(view) < _SPELL_HEADER.size:
+            raise ValueError("spelling index is truncated")
+        (magic, version, n_words, n_slots, n_buckets, slots, word_offs, word_blob, freqs,
+         bucket_offs, bucket_hash, bucket_words, end) = _SPELL_HEADER.unpack_from(view)
+        if magic != SPELL_MAGIC or version != SPELL_VERSION:
+            raise ValueError(f"not a version {SPELL_VERSION} spelling index")
+        if len(view) < end:
+            raise ValueError("spelling index is truncated")
+        if sys.byteorder != "little":
+            raise ValueError("mapped spelling indexes need a little-endian host")
+        self._mask = n_slots - 1
+        self._bucket_mask = n_buckets - 1
+        self._slots = view[slots:slots + 4 * n_slots].cast("I")
+        self._word_offs = view[word_offs:word_offs + 4 * (n_words + 1)].cast("I")
+        self._word_blob = view[word_blob:freqs]
+        self._freqs = view[freqs:freqs + 4 * n_words].cast("I")
+        self._bucket_offs = view[bucket_offs:bucket_offs + 4 * (n_buckets + 1)].cast("I")
+        n_entries = self._bucket_offs[n_buckets]
+        self._bucket_hash = view[bucket_hash:bucket_hash + 4 * n_entries].cast("I")
+        self._bucket_words = view[bucket_words:bucket_words + 4 * n_entries].cast("I")
+
+    def __len__(self) -> int:
+        return len(self._freqs)
+
+    def _known(self, token: str) -> bool:
+        return _lookup(token.encode("utf-8"), self._slots, self._word_offs, self._word_blob, self._mask) >= 0
+
+    def _words_for(self, key: str) -> Iterable[Tuple[str, int]]:
+        h = zlib.crc32(key.encode("utf-8"))
+        bucket = h & self._bucket_mask
+        offs, hashes, wids = self._word_offs, self._bucket_hash, self._bucket_words
+        for i in range(self._bucket_offs[bucket], self._bucket_offs[bucket + 1]):
+            if hashes[i] == h:
+                wid = wids[i]
+                yield str(self._word_blob[offs[wid]:offs[wid + 1]], "utf-8"), self._freqs[wid]
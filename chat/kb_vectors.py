@@ -0,0 +1,171 @@
+"""Dense-vector KB matcher (optional, needs NumPy).
+
+KB questions become hashed TF-IDF vectors: every token maps to a fixed
+pseudo-random direction derived from its hash, weighted by IDF, so no
+vocabulary has to be shipped and nothing is fetched from the network.
+Optionally the matrix is reduced with a truncated SVD (LSA) so questions
+that share co-occurring words land close together. Queries are scored with
+matrix products against one float32 matrix; large KBs go through
+random-projection LSH buckets first so only candidate rows are scored.
+
+Enable with ``CHAT_KB_ENGINE = "vector"`` in settings; it has the same
+``search`` / ``best_answer`` interface as ``bot_logic.KnowledgeIndex``.
+"""
+import hashlib
+import math
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .bot_logic import KBMatch, tokenize
+
+VECTOR_MATCH_THRESHOLD = 0.35
+
+
+@lru_cache(maxsize=65536)
+def _token_direction(token: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    vec /= np.linalg.norm(vec) or 1.0
+    vec.setflags(write=False)
+    return vec
+
+
+class VectorKnowledgeIndex:
+    def __init__(
+        self,
+        entries: Iterable[Tuple[str, str]],
+        dim: int = 256,
+        lsa_rank: Optional[int] = None,
+        lsh_tables: int = 4,
+        lsh_bits: int = 12,
+        lsh_min_rows: int = 4096,
+        seed: int = 0,
+        threshold: float = VECTOR_MATCH_THRESHOLD,
+    ):
+        self.entries: List[Tuple[str, str]] = list(entries)
+        self.dim = dim
+        self.threshold = threshold
+        token_sets: List[FrozenSet[str]] = [frozenset(tokenize(q)) for q, _ in self.entries]
+        n = len(self.entries)
+
+        df: Dict[str, int] = {}
+        for toks in token_sets:
+            for tok in toks:
+                df[tok] = df.get(tok, 0) + 1
+        # smoothed IDF; unseen query tokens get the maximum weight
+        self._idf: Dict[str, float] = {t: math.log((1 + n) / (1 + c)) + 1.0 for t, c in df.items()}
+        self._idf_unseen = math.log(1 + n) + 1.0
+
+        vocab = sorted(df)
+        col = {t: i for i, t in enumerate(vocab)}
+        directions = np.stack([_token_direction(t, dim) for t in vocab]) if vocab else np.zeros((0, dim), np.float32)
+        rows = np.fromiter((r for r, toks in enumerate(token_sets) for _ in toks), dtype=np.int64)
+        cols = np.fromiter((col[t] for toks in token_sets for t in toks), dtype=np.int64)
+        weights = np.array([self._idf[vocab[c]] for c in cols], dtype=np.float32)
+        matrix = np.zeros((n, dim), dtype=np.float32)
+        if len(rows):
+            np.add.at(matrix, rows, directions[cols] * weights[:, None])
+
+        self._projection: Optional[np.ndarray] = None
+        if lsa_rank and n:
+            _u, _s, vt = np.linalg.svd(matrix, full_matrices=False)
+            self._projection = np.ascontiguousarray(vt[:lsa_rank].T)
+            matrix = matrix @ self._projection
+        self.matrix = self._normalize(matrix)
+
+        self._planes: Optional[np.ndarray] = None
+        self._buckets: List[Dict[int, np.ndarray]] = []
+        if n >= lsh_min_rows and lsh_tables > 0 and lsh_bits > 0:
+            rng = np.random.default_rng(seed)
+            self._lsh_tables, self._lsh_bits = lsh_tables, lsh_bits
+            self._planes = rng.standard_normal((self.matrix.shape[1], lsh_tables * lsh_bits)).astype(np.float32)
+            codes = self._codes(self.matrix)
+            for t in range(lsh_tables):
+                order = np.argsort(codes[:, t], kind="stable")
+                keys, starts = np.unique(codes[order, t], return_index=True)
+                self._buckets.append(dict(zip(keys.tolist(), np.split(order, starts[1:]))))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _normalize(m: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(m, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (m / norms).astype(np.float32)
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        bits = (vectors @ self._planes > 0).reshape(len(vectors), self._lsh_tables, self._lsh_bits)
+        return bits.astype(np.int64) @ (1 << np.arange(self._lsh_bits, dtype=np.int64))
+
+    def embed(self, token_sets: Sequence[Set[str]]) -> np.ndarray:
+        out = np.zeros((len(token_sets), self.dim), dtype=np.float32)
+        for i, toks in enumerate(token_sets):
+            for tok in toks:
+                out[i] += self._idf.get(tok, self._idf_unseen) * _token_direction(tok, self.dim)
+        if self._projection is not None:
+            out = out @ self._projection
+        return self._normalize(out)
+
+    def _candidates(self, code_row: np.ndarray) -> np.ndarray:
+        # multi-probe: the query's bucket plus every bucket one bit away
+        found = []
+        for t, buckets in enumerate(self._buckets):
+            code = int(code_row[t])
+            for probe in [code] + [code ^ (1 << b) for b in range(self._lsh_bits)]:
+                rows = buckets.get(probe)
+                if rows is not None:
+                    found.append(rows)
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def _top(self, scores: np.ndarray, rows: Optional[np.ndarray], k: int) -> List[KBMatch]:
+        if not len(scores):
+            return []
+        if k < len(scores):
+            keep = np.argpartition(-scores, k - 1)[:k]
+        else:
+            keep = np.arange(len(scores))
+        idx = keep if rows is None else rows[keep]
+        order = np.lexsort((idx, -scores[keep]))
+        return [
+            KBMatch(float(scores[keep[o]]), *self.entries[int(idx[o])])
+            for o in order if scores[keep[o]] > 0
+        ]
+
+    def search_many(self, token_sets: Sequence[Set[str]], k: int = 1) -> List[List[KBMatch]]:
+        """Top-k matches for each token set, scored in one batch."""
+        if not self.entries or not token_sets:
+            return [[] for _ in token_sets]
+        queries = self.embed(token_sets)
+        if self._planes is None:
+            scores = queries @ self.matrix.T
+            return [self._top(scores[i], None, k) for i in range(len(token_sets))]
+        codes = self._codes(queries)
+        out = []
+        for i in range(len(token_sets)):
+            rows = self._candidates(codes[i])
+            out.append(self._top(self.matrix[rows] @ queries[i], rows, k))
+        return out
+
+    def search(self, tokens: Set[str], k: int = 1) -> List[KBMatch]:
+        if not tokens:
+            return []
+        return self.search_many([tokens], k)[0]
+
+    def best_answer(self, tokens: Set[str], threshold: Optional[float] = None) -> Optional[str]:
+        top = self.search(tokens, k=1)
+        if top and top[0].score >= (self.threshold if threshold is None else threshold):
+            return top[0].answer
+        return None
+
+    def best_answers(self, token_sets: Sequence[Set[str]], threshold: Optional[float] = None) -> List[Optional[str]]:
+        cut = self.threshold if threshold is None else threshold
+        token_sets = list(token_sets)
+        out: List[Optional[str]] = [None] * len(token_sets)
+        live = [i for i, toks in enumerate(token_sets) if toks]
+        for i, top in zip(live, self.search_many([token_sets[i] for i in live], k=1)):
+            if top and top[0].score >= cut:
+                out[i] = top[0].answer
+        return out
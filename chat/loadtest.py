@@ -0,0 +1,297 @@
+"""Simulated chat users for `manage.py chat_loadtest`.
+
+Each user is two asyncio tasks over keep-alive HTTP/1.1 connections (stdlib
+only, no client library): a poller that follows app.js exactly (1 s after
+start, then x1.7 after an empty poll, x2 after an error, capped at 15 s,
+back to 1 s when messages arrive or the user sends, at least Retry-After
+after a 429, If-None-Match with the last ETag, X-Poll-Token from the
+chat page) and a sender that posts a message from the configured mix every
+`send_interval` seconds on average. Before that a user registers (or logs
+in if the account exists), opens the chat page for the CSRF cookie and
+loads history.
+"""
+import asyncio
+import json
+import random
+import re
+import ssl
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+from .benchmarks import synthetic_message, summarize
+
+MIN_DELAY = 1.0      # app.js MIN_DELAY / MAX_DELAY, in seconds
+MAX_DELAY = 15.0
+EMPTY_BACKOFF = 1.7
+ERROR_BACKOFF = 2.0
+POLL_TOKEN_RE = re.compile(rb'name="chat-poll-token" content="([^"]*)"')
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Response:
+    def __init__(self, status: int, headers: Dict[str, List[str]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def header(self, name: str) -> Optional[str]:
+        values = self.headers.get(name.lower())
+        return values[-1] if values else None
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection with a shared cookie jar."""
+
+    def __init__(self, base_url: str, cookies: Dict[str, str], timeout: float = 30.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.host_header = parts.netloc
+        self.cookies = cookies
+        self.timeout = timeout
+        self._reader = self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: Optional[Dict[str, str]] = None) -> Response:
+        try:
+            return await asyncio.wait_for(self._request(method, path, body, headers or {}), self.timeout)
+        except BaseException:
+            # the stream may be mid-response; never reuse it
+            await self.close()
+            raise
+
+    async def _request(self, method, path, body, headers) -> Response:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host_header}", "Connection: keep-alive",
+                 f"Content-Length: {len(body)}"]
+        if self.cookies:
+            lines.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookies.items()))
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise HTTPError("connection closed")
+        status = int(status_line.split()[1])
+        response_headers: Dict[str, List[str]] = defaultdict(list)
+        while True:
+            line = (await self._reader.readline()).decode("latin-1").rstrip("\r\n")
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            response_headers[name.strip().lower()].append(value.strip())
+
+        if response_headers.get("transfer-encoding", [""])[-1].lower() == "chunked":
+            data = await self._read_chunked()
+        elif "content-length" in response_headers:
+            data = await self._reader.readexactly(int(response_headers["content-length"][-1]))
+        elif status in (204, 304) or method == "HEAD":
+            data = b""
+        else:
+            data = await self._reader.read()
+            await self.close()
+        for value in response_headers.get("set-cookie", ()):
+            for name, morsel in SimpleCookie(value).items():
+                self.cookies[name] = morsel.value
+        if response_headers.get("connection", [""])[-1].lower() == "close":
+            await self.close()
+        return Response(status, response_headers, data)
+
+    async def _read_chunked(self) -> bytes:
+        parts = []
+        while True:
+            size = int((await self._reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(parts)
+            parts.append(await self._reader.readexactly(size))
+            await self._reader.readexactly(2)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.crashed_users = 0
+
+    def record(self, endpoint: str, seconds: float, status: Optional[int], ok: bool):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status if status is not None else 0] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            summary = summarize(samples, len(samples))
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "throughput": len(samples) / elapsed,
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / len(samples),
+                "p50": summary["median"], "p95": summary["p95"], "p99": summary["p99"],
+                "mean": summary["mean"], "max": max(samples),
+                "statuses": dict(self.statuses[endpoint]),
+            }
+        total = sum(len(s) for s in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {"elapsed": elapsed, "requests": total, "throughput": total / elapsed if elapsed else 0.0,
+                "errors": errors, "error_rate": errors / total if total else 0.0,
+                "crashed_users": self.crashed_users, "endpoints": endpoints}
+
+
+class SimulatedUser:
+    def __init__(self, index: int, options: dict, stats: Stats, deadline: float):
+        self.username = f"{options['prefix']}{index:0{6 - len(options['prefix'])}d}"
+        self.options = options
+        self.stats = stats
+        self.deadline = deadline
+        self.rng = random.Random(options["seed"] * 100003 + index)
+        self.cookies: Dict[str, str] = {}
+        self.last_id = 0
+        self.etag: Optional[str] = None
+        self.poll_token: Optional[str] = None
+        self.next_delay = options["min_delay"]
+
+    def _connection(self) -> Connection:
+        return Connection(self.options["url"], self.cookies, self.options["timeout"])
+
+    async def call(self, conn: Connection, endpoint: str, method: str, path: str, body: bytes = b"",
+                   headers: Optional[Dict[str, str]] = None, ok_statuses=(200,)) -> Optional[Response]:
+        start = time.perf_counter()
+        try:
+            response = await conn.request(method, path, body, headers)
+        except (OSError, asyncio.TimeoutError, HTTPError, ValueError) as exc:
+            self.stats.record(endpoint, time.perf_counter() - start, None, False)
+            if self.options["verbose"]:
+                print(f"{self.username} {endpoint}: {exc!r}")
+            return None
+        ok = response.status in ok_statuses
+        self.stats.record(endpoint, time.perf_counter() - start, response.status, ok)
+        return response if ok else None
+
+    async def run(self):
+        conn = self._connection()
+        try:
+            if not await self.sign_in(conn):
+                return
+            history = await self.poll_call(conn, "history", "/api/history")
+            if history is not None:
+                self.last_id = max([m["id"] for m in history.json().get("messages", [])] or [0])
+            await asyncio.gather(self.poll_loop(conn), self.send_loop())
+        finally:
+            await conn.close()
+
+    async def poll_call(self, conn: Connection, endpoint: str, path: str,
+                        headers: Optional[Dict[str, str]] = None, ok_statuses=(200,)) -> Optional[Response]:
+        """GET with the poll token, picking up the fresh one the server may send back."""
+        if self.poll_token:
+            headers = {**(headers or {}), "X-Poll-Token": self.poll_token}
+        response = await self.call(conn, endpoint, "GET", path, b"", headers, ok_statuses)
+        if response is not None:
+            self.poll_token = response.header("x-poll-token") or self.poll_token
+        return response
+
+    async def sign_in(self, conn: Connection) -> bool:
+        password = self.options["password"]
+        form = {"username": self.username, "password": password}
+        form_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        if self.options["register"]:
+            await self.call(conn, "register", "POST", "/register/", urlencode({
+                **form, "first_name": "Load", "last_name": "Test", "email": f"{self.username}@example.com",
+                "password1": password, "password2": password,
+            }).encode(), form_headers, ok_statuses=(200, 302))
+        login = await self.call(conn, "login", "POST", "/login/", urlencode(form).encode(), form_headers,
+                                ok_statuses=(302,))
+        if login is None or "sessionid" not in self.cookies:
+            return False
+        index = await self.call(conn, "index", "GET", "/")
+        if index is None or "csrftoken" not in self.cookies:
+            return False
+        match = POLL_TOKEN_RE.search(index.body)
+        self.poll_token = match.group(1).decode() if match else None
+        return True
+
+    async def _sleep(self, seconds: float) -> bool:
+        remaining = self.deadline - time.monotonic()
+        await asyncio.sleep(max(0.0, min(seconds, remaining)))
+        return time.monotonic() < self.deadline
+
+    async def poll_loop(self, conn: Connection):
+        opts = self.options
+        while await self._sleep(self.next_delay):
+            headers = {"If-None-Match": self.etag} if self.etag else {}
+            response = await self.poll_call(conn, "messages", f"/api/messages?after={self.last_id}",
+                                            headers, ok_statuses=(200, 304, 429))
+            if response is None:
+                self.next_delay = min(opts["max_delay"], self.next_delay * ERROR_BACKOFF)
+                continue
+            if response.status == 429:
+                # like app.js: wait as long as Retry-After asks
+                self.next_delay = max(self.next_delay, float(response.header("retry-after") or opts["min_delay"]))
+                continue
+            messages = response.json().get("messages", []) if response.status == 200 else []
+            self.etag = response.header("etag") or self.etag
+            if messages:
+                self.last_id = max(self.last_id, max(m["id"] for m in messages))
+                self.next_delay = opts["min_delay"]
+            else:
+                self.next_delay = min(opts["max_delay"], self.next_delay * EMPTY_BACKOFF)
+
+    async def send_loop(self):
+        opts = self.options
+        if opts["send_interval"] <= 0:
+            return
+        conn = self._connection()
+        kinds, weights = list(opts["mix"]), list(opts["mix"].values())
+        try:
+            while await self._sleep(self.rng.expovariate(1.0 / opts["send_interval"])):
+                text = synthetic_message(self.rng, self.rng.choices(kinds, weights)[0])
+                self.next_delay = opts["min_delay"]
+                response = await self.call(conn, "send", "POST", "/api/send", json.dumps({"message": text}).encode(), {
+                    "Content-Type": "application/json", "X-CSRFToken": self.cookies.get("csrftoken", ""),
+                    "Referer": opts["url"].rstrip("/") + "/",
+                })
+                if response is not None:
+                    self.last_id = max(self.last_id, response.json()["bot_message"]["id"])
+        finally:
+            await conn.close()
+
+
+async def run_load(options: dict) -> dict:
+    """Run options['users'] simulated users for options['duration'] seconds."""
+    stats = Stats()
+    start = time.monotonic()
+    deadline = start + options["ramp_up"] + options["duration"]
+
+    async def user(i):
+        if options["ramp_up"]:
+            await asyncio.sleep(options["ramp_up"] * i / options["users"])
+        try:
+            await SimulatedUser(i, options, stats, deadline).run()
+        except Exception as exc:  # e.g. a malformed response body
+            stats.crashed_users += 1
+            if options["verbose"]:
+                print(f"user {i} stopped: {exc!r}")
+
+    await asyncio.gather(*(user(i) for i in range(options["users"])))
+    return stats.report(time.monotonic() - start)
@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from chat.models import ArchivedMessage, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Move old messages from chat_message into chat_archivedmessage in "
+        "id-ordered chunks, one short transaction per chunk. Safe to stop and "
+        "re-run: progress lives in the tables themselves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, help="Archive messages older than N days.")
+        parser.add_argument("--keep-per-user", type=int, help="Keep only each user's newest N messages hot.")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--pause", type=float, default=0.0,
+                            help="Seconds to sleep between chunks to leave room for live traffic.")
+        parser.add_argument("--dry-run", action="store_true", help="Count what would move, change nothing.")
+
+    def handle(self, *args, **opts):
+        days, keep = opts["older_than_days"], opts["keep_per_user"]
+        if days is None and keep is None:
+            raise CommandError("Give --older-than-days and/or --keep-per-user.")
+        if opts["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        self.chunk_size, self.pause, self.dry_run = opts["chunk_size"], opts["pause"], opts["dry_run"]
+        self.verbosity = opts["verbosity"]
+
+        moved = 0
+        if days is not None:
+            cutoff = timezone.now() - timedelta(days=days)
+            moved += self._archive(Message.objects.filter(created_at__lt=cutoff))
+        if keep is not None:
+            for user_id in User.objects.order_by("id").values_list("id", flat=True).iterator():
+                newest = (Message.objects.filter(user_id=user_id).order_by("-id")
+                          .values_list("id", flat=True)[keep:keep + 1])
+                boundary = next(iter(newest), None)
+                if boundary is not None:
+                    moved += self._archive(Message.objects.filter(user_id=user_id, id__lte=boundary))
+
+        verb = "Would archive" if self.dry_run else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} messages."))
+
+    def _archive(self, qs) -> int:
+        moved, last_id = 0, 0
+        fields = ("id", "user_id", "sender", "message", "created_at")
+        while True:
+            with transaction.atomic():
+                rows = list(qs.filter(id__gt=last_id).order_by("id").values_list(*fields)[:self.chunk_size])
+                if not rows:
+                    return moved
+                last_id = rows[-1][0]
+                if not self.dry_run:
+                    ArchivedMessage.objects.bulk_create(
+                        [ArchivedMessage(**dict(zip(fields, r))) for r in rows], ignore_conflicts=True)
+                    Message.objects.filter(id__in=[r[0] for r in rows]).delete()
+            moved += len(rows)
+            if self.verbosity >= 2:
+                self.stdout.write(f"  moved up to id {last_id} ({moved})")
+            if self.pause:
+                time.sleep(self.pause)
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.bot_logic import BotContent
+from chat.kb_loader import KBLoadError, read_source, write_artifact
+
+
+class Command(BaseCommand):
+    help = "Compile a JSON or SQLite KB source into the precompiled artifact workers load (and hot-reload)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", nargs="?", help="KB source file (default: settings.CHAT_KB_SOURCE).")
+        parser.add_argument("--output", help="Artifact path (default: settings.CHAT_KB_ARTIFACT).")
+
+    def handle(self, *args, **opts):
+        source = opts["source"] or getattr(settings, "CHAT_KB_SOURCE", None)
+        output = opts["output"] or getattr(settings, "CHAT_KB_ARTIFACT", None)
+        if not source or not output:
+            raise CommandError("Give a source and --output, or set CHAT_KB_SOURCE and CHAT_KB_ARTIFACT.")
+        start = time.perf_counter()
+        try:
+            sections, version, digest = read_source(str(source))
+        except KBLoadError as exc:
+            raise CommandError(str(exc)) from exc
+        content = BotContent(version=version, **sections)
+        write_artifact(str(output), content, digest)
+        self.stdout.write(self.style.SUCCESS(
+            f"KB {version}: {len(content.kb)} entries, {len(content.project_qa)} project topics, "
+            f"{len(content.jokes)} jokes, {len(content.quotes)} quotes -> {output} "
+            f"({time.perf_counter() - start:.2f}s)"))
@@ -0,0 +1,96 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the bot engine (micro) and the chat API against a seeded test "
+        "database (macro). Writes JSON; --compare flags regressions against a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--suite", choices=("micro", "macro", "all"), default="all")
+        parser.add_argument("--filter", help="Only run benchmarks whose name contains this.")
+        parser.add_argument("--output", help="Write results JSON here (default: stdout).")
+        parser.add_argument("--compare", metavar="BASELINE", help="Results JSON to compare against.")
+        parser.add_argument("--threshold", type=float, default=benchmarks.DEFAULT_THRESHOLD,
+                            help="Relative median slowdown that counts as a regression (default 0.15).")
+        parser.add_argument("--repeat", type=int, default=5, help="Rounds per micro benchmark.")
+        parser.add_argument("--corpus-size", type=int, default=2000)
+        parser.add_argument("--kb-sizes", default=",".join(map(str, benchmarks.DEFAULT_KB_SIZES)))
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--messages-per-user", type=int, default=2000)
+        parser.add_argument("--requests", type=int, default=200, help="Requests per macro benchmark.")
+
+    def handle(self, *args, **opts):
+        try:
+            kb_sizes = [int(s) for s in opts["kb_sizes"].split(",") if s]
+        except ValueError:
+            raise CommandError("--kb-sizes must be comma-separated integers.")
+        if opts["repeat"] < 1 or opts["corpus_size"] < 1 or opts["requests"] < 1:
+            raise CommandError("--repeat, --corpus-size and --requests must be positive.")
+        if opts["messages_per_user"] < 202:
+            raise CommandError("--messages-per-user must be at least 202 (deep history page).")
+        self._writes_file = bool(opts["output"])
+        baseline = None
+        if opts["compare"]:
+            with open(opts["compare"]) as fh:
+                baseline = json.load(fh)["results"]
+
+        results = {}
+        if opts["suite"] in ("micro", "all"):
+            results.update(benchmarks.run_micro(opts["corpus_size"], opts["repeat"], kb_sizes, opts["filter"]))
+        if opts["suite"] in ("macro", "all"):
+            results.update(self._macro(opts))
+
+        report = json.dumps({"environment": benchmarks.environment(), "results": results}, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w") as fh:
+                fh.write(report + "\n")
+        else:
+            self.stdout.write(report)
+        self._summary(results)
+
+        if baseline is not None:
+            if opts["filter"] or opts["suite"] != "all":
+                # a partial run: only compare what was run
+                baseline = {name: r for name, r in baseline.items() if name in results}
+            rows = benchmarks.compare(results, baseline, opts["threshold"])
+            self._comparison(rows)
+            regressions = [r["name"] for r in rows if r["status"] == "regression"]
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+    def _macro(self, opts):
+        # A throwaway test database, so seeding never touches real data.
+        from django.test.runner import DiscoverRunner
+        from django.test.utils import setup_test_environment, teardown_test_environment
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            return benchmarks.run_macro(opts["users"], opts["messages_per_user"], opts["requests"], opts["filter"])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+    def _summary(self, results):
+        out = self.stderr if not self._writes_file else self.stdout
+        for name, r in results.items():
+            extra = f"  queries={r['queries']:g} errors={r['errors']}" if "queries" in r else ""
+            out.write(f"{name:50} median {benchmarks.format_seconds(r['median']):>9}  "
+                      f"p95 {benchmarks.format_seconds(r['p95']):>9}{extra}")
+
+    def _comparison(self, rows):
+        out = self.stderr if not self._writes_file else self.stdout
+        for row in rows:
+            if "ratio" not in row:
+                out.write(f"{row['name']:50} {row['status']}")
+                continue
+            line = (f"{row['name']:50} {benchmarks.format_seconds(row['baseline']):>9} -> "
+                    f"{benchmarks.format_seconds(row['current']):>9}  x{row['ratio']:.2f}  {row['status']}")
+            out.write(self.style.ERROR(line) if row["status"] == "regression" else line)
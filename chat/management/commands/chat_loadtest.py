@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.benchmarks import DEFAULT_MIX, MESSAGE_KINDS, format_seconds
+from chat.loadtest import MAX_DELAY, MIN_DELAY, run_load
+
+
+def _parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in MESSAGE_KINDS:
+            raise CommandError(f"Unknown message kind {kind!r} (choose from {', '.join(MESSAGE_KINDS)}).")
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise CommandError(f"Bad weight in --mix: {part!r}")
+    if not any(w > 0 for w in mix.values()):
+        raise CommandError("--mix needs at least one positive weight.")
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Run simulated chat users against a running server (runserver, gunicorn, "
+        "uvicorn...): register/log in, load history, poll /api/messages with the "
+        "app.js backoff and send messages. Reports per-endpoint throughput, "
+        "latency percentiles and error rates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--duration", type=float, default=60.0, help="Seconds of steady load after ramp-up.")
+        parser.add_argument("--ramp-up", type=float, default=5.0, help="Seconds over which users start.")
+        parser.add_argument("--send-interval", type=float, default=20.0,
+                            help="Mean seconds between a user's messages (0 = poll only).")
+        parser.add_argument("--mix", default=",".join(f"{k}={v:g}" for k, v in DEFAULT_MIX.items()),
+                            help=f"Message kind weights, from: {', '.join(MESSAGE_KINDS)}.")
+        parser.add_argument("--min-delay", type=float, default=MIN_DELAY, help="Poll delay floor (app.js: 1s).")
+        parser.add_argument("--max-delay", type=float, default=MAX_DELAY, help="Poll delay cap (app.js: 15s).")
+        parser.add_argument("--prefix", default="lt", help="Username prefix; users are <prefix><number>, 6 chars.")
+        parser.add_argument("--password", default="load12")
+        parser.add_argument("--no-register", action="store_false", dest="register",
+                            help="Only log in (accounts already exist).")
+        parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", dest="json_path", help="Also write the report here as JSON.")
+        parser.add_argument("--verbose", action="store_true", help="Print transport errors as they happen.")
+
+    def handle(self, *args, **opts):
+        prefix = opts["prefix"]
+        if not (prefix.isalnum() and 1 <= len(prefix) <= 5):
+            raise CommandError("--prefix must be 1-5 letters/digits (usernames are exactly 6 characters).")
+        if not 1 <= opts["users"] <= 10 ** (6 - len(prefix)):
+            raise CommandError(f"--users must be between 1 and {10 ** (6 - len(prefix))} with this prefix.")
+        if opts["duration"] <= 0 or opts["min_delay"] <= 0 or opts["max_delay"] < opts["min_delay"]:
+            raise CommandError("--duration and --min-delay must be positive, --max-delay >= --min-delay.")
+        opts["mix"] = _parse_mix(opts["mix"])
+        opts["url"] = opts["url"].rstrip("/")
+
+        self.stdout.write(f"{opts['users']} users against {opts['url']} for "
+                          f"{opts['ramp_up']:g}s ramp-up + {opts['duration']:g}s ...")
+        report = asyncio.run(run_load(opts))
+
+        self.stdout.write(f"{'endpoint':10} {'requests':>9} {'req/s':>8} {'errors':>7} "
+                          f"{'p50':>9} {'p95':>9} {'p99':>9}")
+        for name, r in report["endpoints"].items():
+            line = (f"{name:10} {r['requests']:>9} {r['throughput']:>8.1f} {r['error_rate']:>7.1%} "
+                    f"{format_seconds(r['p50']):>9} {format_seconds(r['p95']):>9} {format_seconds(r['p99']):>9}")
+            self.stdout.write(self.style.ERROR(line) if r["errors"] else line)
+        self.stdout.write(f"total: {report['requests']} requests in {report['elapsed']:.1f}s "
+                          f"({report['throughput']:.1f} req/s), error rate {report['error_rate']:.2%}"
+                          + (f", {report['crashed_users']} users stopped early" if report["crashed_users"] else ""))
+        if opts["json_path"]:
+            with open(opts["json_path"], "w") as fh:
+                json.dump(report, fh, indent=2)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.search import fts_available, optimize_index, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the chat_message full-text index from chat_message (and optionally optimize it)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--optimize", action="store_true", help="Merge index segments after rebuilding.")
+
+    def handle(self, *args, **opts):
+        if not fts_available():
+            raise CommandError("Full-text search needs the SQLite backend (FTS5).")
+        rebuild_index()
+        if opts["optimize"]:
+            optimize_index()
+        self.stdout.write(self.style.SUCCESS("Message search index rebuilt."))
@@ -0,0 +1,200 @@
+"""Per-process latency histograms, exposed at /metrics in Prometheus text format.
+
+Recording is lock-free: each thread observes into its own shard (a dict of
+label → bucket counts + sum, registered once per thread), and a scrape adds
+the shards up. When a thread ends (``sync_to_async`` starts new ones all
+the time under ASGI) its shard is folded into a base shard and dropped,
+so the shard count tracks live threads. Observing costs a thread-local
+lookup, a bisect and two increments, cheap enough to leave on in
+production. Numbers are per process; with several workers, scrape each
+one (or aggregate by instance).
+
+* ``RequestMetricsMiddleware`` times every request and, through a
+  connection execute wrapper, counts its DB queries and DB time, labelled
+  by URL name. Queries run by ``sync_to_async`` helpers are included (the
+  context is carried into the worker thread).
+* ``bot_logic`` records which step answered and how long each step took.
+"""
+import contextvars
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from typing import Dict, List, Sequence
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelname: str,
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelname = labelname
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._lock = threading.Lock()   # registration, retirement and scrapes, never observe()
+        self._base: Dict[str, list] = {}   # counts of threads that have ended
+        self._shards: Dict[int, Dict[str, list]] = {}
+
+    def _shard(self) -> Dict[str, list]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # the thread's locals are dropped when it ends, and the owner with them
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard)
+            return shard
+
+    def _retire(self, shard: Dict[str, list]) -> None:
+        with self._lock:
+            self._shards.pop(id(shard), None)
+            _merge(self._base, shard)
+
+    def observe(self, value: float, label: str = "") -> None:
+        shard = self._shard()
+        cell = shard.get(label)
+        if cell is None:
+            # one count per bucket, then +Inf, then the running sum
+            cell = shard[label] = [0] * (len(self.buckets) + 2)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self) -> Dict[str, list]:
+        """label → [bucket counts..., +Inf count, sum], summed over threads."""
+        totals: Dict[str, list] = {}
+        with self._lock:
+            _merge(totals, self._base)
+            for shard in self._shards.values():
+                _merge(totals, shard)
+        return totals
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label, cell in sorted(self.snapshot().items()):
+            base = f'{self.labelname}="{_escape(label)}"'
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), cell):
+                running += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{base},le="{le}"}} {running}')
+            lines.append(f"{self.name}_sum{{{base}}} {cell[-1]!r}")
+            lines.append(f"{self.name}_count{{{base}}} {running}")
+        return lines
+
+
+class _ShardOwner:
+    """Held only by its thread's locals; collected when the thread ends."""
+
+
+def _merge(totals: Dict[str, list], shard: Dict[str, list]) -> None:
+    for label, cell in shard.copy().items():
+        cell = list(cell)
+        total = totals.get(label)
+        if total is None:
+            totals[label] = cell
+        else:
+            for i, v in enumerate(cell):
+                total[i] += v
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+BOT_STAGE_SECONDS = Histogram(
+    "chat_bot_stage_seconds", "Time spent in each bot reply step (cache, router, greeting, kb, followup).", "stage")
+BOT_REPLY_SECONDS = Histogram(
+    "chat_bot_reply_seconds", "Bot reply latency by the intent that answered.", "intent")
+REQUEST_SECONDS = Histogram(
+    "chat_http_request_seconds", "View latency until the response is returned, by URL name.", "view")
+REQUEST_DB_QUERIES = Histogram(
+    "chat_http_db_queries", "DB queries per request, by URL name.", "view", QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram(
+    "chat_http_db_seconds", "DB time per request, by URL name.", "view")
+
+HISTOGRAMS = [BOT_STAGE_SECONDS, BOT_REPLY_SECONDS, REQUEST_SECONDS, REQUEST_DB_QUERIES, REQUEST_DB_SECONDS]
+
+
+def render_metrics() -> str:
+    from .bot_logic import REPLY_CACHE
+    from .ratelimit import rejections
+
+    lines: List[str] = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    stats = REPLY_CACHE.stats()
+    for key in ("hits", "misses", "evictions"):
+        lines += [f"# TYPE chat_reply_cache_{key}_total counter", f"chat_reply_cache_{key}_total {stats[key]}"]
+    lines += ["# TYPE chat_reply_cache_size gauge", f"chat_reply_cache_size {stats['size']}"]
+    lines.append("# TYPE chat_rate_limited_total counter")
+    for (scope, reason), count in sorted(rejections().items()):
+        lines.append(f'chat_rate_limited_total{{scope="{scope}",reason="{reason}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+# -- request instrumentation -------------------------------------------
+_request_db = contextvars.ContextVar("chat_request_db", default=None)
+
+
+def _db_timer(execute, sql, params, many, context):
+    stats = _request_db.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+
+def install_db_timer(sender, connection, **kwargs):
+    """connection_created receiver: time queries made during a request."""
+    if _db_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_timer)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, start = [0, 0.0], time.perf_counter()
+        token = _request_db.set(stats)
+        try:
+            return self.get_response(request)
+        finally:
+            _request_db.reset(token)
+            self._record(request, start, stats)
+
+    async def __acall__(self, request):
+        stats, start = [0, 0.0], time.perf_counter()
+        token = _request_db.set(stats)
+        try:
+            return await self.get_response(request)
+        finally:
+            _request_db.reset(token)
+            self._record(request, start, stats)
+
+    @staticmethod
+    def _record(request, start, stats):
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, view)
+        REQUEST_DB_QUERIES.observe(stats[0], view)
+        REQUEST_DB_SECONDS.observe(stats[1], view)
@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# SQLite only: an FTS5 index over chat_message.message (see chat/search.py).
+FORWARD = [
+    """CREATE VIEW chat_message_fts_src AS
+       SELECT id, message, 'u' || user_id AS owner FROM chat_message""",
+    """CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+       message, owner, content='chat_message_fts_src', content_rowid='id',
+       tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER chat_message_fts_ai AFTER INSERT ON chat_message BEGIN
+       INSERT INTO chat_message_fts(rowid, message, owner)
+       VALUES (new.id, new.message, 'u' || new.user_id);
+       END""",
+    """CREATE TRIGGER chat_message_fts_ad AFTER DELETE ON chat_message BEGIN
+       INSERT INTO chat_message_fts(chat_message_fts, rowid, message, owner)
+       VALUES ('delete', old.id, old.message, 'u' || old.user_id);
+       END""",
+    """CREATE TRIGGER chat_message_fts_au AFTER UPDATE OF message, user_id ON chat_message BEGIN
+       INSERT INTO chat_message_fts(chat_message_fts, rowid, message, owner)
+       VALUES ('delete', old.id, old.message, 'u' || old.user_id);
+       INSERT INTO chat_message_fts(rowid, message, owner)
+       VALUES (new.id, new.message, 'u' || new.user_id);
+       END""",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES('rebuild')",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_au",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ad",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ai",
+    "DROP TABLE IF EXISTS chat_message_fts",
+    "DROP VIEW IF EXISTS chat_message_fts_src",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_archivedmessage'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(FORWARD), _run(BACKWARD)),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('intent', models.CharField(max_length=32)),
+                ('user_messages', models.PositiveIntegerField(default=0)),
+                ('bot_messages', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-day', 'user', 'intent'],
+                'indexes': [models.Index(fields=['day', 'intent'], name='chat_messag_day_18eed8_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'user', 'intent'), name='chat_rollup_day_user_intent')],
+            },
+        ),
+    ]
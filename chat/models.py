@@ -35,4 +35,44 @@ class Message(models.Model):
             "sender": self.sender,
             "message": self.message,
             "timestamp": self.created_at.isoformat(),
-        }
\ No newline at end of file
+        }
+
+class ArchivedMessage(models.Model):
+    """Cold copy of a Message moved out by `manage.py archive_messages`.
+
+    Keeps the original id so history can be merged back in id order.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_messages", db_index=False)
+    sender = models.CharField(max_length=4, choices=Message.SENDER_CHOICES)
+    message = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["user", "id"])]
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M:%S} [{self.sender}] {self.message[:30]} (archived)"
+
+    as_dict = Message.as_dict
+
+class MessageRollup(models.Model):
+    """Messages per day, user and intent, kept current by the send views.
+
+    Written with an increment-upsert alongside the messages themselves
+    (chat/analytics.py) and rebuilt by `manage.py backfill_rollups`.
+    """
+    day = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="message_rollups")
+    intent = models.CharField(max_length=32)
+    user_messages = models.PositiveIntegerField(default=0)
+    bot_messages = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-day", "user", "intent"]
+        constraints = [models.UniqueConstraint(fields=["day", "user", "intent"], name="chat_rollup_day_user_intent")]
+        indexes = [models.Index(fields=["day", "intent"])]
+
+    def __str__(self):
+        return f"{self.day} {self.user_id} {self.intent}: {self.user_messages}/{self.bot_messages}"
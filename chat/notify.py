@@ -0,0 +1,57 @@
+"""In-process "new messages" notifications for /api/stream.
+
+Writers call ``NOTIFIER.publish(user_id, last_message_id)`` after they store
+rows (from any thread); stream and long-poll handlers ``await
+NOTIFIER.wait(...)`` instead of querying the database on a timer. Only
+writers in the same process wake a waiter, so streams still resync from the
+database every CHAT_STREAM_RESYNC seconds to pick up rows written elsewhere.
+"""
+import asyncio
+import threading
+from typing import Dict, Set, Tuple
+
+
+class NotificationRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[int, int] = {}
+        self._waiters: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def latest(self, user_id: int) -> int:
+        """Highest message id published for the user in this process (0 if none)."""
+        return self._latest.get(user_id, 0)
+
+    def publish(self, user_id: int, message_id: int) -> None:
+        with self._lock:
+            if message_id > self._latest.get(user_id, 0):
+                self._latest[user_id] = message_id
+            waiters = list(self._waiters.get(user_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, user_id: int, after_id: int, timeout: float) -> bool:
+        """Wait until something newer than `after_id` is published; False on timeout."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if self._latest.get(user_id, 0) > after_id:
+                return True
+            self._waiters.setdefault(user_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                bucket = self._waiters.get(user_id)
+                if bucket is not None:
+                    bucket.discard(waiter)
+                    if not bucket:
+                        del self._waiters[user_id]
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(b) for b in self._waiters.values())
+
+
+NOTIFIER = NotificationRegistry()
@@ -0,0 +1,67 @@
+"""Signed poll tokens: polling without the session or auth_user lookups.
+
+``index`` gives the page a token: the user id, timestamped and signed with
+SECRET_KEY. app.js sends it as ``X-Poll-Token`` on /api/messages and
+/api/history. A valid token identifies the user without loading the
+session or the user row, so an empty poll answered from the high-water
+mark runs no query at all.
+
+A token expires after ``CHAT_POLL_TOKEN_MAX_AGE`` seconds. After that, or
+when the token is missing or garbled, the view authenticates through the
+session like any other view. It then sends a fresh token back in the
+``X-Poll-Token`` response header, which app.js picks up. The max age is
+also how long a token keeps working after logout. Set it to 0 to turn
+tokens off.
+"""
+from functools import wraps
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core import signing
+
+POLL_TOKEN_HEADER = "X-Poll-Token"
+_SALT = "chat.poll-token"
+
+
+def _max_age() -> int:
+    return getattr(settings, "CHAT_POLL_TOKEN_MAX_AGE", 300) or 0
+
+
+def issue_token(user_id: int) -> str:
+    return signing.TimestampSigner(salt=_SALT).sign(str(user_id))
+
+
+def token_user_id(request) -> Optional[int]:
+    """The user id in the request's poll token, or None if missing, expired or forged."""
+    value = request.headers.get(POLL_TOKEN_HEADER)
+    max_age = _max_age()
+    if not value or not max_age:
+        return None
+    try:
+        return int(signing.TimestampSigner(salt=_SALT).unsign(value, max_age=max_age))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def poll_login_required(view):
+    """login_required for async read-only views that also accepts a poll token.
+
+    Either way the view finds the user's id in ``request.chat_user_id``.
+    Without a valid token it must not rely on anything but the id.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user_id = token_user_id(request)
+        if user_id is not None:
+            request.chat_user_id = user_id
+            return await view(request, *args, **kwargs)
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        request.chat_user_id = user.id
+        response = await view(request, *args, **kwargs)
+        if _max_age():
+            response[POLL_TOKEN_HEADER] = issue_token(user.id)
+        return response
+    return wrapper
@@ -0,0 +1,260 @@
+"""Per-user admission control for the chat API.
+
+Each scope in ``CHAT_RATE_LIMITS`` (``send`` for api_send/api_send_batch,
+``poll`` for api_messages/api_history/api_stream) is a token bucket per
+user: ``burst`` requests at once, refilled at ``rate`` per second. A
+request that finds the bucket empty gets 429 with ``Retry-After``, the
+number of seconds until a token is back. app.js waits that long before
+polling again. ``concurrency`` also caps how many requests of the scope a
+user may have in flight, so one tab cannot tie up several workers with
+slow sends. A scope missing from the setting is not limited.
+
+Buckets are kept per process by default. Set ``CHAT_RATE_LIMIT_CACHE`` to a
+shared cache alias so the budgets hold across workers. Caches have no
+atomic read-modify-write for buckets, so under a race a client may get a
+token or two extra; the in-flight counters use incr/decr and are exact.
+Async views go through the limiters' ``a``-prefixed methods, which use the
+cache's async API so a cache round trip never blocks the event loop.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+SLOT_TIMEOUT = 60   # seconds before a leaked in-flight slot is forgotten (cache backend)
+
+
+class LocalLimiter:
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()   # key -> (tokens, stamp)
+        self._in_flight: Dict[str, int] = {}
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Take `cost` tokens; 0 on success, else the seconds until they are there."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            self._buckets[key] = (tokens - cost if not wait else tokens, now)
+            self._buckets.move_to_end(key)
+            # least recently seen first; an evicted bucket simply starts full
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def enter(self, key: str, limit: int) -> bool:
+        with self._lock:
+            n = self._in_flight.get(key, 0)
+            if n >= limit:
+                return False
+            self._in_flight[key] = n + 1
+            return True
+
+    def leave(self, key: str) -> None:
+        with self._lock:
+            n = self._in_flight.pop(key, 0) - 1
+            if n > 0:
+                self._in_flight[key] = n
+
+    # in-process and non-blocking, so the event loop can run these itself
+    async def atake(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        return self.take(key, rate, burst, cost)
+
+    async def aenter(self, key: str, limit: int) -> bool:
+        return self.enter(key, limit)
+
+    async def aleave(self, key: str) -> None:
+        self.leave(key)
+
+
+class CacheLimiter:
+    """Buckets and in-flight counters in a Django cache shared by all workers."""
+
+    def __init__(self, alias: str, prefix: str = "chat:rl:"):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    @staticmethod
+    def _refill(bucket, rate: float, burst: float, cost: float, now: float) -> Tuple[float, tuple, int]:
+        """(wait, new bucket, its timeout) for a bucket read from the cache."""
+        tokens, stamp = bucket or (burst, now)
+        tokens = min(burst, tokens + max(0.0, now - stamp) * rate)
+        wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+        # a bucket untouched for burst/rate seconds is full again, so it can expire
+        return wait, (tokens - cost if not wait else tokens, now), math.ceil(burst / rate) + 1
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        key = f"{self.prefix}{key}"
+        wait, bucket, timeout = self._refill(self.cache.get(key), rate, burst, cost, time.time())
+        self.cache.set(key, bucket, timeout)
+        return wait
+
+    async def atake(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        key = f"{self.prefix}{key}"
+        wait, bucket, timeout = self._refill(await self.cache.aget(key), rate, burst, cost, time.time())
+        await self.cache.aset(key, bucket, timeout)
+        return wait
+
+    def enter(self, key: str, limit: int) -> bool:
+        key = f"{self.prefix}inflight:{key}"
+        self.cache.add(key, 0, SLOT_TIMEOUT)
+        try:
+            n = self.cache.incr(key)
+        except ValueError:  # expired between add() and incr()
+            self.cache.add(key, 1, SLOT_TIMEOUT)
+            return True
+        if n > limit:
+            self._decr(key)
+            return False
+        return True
+
+    async def aenter(self, key: str, limit: int) -> bool:
+        key = f"{self.prefix}inflight:{key}"
+        await self.cache.aadd(key, 0, SLOT_TIMEOUT)
+        try:
+            n = await self.cache.aincr(key)
+        except ValueError:
+            await self.cache.aadd(key, 1, SLOT_TIMEOUT)
+            return True
+        if n > limit:
+            await self._adecr(key)
+            return False
+        return True
+
+    def leave(self, key: str) -> None:
+        self._decr(f"{self.prefix}inflight:{key}")
+
+    async def aleave(self, key: str) -> None:
+        await self._adecr(f"{self.prefix}inflight:{key}")
+
+    def _decr(self, key: str) -> None:
+        try:
+            self.cache.decr(key)
+        except ValueError:
+            pass
+
+    async def _adecr(self, key: str) -> None:
+        try:
+            await self.cache.adecr(key)
+        except ValueError:
+            pass
+
+
+def _build():
+    alias = getattr(settings, "CHAT_RATE_LIMIT_CACHE", None)
+    return CacheLimiter(alias) if alias else LocalLimiter()
+
+
+LIMITER = _build()
+
+# (scope, reason) -> rejected requests, exported by /metrics
+REJECTIONS: Dict[Tuple[str, str], int] = {}
+_rejections_lock = threading.Lock()
+
+
+def rejections() -> Dict[Tuple[str, str], int]:
+    with _rejections_lock:
+        return dict(REJECTIONS)
+
+
+def _reject(scope: str, reason: str, retry_after: float) -> JsonResponse:
+    with _rejections_lock:
+        REJECTIONS[scope, reason] = REJECTIONS.get((scope, reason), 0) + 1
+    seconds = max(1, math.ceil(retry_after))
+    response = JsonResponse({"error": "Too many requests, slow down.", "retry_after": seconds}, status=429)
+    response["Retry-After"] = str(seconds)
+    return response
+
+
+def _charge(limits: dict, request, cost) -> float:
+    burst = limits.get("burst", 1)
+    return min(cost(request), burst) if cost is not None else 1
+
+
+def _admit(scope: str, user_id: int, request, cost) -> Tuple[Optional[JsonResponse], Optional[str]]:
+    """(429 response or None, in-flight slot key to release or None)."""
+    limits = getattr(settings, "CHAT_RATE_LIMITS", {}).get(scope)
+    if not limits:
+        return None, None
+    key = f"{scope}:{user_id}"
+    slot = None
+    # the in-flight cap first, so a request turned away there costs no token
+    if limits.get("concurrency"):
+        if not LIMITER.enter(key, limits["concurrency"]):
+            return _reject(scope, "concurrency", 1), None
+        slot = key
+    if limits.get("rate"):
+        wait = LIMITER.take(key, limits["rate"], limits.get("burst", 1), _charge(limits, request, cost))
+        if wait:
+            if slot is not None:
+                LIMITER.leave(slot)
+            return _reject(scope, "rate", wait), None
+    return None, slot
+
+
+async def _aadmit(scope: str, user_id: int, request, cost) -> Tuple[Optional[JsonResponse], Optional[str]]:
+    """_admit() for async views."""
+    limits = getattr(settings, "CHAT_RATE_LIMITS", {}).get(scope)
+    if not limits:
+        return None, None
+    key = f"{scope}:{user_id}"
+    slot = None
+    if limits.get("concurrency"):
+        if not await LIMITER.aenter(key, limits["concurrency"]):
+            return _reject(scope, "concurrency", 1), None
+        slot = key
+    if limits.get("rate"):
+        wait = await LIMITER.atake(key, limits["rate"], limits.get("burst", 1), _charge(limits, request, cost))
+        if wait:
+            if slot is not None:
+                await LIMITER.aleave(slot)
+            return _reject(scope, "rate", wait), None
+    return None, slot
+
+
+def admission(scope: str, cost: Optional[Callable] = None):
+    """Apply the CHAT_RATE_LIMITS[scope] budget to a view (under @login_required
+    or @poll_login_required).
+
+    `cost(request)` may charge more than one token; it is capped at the
+    bucket size so a large request can still get through.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                # set by polltoken.poll_login_required, which needs no session
+                user_id = getattr(request, "chat_user_id", None)
+                if user_id is None:
+                    user_id = (await request.auser()).id
+                rejected, slot = await _aadmit(scope, user_id, request, cost)
+                if rejected is not None:
+                    return rejected
+                try:
+                    return await view(request, *args, **kwargs)
+                finally:
+                    if slot is not None:
+                        await LIMITER.aleave(slot)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                rejected, slot = _admit(scope, request.user.id, request, cost)
+                if rejected is not None:
+                    return rejected
+                try:
+                    return view(request, *args, **kwargs)
+                finally:
+                    if slot is not None:
+                        LIMITER.leave(slot)
+        return wrapper
+    return decorator
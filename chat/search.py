@@ -0,0 +1,119 @@
+"""Full-text search over chat_message backed by SQLite FTS5.
+
+``chat_message_fts`` is an external-content FTS5 index over the view
+``chat_message_fts_src`` (message text plus an ``owner`` token ``u<user_id>``)
+kept in sync by triggers from migration 0003 (so archived messages, which
+are deleted from chat_message, drop out of search). Putting the owner in the index
+lets a query intersect the user's postings with the term postings instead
+of filtering every match afterwards.
+"""
+import math
+import re
+from datetime import timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+FTS_TABLE = "chat_message_fts"
+# bm25 weights: message column only, the owner column never affects rank
+RANK_SQL = f"bm25({FTS_TABLE}, 1.0, 0.0)"
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_available() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def match_expression(query: str, user_id: Optional[int] = None) -> Optional[str]:
+    """User text → FTS5 query: every word must match, the last one as a prefix."""
+    terms = [t.replace('"', "") for t in _TERM.findall(query)]
+    if not terms:
+        return None
+    phrases = [f'"{t}"' for t in terms]
+    phrases[-1] += "*"
+    expr = f"message:({' '.join(phrases)})"
+    if user_id is not None:
+        expr = f'owner:"u{int(user_id)}" AND {expr}'
+    return expr
+
+
+def encode_cursor(order: str, row: dict) -> str:
+    return f"{row['rank']!r}:{row['id']}" if order == "rank" else str(row["id"])
+
+
+def _decode_cursor(order: str, cursor: str) -> Tuple:
+    if order == "rank":
+        rank, _, msg_id = cursor.rpartition(":")
+        rank = float(rank)
+        if not math.isfinite(rank):   # nan compares false to everything
+            raise ValueError(f"invalid rank in cursor: {cursor!r}")
+        return rank, int(msg_id)
+    return (int(cursor),)
+
+
+def search_messages(user_id: int, query: str, limit: int = 20, cursor: Optional[str] = None,
+                    order: str = "rank") -> Tuple[List[dict], Optional[str]]:
+    """One page of the user's matching messages and the cursor for the next.
+
+    order="rank" sorts by bm25 (best first, then id); order="recent" sorts
+    newest first. Raises ValueError for an unusable cursor.
+    """
+    expr = match_expression(query, user_id)
+    if expr is None:
+        return [], None
+    where, params = [f"{FTS_TABLE} MATCH %s"], [expr]
+    if cursor:
+        after = _decode_cursor(order, cursor)
+        if order == "rank":
+            where.append(f"({RANK_SQL} > %s OR ({RANK_SQL} = %s AND m.id > %s))")
+            params += [after[0], after[0], after[1]]
+        else:
+            where.append("m.id < %s")
+            params.append(after[0])
+    order_sql = f"{RANK_SQL}, m.id" if order == "rank" else "m.id DESC"
+    sql = (
+        f"SELECT m.id, m.sender, m.created_at, "
+        f"snippet({FTS_TABLE}, 0, '[', ']', '…', 12), {RANK_SQL} "
+        f"FROM {FTS_TABLE} JOIN chat_message m ON m.id = {FTS_TABLE}.rowid "
+        f"WHERE {' AND '.join(where)} ORDER BY {order_sql} LIMIT %s"
+    )
+    with connection.cursor() as cur:
+        cur.execute(sql, params + [limit + 1])
+        rows = cur.fetchall()
+
+    results = [
+        {"id": r[0], "sender": r[1], "timestamp": _iso(r[2]), "snippet": r[3], "rank": r[4]}
+        for r in rows[:limit]
+    ]
+    next_cursor = encode_cursor(order, results[-1]) if len(rows) > limit else None
+    return results, next_cursor
+
+
+def matching_ids_sql(query: str) -> Optional[Tuple[str, List[str]]]:
+    """(sql, params) selecting ids of all messages matching `query`, for admin search."""
+    expr = match_expression(query)
+    if expr is None:
+        return None
+    return f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expr]
+
+
+def rebuild_index() -> None:
+    with connection.cursor() as cur:
+        cur.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+
+
+def optimize_index() -> None:
+    with connection.cursor() as cur:
+        cur.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('optimize')")
+
+
+def _iso(value) -> str:
+    # raw cursors skip the ORM's converters: SQLite hands back naive UTC
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value.isoformat()
@@ -6,7 +6,10 @@ const typingEl = document.getElementById("typing");
 
 let lastId = 0;
 const renderedIds = new Set();
+let olderCursor = null;
+let loadingOlder = false;
 
+let stream = null;
 let polling = false;
 let pollTimeout = null;
 let nextDelay = 1000;
@@ -24,9 +27,31 @@ function getCookie(name) {
 }
 const csrftoken = getCookie('csrftoken');
 
+// Signed poll token: lets /api/messages and /api/history skip the session
+// lookup. The server sends a fresh one (X-Poll-Token) once it has expired.
+let pollToken = document.querySelector('meta[name="chat-poll-token"]')?.content || null;
+function pollFetch(url, options = {}) {
+  const headers = pollToken ? { "X-Poll-Token": pollToken } : {};
+  return fetch(url, { credentials: "same-origin", ...options, headers }).then((res) => {
+    const fresh = res.headers.get("X-Poll-Token");
+    if (fresh) pollToken = fresh;
+    return res;
+  });
+}
+
+// 429 responses carry Retry-After (seconds or an HTTP date); 0 when absent.
+function retryAfterMs(res) {
+  const value = res.headers.get("Retry-After");
+  if (!value) return 0;
+  const seconds = Number(value);
+  if (!Number.isNaN(seconds)) return Math.max(0, seconds * 1000);
+  const date = Date.parse(value);
+  return Number.isNaN(date) ? 0 : Math.max(0, date - Date.now());
+}
+
 window.addEventListener("DOMContentLoaded", async () => {
   await loadHistory();
-  startPolling();
+  if (!startStream()) startPolling();
   setupActivityDetection();
   setupVisibilityHandlers();
   setupOnlineOffline();
@@ -58,6 +83,13 @@ async function onSend() {
     });
 
     let data = {}; try { data = await res.json(); } catch {}
+    if (res.status === 429) {
+      const wait = Math.ceil(retryAfterMs(res) / 1000) || 1;
+      if (tempEl) tempEl.classList.add("error");
+      input.value = input.value || text;
+      alert(`You're sending messages too quickly. Please wait ${wait}s and try again.`);
+      return;
+    }
     if (!res.ok) throw new Error(`Failed to send (${res.status})`);
 
     if (tempEl && tempEl.parentNode) tempEl.parentNode.removeChild(tempEl);
@@ -79,7 +111,8 @@ async function onSend() {
 
 async function loadHistory() {
   try {
-    const res = await fetch("/api/history", { credentials: "same-origin" });
+    const res = await pollFetch("/api/history");
+    if (res.status === 429) { setTimeout(loadHistory, retryAfterMs(res) || MIN_DELAY); return; }
     if (!res.ok) throw new Error(`Failed to load history (${res.status})`);
     const data = await res.json();
 
@@ -89,20 +122,79 @@ async function loadHistory() {
       renderedIds.add(m.id);
       lastId = Math.max(lastId, m.id);
     });
+    olderCursor = data.next_cursor;
     scrollToBottom();
   } catch (e) {
     console.error("Failed to load history", e);
   }
 }
 
-function startPolling() { if (!polling) { polling = true; scheduleNextPoll(MIN_DELAY); } }
+// Older pages are fetched on demand when the user scrolls to the top.
+async function loadOlder() {
+  if (loadingOlder || olderCursor == null) return;
+  loadingOlder = true;
+  try {
+    const res = await pollFetch(`/api/history?before=${olderCursor}&archived=1`);
+    if (!res.ok) throw new Error(`Failed to load older history (${res.status})`);
+    const data = await res.json();
+    const prevHeight = chat.scrollHeight;
+    (data.messages || []).slice().reverse().forEach((m) => {
+      if (!renderedIds.has(m.id)) { addMessage(m, false, true); renderedIds.add(m.id); }
+    });
+    chat.scrollTop += chat.scrollHeight - prevHeight;
+    olderCursor = data.next_cursor;
+  } catch (e) {
+    console.error(e);
+  } finally {
+    loadingOlder = false;
+  }
+}
+chat.addEventListener("scroll", () => { if (chat.scrollTop === 0) loadOlder(); });
+
+// Server push: /api/stream sends each new message as an SSE event and the
+// browser resumes with Last-Event-ID after reconnects. If the stream cannot
+// be opened (no EventSource, endpoint error, 204 from a WSGI server) or does
+// not open within STREAM_OPEN_TIMEOUT (a buffering server or proxy), we fall
+// back to polling.
+const STREAM_OPEN_TIMEOUT = 20000;
+function fallBackToPolling() {
+  if (stream) { stream.close(); stream = null; }
+  startPolling();
+}
+function startStream() {
+  if (!window.EventSource) return false;
+  if (stream) return true;
+  const es = new EventSource(`/api/stream?after=${lastId}`);
+  stream = es;
+  const openTimer = setTimeout(() => { if (stream === es && es.readyState !== EventSource.OPEN) fallBackToPolling(); },
+                               STREAM_OPEN_TIMEOUT);
+  stream.onopen = () => clearTimeout(openTimer);
+  stream.onmessage = (e) => {
+    let m; try { m = JSON.parse(e.data); } catch { return; }
+    if (!renderedIds.has(m.id)) {
+      addMessage(m); renderedIds.add(m.id); lastId = Math.max(lastId, m.id);
+      typingEl.classList.add("hidden"); scrollToBottom();
+    }
+  };
+  stream.onerror = () => {
+    if (stream === es && es.readyState === EventSource.CLOSED) { clearTimeout(openTimer); fallBackToPolling(); }
+  };
+  return true;
+}
+
+function startPolling() { if (stream) return; if (!polling) { polling = true; scheduleNextPoll(MIN_DELAY); } }
 function stopPolling() { polling = false; if (pollTimeout) { clearTimeout(pollTimeout); pollTimeout = null; } }
 function scheduleNextPoll(delay) { if (!polling) return; if (pollTimeout) clearTimeout(pollTimeout); pollTimeout = setTimeout(fetchNewMessages, delay); }
 
 async function fetchNewMessages() {
   if (!polling || document.hidden || isIdle || !navigator.onLine) return;
   try {
-    const res = await fetch(`/api/messages?after=${lastId}`, { credentials: "same-origin" });
+    const res = await pollFetch(`/api/messages?after=${lastId}`, { cache: "no-cache" });
+    if (res.status === 429) {
+      // rate limited: wait as long as the server asks, then resume the backoff
+      nextDelay = Math.max(nextDelay, retryAfterMs(res) || MIN_DELAY);
+      return;
+    }
     if (!res.ok) throw new Error("poll failed");
     const data = await res.json();
     const msgs = data.messages || [];
@@ -138,7 +230,7 @@ function setupActivityDetection() {
 function setupVisibilityHandlers() { document.addEventListener("visibilitychange", () => { if (document.hidden) stopPolling(); else if (!isIdle && navigator.onLine) startPolling(); }); }
 function setupOnlineOffline() { window.addEventListener("offline", () => stopPolling()); window.addEventListener("online", () => { if (!document.hidden && !isIdle) startPolling(); }); }
 
-function addMessage(m, isTemp = false) {
+function addMessage(m, isTemp = false, prepend = false) {
   const wrapper = document.createElement("div");
   wrapper.className = `msg ${m.sender}${isTemp ? " pending" : ""}`;
   if (m.id) wrapper.dataset.id = m.id;
@@ -152,7 +244,7 @@ function addMessage(m, isTemp = false) {
 
   wrapper.appendChild(content);
   wrapper.appendChild(meta);
-  chat.appendChild(wrapper);
+  if (prepend) chat.insertBefore(wrapper, chat.firstChild); else chat.appendChild(wrapper);
   return wrapper;
 }
 
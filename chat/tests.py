@@ -1,3 +1,826 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Max
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import bot_logic, kb_loader, metrics, ratelimit, views, watermarks, write_behind
+from .polltoken import issue_token
+from .bot_logic import KnowledgeIndex, calculator_intent, tokenize
+from .kb_mmap import MappedKnowledgeIndex, MappedSpellCorrector, build_index
+from .models import ArchivedMessage, Message, MessageRollup, Profile
+
+try:
+    from .kb_vectors import VectorKnowledgeIndex
+except ImportError:  # numpy is optional
+    VectorKnowledgeIndex = None
+
+
+def off_the_event_loop(method):
+    """Wrap a blocking cache method so calling it from a running event loop fails."""
+    def call(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return method(*args, **kwargs)
+        raise AssertionError(f"blocking {method.__name__}() on the event loop")
+    return call
+
+
+@override_settings(CHAT_TYPING_DELAY=0)
+class SendQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("abc123", password="abc123", first_name="Ann")
+        Profile.objects.create(user=self.user)
+        self.client.force_login(self.user)
+        self.client.get("/")  # warms the session's profile cache
+
+    def send(self, text):
+        resp = self.client.post("/api/send", json.dumps({"message": text}), content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    # Every request costs 2 queries for the session and auth_user lookups;
+    # the write transaction is SAVEPOINT + INSERT + rollup upsert + RELEASE
+    # under TestCase's outer transaction, and a session rewrite is
+    # SAVEPOINT + UPDATE + RELEASE.
+    def test_normal_reply(self):
+        with self.assertNumQueries(6):
+            data = self.send("what is python")
+        self.assertEqual(data["bot_message"]["id"], data["user_message"]["id"] + 1)
+
+    def test_ask_name(self):
+        with self.assertNumQueries(6):
+            data = self.send("what is my name")
+        self.assertEqual(data["bot_message"]["message"], "Your name is Ann.")
+
+    def test_name_capture(self):
+        # + UPDATE chat_profile, + session rewrite for the new cache entry
+        with self.assertNumQueries(10):
+            self.send("my name is Bob")
+        self.assertEqual(Profile.objects.get(user=self.user).preferred_name, "Bob")
+        with self.assertNumQueries(6):
+            data = self.send("what is my name")
+        self.assertEqual(data["bot_message"]["message"], "Your name is Bob.")
+
+    def test_reset(self):
+        self.send("my name is Bob")
+        with self.assertNumQueries(10):
+            self.send("reset")
+        self.assertIsNone(Profile.objects.get(user=self.user).preferred_name)
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 4)
+
+    def test_cold_profile_cache_reads_profile_once(self):
+        session = self.client.session
+        del session["chat_profile"]
+        session.save()
+        # + SELECT chat_profile, + session rewrite
+        with self.assertNumQueries(10):
+            self.send("what is python")
+
+
+@override_settings(CHAT_READ_REPLICA=None)
+class StreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("sse123", password="sse123")
+        Message.objects.create(user=self.user, sender=Message.USER, message="hi")
+
+    def test_wsgi_event_stream_is_refused_so_the_client_polls(self):
+        self.client.force_login(self.user)
+        resp = self.client.get("/api/stream", headers={"Accept": "text/event-stream"})
+        self.assertEqual(resp.status_code, 204)
+        resp = self.client.get("/api/stream", {"after": 0, "timeout": 1})
+        self.assertEqual([m["message"] for m in resp.json()["messages"]], ["hi"])
+
+    async def test_asgi_event_stream_sends_backlog(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        resp = await client.get("/api/stream", {"after": 0}, headers={"Accept": "text/event-stream"})
+        self.assertEqual(resp["Content-Type"], "text/event-stream")
+        chunks = aiter(resp.streaming_content)
+        self.assertEqual(await anext(chunks), b"retry: 3000\n\n")
+        self.assertIn(b'"message": "hi"', await anext(chunks))
+        await chunks.aclose()
+
+
+@override_settings(CHAT_READ_REPLICA=None)
+class HistoryPagingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hist123", password="hist123")
+        self.client.force_login(self.user)
+        for i in range(1, 8):
+            Message.objects.create(user=self.user, sender=Message.USER, message=f"m{i}")
+        call_command("archive_messages", keep_per_user=4, stdout=StringIO())   # m1-m3 go cold
+        self.ids = {m.message: m.id for m in Message.objects.all()}
+
+    def walk(self, cursor, **params):
+        pages = []
+        while True:
+            data = self.client.get("/api/history", {"limit": 2, **params}).json()
+            pages.append([m["message"] for m in data["messages"]])
+            if data["next_cursor"] is None:
+                self.assertFalse(data["has_more"])
+                return pages
+            self.assertTrue(data["has_more"])
+            params[cursor] = data["next_cursor"]
+
+    def test_before_pages_newest_first(self):
+        self.assertEqual(self.walk("before"), [["m6", "m7"], ["m4", "m5"]])
+        self.assertEqual(self.walk("before", before=self.ids["m5"]), [["m4"]])
+
+    def test_after_pages_oldest_first(self):
+        self.assertEqual(self.walk("after", after=0), [["m4", "m5"], ["m6", "m7"]])
+        self.assertEqual(self.walk("after", after=self.ids["m7"]), [[]])
+
+    def test_archived_pages_continue_into_the_archive(self):
+        self.assertEqual(self.walk("before", archived="1"), [["m6", "m7"], ["m4", "m5"], ["m2", "m3"], ["m1"]])
+        self.assertEqual(self.walk("after", after=0, archived="1"),
+                         [["m1", "m2"], ["m3", "m4"], ["m5", "m6"], ["m7"]])
+
+
+@override_settings(CHAT_READ_REPLICA=None)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("exp123", password="exp123")
+        other = User.objects.create_user("exp456", password="exp456")
+        Message.objects.create(user=other, sender=Message.USER, message="not mine")
+        for day, text in enumerate(["old, \"quoted\"", "older", "mid", "new"], start=1):
+            msg = Message.objects.create(user=self.user, sender=Message.USER, message=text)
+            Message.objects.filter(id=msg.id).update(created_at=datetime(2026, 1, day, 12, tzinfo=dt_timezone.utc))
+        call_command("archive_messages", keep_per_user=2, stdout=StringIO())   # the first two go cold
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        resp = self.client.get("/api/export", params)
+        self.assertEqual(resp.status_code, 200)
+        return resp, b"".join(resp.streaming_content)
+
+    def test_ndjson_and_csv_bodies(self):
+        resp, body = self.export()
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        self.assertEqual(resp["Content-Disposition"], 'attachment; filename="chat-exp123.ndjson"')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([(r["sender"], r["message"]) for r in rows], [("user", "mid"), ("user", "new")])
+        self.assertEqual(rows[0]["timestamp"], "2026-01-03T12:00:00+00:00")
+
+        resp, body = self.export(format="csv", archived="1")
+        self.assertEqual(resp["Content-Type"], "text/csv")
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[0], ["id", "sender", "message", "timestamp"])
+        self.assertEqual([r[2] for r in rows[1:]], ['old, "quoted"', "older", "mid", "new"])
+
+    def test_gzip_is_a_content_encoding(self):
+        resp, body = self.export(gzip="1")
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        self.assertEqual(gzip.decompress(body), self.export()[1])
+
+    def messages(self, **params):
+        return [json.loads(line)["message"] for line in self.export(archived="1", **params)[1].decode().splitlines()]
+
+    def test_since_and_until_bounds(self):
+        self.assertEqual(self.messages(since="2026-01-02", until="2026-01-03"), ["older", "mid"])   # until covers its day
+        self.assertEqual(self.messages(since="2026-01-03T12:00:00Z"), ["mid", "new"])
+        self.assertEqual(self.messages(until="2026-01-02T11:00:00+00:00"), ['old, "quoted"'])
+
+    async def test_archived_rows_come_first_in_id_order(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        resp = await client.get("/api/export", {"archived": "1"})
+        body = b"".join([chunk async for chunk in resp.streaming_content])
+        ids = [json.loads(line)["id"] for line in body.decode().splitlines()]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(ids[:2], [m.id async for m in ArchivedMessage.objects.filter(user=self.user)])
+
+    def test_unknown_format_or_bad_date_is_rejected(self):
+        for params in ({"format": "xml"}, {"since": "yesterday"}, {"until": "2026-13-01"}):
+            with self.subTest(**params):
+                resp = self.client.get("/api/export", params)
+                self.assertEqual(resp.status_code, 400)
+                self.assertIn("error", resp.json())
+
+
+@override_settings(CHAT_READ_REPLICA=None)
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("fts123", password="fts123")
+        other = User.objects.create_user("fts456", password="fts456")
+        self.client.force_login(self.user)
+        for text in ["python is fun", "I like pythons", "django tips", "more python notes"]:
+            Message.objects.create(user=self.user, sender=Message.USER, message=text)
+        Message.objects.create(user=other, sender=Message.USER, message="python secrets")
+
+    def search(self, **params):
+        resp = self.client.get("/api/search", params)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_prefix_match_is_scoped_to_the_user(self):
+        data = self.search(q="pyth", order="recent")
+        self.assertEqual([r["snippet"] for r in data["results"]],
+                         ["more [python] notes", "I like [pythons]", "[python] is fun"])
+        self.assertEqual(self.search(q="secrets")["results"], [])
+
+    def test_cursors_page_through_every_match(self):
+        for order in ("rank", "recent"):
+            seen, cursor = [], None
+            while True:
+                data = self.search(q="python", order=order, limit=1, **({"cursor": cursor} if cursor else {}))
+                seen += [r["id"] for r in data["results"]]
+                cursor = data["next_cursor"]
+                if cursor is None:
+                    break
+            self.assertEqual(len(seen), 3, order)
+            self.assertEqual(len(set(seen)), 3, order)
+        for cursor in ["zz", "nan:1", "inf:1", "-inf:5"]:
+            self.assertEqual(self.client.get("/api/search", {"q": "python", "cursor": cursor}).status_code, 400)
+
+    def test_triggers_follow_updates_deletes_and_archiving(self):
+        msg = Message.objects.get(message="django tips")
+        msg.message = "flask tips"
+        msg.save()
+        self.assertEqual(self.search(q="django")["results"], [])
+        self.assertEqual([r["id"] for r in self.search(q="flask")["results"]], [msg.id])
+        msg.delete()
+        self.assertEqual(self.search(q="flask")["results"], [])
+
+        call_command("archive_messages", keep_per_user=1, stdout=StringIO())
+        self.assertEqual([r["snippet"] for r in self.search(q="python")["results"]], ["more [python] notes"])
+        call_command("rebuild_message_index", stdout=StringIO())
+        self.assertEqual(len(self.search(q="python")["results"]), 1)
+
+
+class SQLiteTuningTests(TestCase):
+    def test_new_connections_get_the_pragmas(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            default = connections["default"]
+            conn = type(default)({**default.settings_dict, "NAME": os.path.join(tmp, "t.sqlite3")}, alias="pragma_test")
+            try:
+                with conn.cursor() as cursor:
+                    values = {}
+                    for name in ("journal_mode", "busy_timeout", "synchronous"):
+                        cursor.execute(f"PRAGMA {name}")
+                        values[name] = cursor.fetchone()[0]
+            finally:
+                conn.close()
+        self.assertEqual(values, {"journal_mode": "wal", "busy_timeout": 5000, "synchronous": 1})   # 1 = NORMAL
+
+
+# Both aliases are real connections to the test database, so rows must be committed.
+@override_settings(CHAT_READ_REPLICA="replica", CHAT_TYPING_DELAY=0)
+class ReadReplicaTests(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def message_queries(self, captured):
+        return [q["sql"].split()[0] for q in captured.captured_queries if '"chat_message"' in q["sql"]]
+
+    def test_polling_reads_use_the_replica_and_sends_write_default(self):
+        user = User.objects.create_user("rep123", password="rep123")
+        self.client.force_login(user)
+        with CaptureQueriesContext(connections["default"]) as default, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            self.client.post("/api/send", json.dumps({"message": "hello"}), content_type="application/json")
+        self.assertIn("INSERT", self.message_queries(default))
+        self.assertEqual(self.message_queries(replica), [])
+
+        with CaptureQueriesContext(connections["default"]) as default, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            history = self.client.get("/api/history").json()
+            # a fresh store, so the poll seeds its mark with MAX(id)
+            with mock.patch.object(views, "HIGH_WATER_MARKS", watermarks.LocalHighWaterMarks()):
+                polled = self.client.get("/api/messages", {"after": 0}).json()
+        self.assertEqual([m["sender"] for m in history["messages"]], ["user", "bot"])
+        self.assertEqual([m["sender"] for m in polled["messages"]], ["user", "bot"])
+        self.assertEqual(self.message_queries(default), [])
+        self.assertEqual(self.message_queries(replica), ["SELECT"] * 3)   # history, MAX(id), poll
+
+
+# The flusher thread commits on its own connection, so these need real commits.
+@override_settings(CHAT_TYPING_DELAY=0, CHAT_READ_REPLICA=None)
+class WriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("wb1234", password="wb1234")
+
+    def rows(self, *texts):
+        return [Message(user=self.user, sender=Message.USER, message=t) for t in texts]
+
+    def test_enqueues_merge_into_one_batch_flushed_on_stop(self):
+        wb = write_behind.MessageWriteBehind(batch_size=100, flush_interval=60)
+        insert = mock.patch.object(wb, "_insert", wraps=wb._insert).start()
+        self.addCleanup(mock.patch.stopall)
+        for pair in [("a", "b"), ("c", "d"), ("e", "f")]:
+            wb.enqueue(self.rows(*pair))
+        self.assertEqual(len(wb.pending(self.user.id)), 6)
+        self.assertFalse(Message.objects.exists())
+        wb.stop()
+        self.assertEqual([len(call.args[0]) for call in insert.call_args_list], [6])
+        self.assertEqual(list(Message.objects.values_list("message", flat=True)), list("abcdef"))
+        self.assertEqual(wb.pending(self.user.id), [])
+
+    def test_ids_start_above_archived_rows(self):
+        Message.objects.bulk_create(self.rows("old", "older"))
+        call_command("archive_messages", keep_per_user=0, stdout=StringIO())
+        archived = ArchivedMessage.objects.aggregate(m=Max("id"))["m"]
+        wb = write_behind.MessageWriteBehind(flush_interval=60)
+        [row] = wb.enqueue(self.rows("new"))
+        wb.stop()
+        self.assertGreater(row.id, archived)
+        self.assertEqual(Message.objects.get().id, row.id)
+
+    def test_failing_batch_is_written_row_by_row_then_dropped(self):
+        wb = write_behind.MessageWriteBehind(batch_size=100, flush_interval=60, max_attempts=2)
+        bad = Message(user_id=self.user.id + 1000, sender=Message.USER, message="orphan")
+        wb.enqueue(self.rows("first") + [bad] + self.rows("last"))
+        with self.assertLogs("chat.write_behind", "ERROR"):
+            wb.flush()   # attempt 1 fails and requeues
+            wb.flush()   # attempt 2 gives up on the batch
+        self.assertEqual(wb.dropped, 1)
+        self.assertEqual(list(Message.objects.values_list("message", flat=True)), ["first", "last"])
+        self.assertEqual(wb.pending(self.user.id), [])
+        wb.stop()
+
+    def test_read_your_writes_through_api_messages(self):
+        write_behind.configure({"batch_size": 100, "flush_interval": 60})
+        self.addCleanup(write_behind.configure, None)
+        self.client.force_login(self.user)
+        resp = self.client.post("/api/send", json.dumps({"message": "what is python"}), content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(Message.objects.exists())
+        resp = self.client.get("/api/messages", {"after": 0})
+        self.assertEqual([m["sender"] for m in resp.json()["messages"]], ["user", "bot"])
+        write_behind.configure(None)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_full_queue_waits_outside_the_send_transaction(self):
+        wb = write_behind.configure({"batch_size": 100, "flush_interval": 0.2, "max_pending": 2})
+        self.addCleanup(write_behind.configure, None)
+        in_transaction = []
+        enqueue = wb.enqueue
+        def recording_enqueue(rows):
+            in_transaction.append(connection.in_atomic_block)
+            return enqueue(rows)
+        wb.enqueue = recording_enqueue
+        wb.enqueue(self.rows("a", "b"))   # the queue is now full
+        self.client.force_login(self.user)
+        resp = self.client.post("/api/send", json.dumps({"message": "my name is Ann"}),
+                                content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        write_behind.configure(None)
+        self.assertEqual(in_transaction, [False, False])
+        self.assertEqual(wb.dropped, 0)
+        self.assertEqual(Message.objects.count(), 4)
+        self.assertEqual(Profile.objects.get(user=self.user).preferred_name, "Ann")
+
+
+@override_settings(CHAT_READ_REPLICA=None)
+class HighWaterMarkTests(TestCase):
+    def test_local_mark_is_reseeded_after_its_ttl(self):
+        marks = watermarks.LocalHighWaterMarks(ttl=2)
+        patcher = mock.patch.object(views, "HIGH_WATER_MARKS", marks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user("hwm123", password="hwm123")
+        self.client.force_login(user)
+        first = Message.objects.create(user=user, sender=Message.USER, message="one")
+        self.assertEqual(self.client.get("/api/messages", {"after": first.id}).json(), {"messages": []})
+
+        # written by another worker: this worker's mark does not move
+        Message.objects.create(user=user, sender=Message.USER, message="two")
+        marks.advance(user.id, first.id)   # a local write keeps the old expiry
+        self.assertEqual(self.client.get("/api/messages", {"after": first.id}).json(), {"messages": []})
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 3):
+            resp = self.client.get("/api/messages", {"after": first.id})
+        self.assertEqual([m["message"] for m in resp.json()["messages"]], ["two"])
+
+    @override_settings(CHAT_TYPING_DELAY=0)
+    async def test_async_views_reach_cached_marks_off_the_event_loop(self):
+        marks = watermarks.CacheHighWaterMarks("default", prefix=f"{self.id()}:")
+        for name in ("get", "set"):
+            patcher = mock.patch.object(marks.cache, name, off_the_event_loop(getattr(marks.cache, name)))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        user = await sync_to_async(User.objects.create_user)("hwm456", password="hwm456")
+        with mock.patch.object(views, "HIGH_WATER_MARKS", marks):
+            client = AsyncClient()
+            await client.aforce_login(user)
+            self.assertEqual((await client.get("/api/messages", {"after": 0})).json(), {"messages": []})
+            sent = (await client.post("/api/send", json.dumps({"message": "hello"}),
+                                      content_type="application/json")).json()
+            resp = await client.get("/api/messages", {"after": 0})
+        self.assertEqual(len(resp.json()["messages"]), 2)
+        self.assertEqual(await marks.aget(user.id), sent["bot_message"]["id"])
+
+
+@override_settings(CHAT_TYPING_DELAY=0)
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("abc123", password="abc123")
+        self.client.force_login(self.user)
+
+    def counts(self):
+        return {r.intent: (r.user_messages, r.bot_messages) for r in MessageRollup.objects.filter(user=self.user)}
+
+    def test_sends_update_rollups_and_backfill_agrees(self):
+        for text in ["what is python", "what is python", "my name is Bob", "calculate 2+2"]:
+            self.client.post("/api/send", json.dumps({"message": text}), content_type="application/json")
+        self.client.post("/api/send_batch", json.dumps({"messages": ["what is django", "reset"]}),
+                         content_type="application/json")
+        live = self.counts()
+        self.assertEqual(live, {"kb": (3, 3), "name_set": (1, 1), "calculator": (1, 1), "name_reset": (1, 1)})
+        MessageRollup.objects.all().delete()
+        call_command("backfill_rollups", stdout=StringIO())
+        self.assertEqual(self.counts(), live)
+
+
+class HistogramTests(TestCase):
+    def test_shards_of_finished_threads_are_folded_in(self):
+        hist = metrics.Histogram("test_seconds", "Test.", "label")
+        threads = [threading.Thread(target=hist.observe, args=(0.002, "x")) for _ in range(50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        hist.observe(0.002, "x")
+        self.assertEqual(len(hist._shards), 1)   # this thread's
+        cell = hist.snapshot()["x"]
+        self.assertEqual(sum(cell[:-1]), 51)
+        self.assertAlmostEqual(cell[-1], 0.102)
+
+
+class FrozenDatetime(datetime):
+    """Wednesday 4 March 2026, 15:06:07 (UTC too), for the time/date replies."""
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2026, 3, 4, 15, 6, 7, tzinfo=tz)
+
+
+def kb_answer(question):
+    return next(a for q, a in bot_logic.KB if q == question)
+
+
+class IntentRouterParityTests(TestCase):
+    # (message, intent, reply) as the old if-chain answered them: project Q&A,
+    # then time/date, calculator, jokes/quotes, greeting, KB, follow-up.
+    CASES = [
+        # "utc" + "time" beats plain time; either beats the calculator gate
+        ("what is the utc time", "time_date", "UTC time is 15:06:07."),
+        ("what time is it", "time_date", "The current time is 03:06 PM."),
+        ("calc the clock", "time_date", "The current time is 03:06 PM."),
+        ("utc please", "followup", None),
+        # "today" contains "day"; date comes before day + week
+        ("what day is today", "time_date", "Today is Wednesday, 04 March 2026."),
+        ("weekday today", "time_date", "Today is Wednesday, 04 March 2026."),
+        ("which day of the week is it", "time_date", "It’s Wednesday."),
+        ("the weekday", "time_date", "It’s Wednesday."),
+        ("this month", "time_date", "We are in March."),
+        ("next year plans", "time_date", "It’s 2026."),
+        # project phrases first; "project" needs one of the flex words
+        ("tell me about the project", "project", bot_logic.PROJECT_OVERVIEW),
+        ("project details", "project", bot_logic.PROJECT_OVERVIEW),
+        ("explain the project", "project", bot_logic.PROJECT_OVERVIEW),
+        ("how to run the project", "project", bot_logic.PROJECT_HOW_TO_RUN),
+        ("good database design", "project", bot_logic.PROJECT_DATABASE),
+        ("project", "followup", None),
+        ("about this", "followup", None),
+        # the calculator gate vs. keywords and the KB
+        ("calculate 12*(3+4)", "calculator", "12*(3+4) = 84"),
+        ("calculate 2^10", "calculator", "2**10 = 1024"),
+        ("2+3 please", "calculator", "2+3 = 5"),
+        ("1/0", "calculator", "Division by zero is not allowed."),
+        ("what is the time 2+3", "time_date", "The current time is 03:06 PM."),
+        ("what is 2+3", "followup", None),   # the capture starts at the space
+        ("what is python", "kb", kb_answer("what is python")),
+        ("explain rest api", "kb", kb_answer("what is rest api")),
+        # time before jokes, jokes before quotes
+        ("tell me a joke about time", "time_date", "The current time is 03:06 PM."),
+        ("tell me a funny quote", "joke_quote", bot_logic.JOKES[0]),
+        ("inspire me", "joke_quote", bot_logic.QUOTES[0]),
+        # greeting vs. router and KB
+        ("hi, what time is it", "time_date", "The current time is 03:06 PM."),
+        ("hello, what is django", "greeting", "Good afternoon! How can I help you today?"),
+        ("hey", "greeting", "Good afternoon! How can I help you today?"),
+    ]
+
+    def setUp(self):
+        for patcher in (mock.patch.object(bot_logic, "datetime", FrozenDatetime),
+                        mock.patch("random.choice", lambda seq: seq[0]),
+                        mock.patch.object(bot_logic, "REPLY_CACHE", bot_logic.ReplyCache(maxsize=0))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_replies_match_the_old_if_chain(self):
+        for text, intent, reply in self.CASES:
+            with self.subTest(text=text):
+                self.assertEqual(bot_logic.bot_reply_with_intent(text),
+                                 (intent, reply if reply is not None else bot_logic.FOLLOWUPS[0]))
+
+    def test_batch_replies_agree(self):
+        expected = [(i, r if r is not None else bot_logic.FOLLOWUPS[0]) for _t, i, r in self.CASES]
+        self.assertEqual(bot_logic.bot_replies_with_intents([t for t, _i, _r in self.CASES]), expected)
+
+
+class ReplyCacheTests(TestCase):
+    def setUp(self):
+        self.cache = bot_logic.ReplyCache(maxsize=2, ttl=60)
+        patcher = mock.patch.object(bot_logic, "REPLY_CACHE", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_key_ignores_case_and_spacing(self):
+        bot_logic.generate_bot_reply("What is  Python")
+        self.assertIsNotNone(self.cache.get(" what is python "))
+        self.assertIsNotNone(self.cache.get("what\tis python"))
+
+    def test_time_dependent_random_and_refused_replies_are_never_stored(self):
+        for text in ["what time is it", "tell me a joke", "inspire me", "hello", "asdfgh qwerty", "calc 9^999"]:
+            with self.subTest(text=text):
+                bot_logic.generate_bot_reply(text)
+                bot_logic.generate_bot_replies([text])
+                self.assertIsNone(self.cache.get(text))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_ttl_expiry_and_lru_eviction_are_counted(self):
+        self.cache.put("a", ("kb", "A"))
+        self.cache.put("b", ("kb", "B"))
+        self.assertEqual(self.cache.get("a"), ("kb", "A"))   # b is now least recent
+        self.cache.put("c", ("kb", "C"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats(), {"size": 2, "maxsize": 2, "hits": 1, "misses": 1, "evictions": 1})
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats(), {"size": 1, "maxsize": 2, "hits": 1, "misses": 2, "evictions": 2})
+
+    def test_install_content_clears_the_cache(self):
+        self.addCleanup(bot_logic.install_content, bot_logic.CONTENT)
+        generation = self.cache.generation
+        bot_logic.generate_bot_reply("what is python")
+        bot_logic.install_content(bot_logic.CONTENT)
+        self.assertIsNone(self.cache.get("what is python"))
+        # a reply computed before the swap is not stored after it
+        self.cache.put("what is python", ("kb", "stale"), generation=generation)
+        self.assertIsNone(self.cache.get("what is python"))
+
+
+class CalculatorTests(TestCase):
+    def test_results_match_float_arithmetic(self):
+        self.assertEqual(calculator_intent("calculate 12*(3+4)"), "12*(3+4) = 84")
+        self.assertEqual(calculator_intent("calc 2^10 % 7"), "2**10 % 7 = 2")
+        self.assertEqual(calculator_intent("calc 5/0"), "Division by zero is not allowed.")
+
+    def test_hostile_expressions_are_refused_quickly(self):
+        for text in ["calculate 9^9^9", "calc 9**9**9**9", "calc 10^309", "calc " + "9" * 190 + "^99"]:
+            start = time.perf_counter()
+            self.assertEqual(calculator_intent(text), "That number is too large for me to calculate.")
+            self.assertLess(time.perf_counter() - start, 0.05)
+        self.assertIsNone(calculator_intent("calc (-8)^(1/3)"))
+        self.assertIsNone(calculator_intent("calc " + "1+" * 150 + "1"))
+
+    def test_long_sums_are_answered(self):
+        expr = "+".join(["1"] * 61)
+        self.assertEqual(calculator_intent("calc " + expr), f"{expr} = 61")
+
+    def test_refusals_are_not_cached(self):
+        cache = bot_logic.ReplyCache()
+        with mock.patch.object(bot_logic, "REPLY_CACHE", cache):
+            self.assertEqual(bot_logic.generate_bot_reply("calc 9^999"), bot_logic.CALC_TOO_LARGE)
+            bot_logic.generate_bot_reply("calc 2^10")
+        self.assertIsNone(cache.get("calc 9^999"))
+        self.assertEqual(cache.get("calc 2^10"), ("calculator", "2**10 = 1024"))
+
+
+class SpellingTests(TestCase):
+    def test_misspelled_questions_get_the_right_reply(self):
+        python = bot_logic.generate_bot_reply("what is python")
+        self.assertEqual(bot_logic.generate_bot_reply("what is pyhton"), python)
+        self.assertEqual(bot_logic.generate_bot_replies(["explain djnago"]),
+                         [bot_logic.generate_bot_reply("explain django")])
+
+    def test_unknown_words_still_fall_back(self):
+        speller = bot_logic.CONTENT.speller
+        self.assertIsNone(speller.correct_text("asdfgh qwerty"))
+        self.assertEqual(speller.correct("cat"), "cat")   # too short to correct
+        self.assertEqual(bot_logic.bot_reply_with_intent("asdfgh qwerty")[0], bot_logic.FALLBACK_INTENT)
+
+    def test_short_words_get_one_edit_and_only_kb_words(self):
+        speller = bot_logic.SpellCorrector([("python", 1), ("javascript", 1)])
+        self.assertEqual(speller.correct("pythn"), "python")
+        self.assertEqual(speller.correct("pyhtno"), "pyhtno")      # two edits, six letters
+        self.assertEqual(speller.correct("javscrpt"), "javascript")
+        content = bot_logic.CONTENT.speller
+        for word in ["gear", "mouth", "mate", "rust", "joek"]:
+            self.assertEqual(content.correct(word), word)
+
+    def test_ordinary_words_are_not_turned_into_keywords(self):
+        texts = ["thanks mate", "my dear friend", "gear", "what about mouth", "test", "what is rust"]
+        for text in texts:
+            with self.subTest(text=text):
+                self.assertEqual(bot_logic.bot_reply_with_intent(text)[0], bot_logic.FALLBACK_INTENT)
+        self.assertEqual({intent for intent, _ in bot_logic.bot_replies_with_intents(texts)},
+                         {bot_logic.FALLBACK_INTENT})
+
+    def test_corrected_text_never_reaches_time_and_date(self):
+        self.addCleanup(bot_logic.install_content, bot_logic.CONTENT)
+        bot_logic.install_content(bot_logic.BotContent(
+            [("important dates", "Launch is in May.")], {}, {}, ["joke"], ["quote"]))
+        # "dates" contains the date keyword, but only the KB may answer a guess
+        self.assertEqual(bot_logic.bot_reply_with_intent("importnat datse"),
+                         (bot_logic.KB_INTENT, "Launch is in May."))
+
+
+class KBLoaderTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(bot_logic.install_content, bot_logic.CONTENT)
+        self.source = os.path.join(tmp.name, "kb.json")
+        self.artifact = os.path.join(tmp.name, "kb.artifact")
+
+    def write(self, doc):
+        with open(self.source, "w") as fh:
+            json.dump(doc, fh)
+        # a distinct mtime even on coarse-grained filesystems
+        os.utime(self.source, ns=(time.time_ns(), time.time_ns() + len(json.dumps(doc))))
+
+    def test_artifact_and_hot_swap(self):
+        self.write({"version": "v1", "kb": [["what is rust", "Rust v1."]], "jokes": ["Joke v1."]})
+        reloader = kb_loader.KBReloader(self.source, self.artifact, interval=None)
+        reloader.reload()
+        self.assertEqual(bot_logic.generate_bot_reply("what is rust"), "Rust v1.")
+        self.assertEqual(bot_logic.generate_bot_reply("tell me a joke"), "Joke v1.")
+        self.assertIn("Project:", bot_logic.generate_bot_reply("tell me about your project"))  # built-in
+
+        content, _ = kb_loader.load(None, self.artifact)
+        self.assertEqual(content.version, "v1")
+        self.assertIsInstance(content.index, MappedKnowledgeIndex)
+        self.assertEqual(list(content.kb), [("what is rust", "Rust v1.")])
+
+        self.assertFalse(reloader.check())
+        self.write({"version": "v2", "kb": [{"question": "what is rust", "answer": "Rust v2."}]})
+        self.assertTrue(reloader.check())
+        self.assertEqual(bot_logic.CONTENT.version, "v2")
+        self.assertEqual(bot_logic.generate_bot_reply("what is rust"), "Rust v2.")  # cache was cleared
+
+        with open(self.source, "w") as fh:
+            fh.write("{not json")
+        with self.assertLogs("chat.kb_loader", "ERROR"):
+            self.assertFalse(reloader.check())
+        self.assertEqual(bot_logic.CONTENT.version, "v2")
+
+    def test_artifact_maps_the_spelling_dictionary(self):
+        self.write({"kb": [["what is rust", "Rust."], ["explain kubernetes", "K8s."]]})
+        kb_loader.load(self.source, self.artifact)   # writes the artifact
+        rebuilt = AssertionError("spelling dictionary rebuilt")
+        with mock.patch.object(bot_logic.SpellCorrector, "__init__", side_effect=rebuilt), \
+                mock.patch.object(kb_loader, "build_spell_index", side_effect=rebuilt):
+            content, _ = kb_loader.load(self.source, self.artifact)
+            self.assertIsInstance(content.speller, MappedSpellCorrector)
+            self.assertEqual(content.speller.correct("kubernets"), "kubernetes")
+            bot_logic.install_content(content)
+            self.assertEqual(bot_logic.generate_bot_reply("explain kubernetse"), "K8s.")
+
+    def test_mapped_index_matches_in_memory_index(self):
+        entries = bot_logic.KB + [("naïve café", "Unicode ✓"), ("what is django rest", "DRF")]
+        index = KnowledgeIndex(entries)
+        mapped = MappedKnowledgeIndex(build_index(index.entries, index.token_sets))
+        self.assertEqual(list(mapped.entries), entries)
+        for text in ["what is django", "django rest api", "naïve café", "json http git", "nothing here", ""]:
+            self.assertEqual(mapped.search(tokenize(text), k=3), index.search(tokenize(text), k=3))
+
+
+@skipUnless(VectorKnowledgeIndex, "needs numpy")
+class KBVectorTests(TestCase):
+    QUERIES = [q for q, _ in bot_logic.KB] + ["what is " + q for q, _ in bot_logic.KB]
+    MISSES = ["quantum chromodynamics", "lorem ipsum dolor", "xyzzy"]
+
+    def test_vector_matcher_agrees_with_exact_index(self):
+        exact = KnowledgeIndex(bot_logic.KB)
+        # the built-in KB is small; lsh_min_rows=0 forces the LSH candidate path too
+        for opts in ({}, {"lsh_min_rows": 0}):
+            vector = VectorKnowledgeIndex(bot_logic.KB, **opts)
+            for text in self.QUERIES + self.MISSES:
+                self.assertEqual(vector.best_answer(tokenize(text)), exact.best_answer(tokenize(text)), (opts, text))
+            self.assertEqual(vector.best_answers([tokenize(t) for t in self.MISSES]), [None] * len(self.MISSES))
+
+    def test_bot_replies_are_unchanged(self):
+        texts = self.QUERIES + self.MISSES
+        expected = bot_logic.bot_replies_with_intents(texts)
+        self.addCleanup(bot_logic.install_content, bot_logic.CONTENT)
+        bot_logic.set_kb_matcher(VectorKnowledgeIndex(bot_logic.KB))
+        replies = bot_logic.bot_replies_with_intents(texts)
+        self.assertEqual([i for i, _ in replies], [i for i, _ in expected])
+        self.assertEqual([r for i, r in replies if i != bot_logic.FALLBACK_INTENT],
+                         [r for i, r in expected if i != bot_logic.FALLBACK_INTENT])
+        self.assertEqual([i for i, _ in replies[-len(self.MISSES):]], [bot_logic.FALLBACK_INTENT] * len(self.MISSES))
+
+
+@override_settings(CHAT_TYPING_DELAY=0, CHAT_READ_REPLICA=None, CHAT_RATE_LIMITS={
+    "send": {"rate": 0.01, "burst": 2, "concurrency": 1},
+    "poll": {"rate": 0.5, "burst": 1},
+})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit, "LIMITER", ratelimit.LocalLimiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("lim123", password="lim123")
+        self.client.force_login(self.user)
+
+    def send(self, text="hello"):
+        return self.client.post("/api/send", json.dumps({"message": text}), content_type="application/json")
+
+    def test_send_and_poll_budgets_are_separate(self):
+        self.assertEqual(self.send().status_code, 200)
+        self.assertEqual(self.send().status_code, 200)
+        resp = self.send()
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp["Retry-After"], "100")
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 4)
+
+        self.assertEqual(self.client.get("/api/messages", {"after": 0}).status_code, 200)
+        resp = self.client.get("/api/messages", {"after": 0})
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp["Retry-After"], "2")
+
+    def test_in_flight_cap(self):
+        limiter = ratelimit.LIMITER
+        self.assertTrue(limiter.enter("send:%d" % self.user.id, 1))
+        resp = self.send()
+        self.assertEqual(resp.status_code, 429)
+        limiter.leave("send:%d" % self.user.id)
+        self.assertEqual(self.send().status_code, 200)
+
+    async def test_async_views_reach_the_shared_cache_off_the_event_loop(self):
+        limiter = ratelimit.CacheLimiter("default", prefix=f"{self.id()}:")
+        for name in ("get", "set", "add", "incr", "decr"):
+            patcher = mock.patch.object(limiter.cache, name, off_the_event_loop(getattr(limiter.cache, name)))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with mock.patch.object(ratelimit, "LIMITER", limiter):
+            client = AsyncClient()
+            await client.aforce_login(self.user)
+            sends = [await client.post("/api/send", json.dumps({"message": "hello"}),
+                                       content_type="application/json") for _ in range(3)]
+            polls = [await client.get("/api/messages", {"after": 0}) for _ in range(2)]
+        self.assertEqual([r.status_code for r in sends], [200, 200, 429])
+        self.assertEqual([r.status_code for r in polls], [200, 429])
+        self.assertEqual(await limiter.cache.aget(f"{self.id()}:inflight:send:{self.user.id}"), 0)
+
+
+@override_settings(CHAT_READ_REPLICA=None)
+class PollTokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("tok123", password="tok123")
+        Message.objects.create(user=self.user, sender=Message.USER, message="hi")
+
+    def test_empty_poll_with_token_runs_no_queries(self):
+        token = issue_token(self.user.id)
+        newest = Message.objects.filter(user=self.user).latest("id").id
+        self.client.get("/api/messages", {"after": newest}, headers={"X-Poll-Token": token})  # seeds the mark
+        with self.assertNumQueries(0):
+            resp = self.client.get("/api/messages", {"after": newest}, headers={"X-Poll-Token": token})
+        self.assertEqual(resp.json(), {"messages": []})
+        resp = self.client.get("/api/history", headers={"X-Poll-Token": token})
+        self.assertEqual([m["message"] for m in resp.json()["messages"]], ["hi"])
+
+    @override_settings(CHAT_TYPING_DELAY=0)
+    def test_polls_long_after_seeding_stay_query_free_and_see_sends(self):
+        token = issue_token(self.user.id)
+        newest = Message.objects.filter(user=self.user).latest("id").id
+        self.client.get("/api/messages", {"after": newest}, headers={"X-Poll-Token": token})  # seeds the mark
+        # (a throwaway limiter: its buckets would keep the shifted clock's stamps)
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 3600), \
+                mock.patch.object(ratelimit, "LIMITER", ratelimit.LocalLimiter()):
+            with self.assertNumQueries(0):
+                resp = self.client.get("/api/messages", {"after": newest}, headers={"X-Poll-Token": token})
+            self.assertEqual(resp.json(), {"messages": []})
+            self.client.force_login(self.user)
+            self.client.post("/api/send", json.dumps({"message": "hello"}), content_type="application/json")
+            resp = self.client.get("/api/messages", {"after": newest}, headers={"X-Poll-Token": token})
+        self.assertEqual([m["sender"] for m in resp.json()["messages"]], ["user", "bot"])
+
+    def test_bad_or_expired_token_falls_back_to_session(self):
+        resp = self.client.get("/api/messages", headers={"X-Poll-Token": "forged:token"})
+        self.assertEqual(resp.status_code, 302)
+        self.client.force_login(self.user)
+        with override_settings(CHAT_POLL_TOKEN_MAX_AGE=1):
+            stale = issue_token(self.user.id)
+            with mock.patch("time.time", return_value=time.time() + 5):
+                resp = self.client.get("/api/messages", headers={"X-Poll-Token": stale})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["X-Poll-Token"], stale)
@@ -7,8 +7,13 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('register/', views.register_view, name='register'),
     path('logout/', views.logout_view, name='logout'),
+    path('metrics', views.metrics, name='metrics'),
 
     re_path(r'^api/history/?$', views.api_history, name='api_history'),
     re_path(r'^api/messages/?$', views.api_messages, name='api_messages'),
+    re_path(r'^api/export/?$', views.api_export, name='api_export'),
+    re_path(r'^api/search/?$', views.api_search, name='api_search'),
+    re_path(r'^api/stream/?$', views.api_stream, name='api_stream'),
     re_path(r'^api/send/?$', views.api_send, name='api_send'),
+    re_path(r'^api/send_batch/?$', views.api_send_batch, name='api_send_batch'),
 ]
\ No newline at end of file
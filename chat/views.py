@@ -1,16 +1,34 @@
 
 # chat/views.py
-import re
-import json, time, logging
+import json, time, asyncio, logging
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
+from django.db import transaction
+from django.db.models import Max
 from .forms import RegisterForm, LoginForm
-from .models import Message, Profile
-from .bot_logic import generate_bot_reply
+from .models import ArchivedMessage, Message, Profile
+from .bot_logic import bot_reply_with_intent, bot_replies_with_intents, extract_name, is_asking_name, is_reset
+from .analytics import ERROR_INTENT, NAME_ASK_INTENT, NAME_RESET_INTENT, NAME_SET_INTENT, record_messages
+from .db import reads_from_replica
+from .export import EXPORT_FORMATS, export_response
+from .metrics import render_metrics
+from .notify import NOTIFIER
+from .polltoken import issue_token, poll_login_required
+from .ratelimit import admission
+from .search import fts_available, search_messages
+from .watermarks import HIGH_WATER_MARKS
+from . import write_behind
 
 log = logging.getLogger(__name__)
 
@@ -51,55 +69,379 @@ def logout_view(request):
     logout(request)
     return redirect("login")
 
+@require_GET
+def metrics(request):
+    """Prometheus scrape endpoint (bearer token when CHAT_METRICS_TOKEN is set)."""
+    token = getattr(settings, "CHAT_METRICS_TOKEN", None)
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # -------- Chat pages & APIs (CSRF enabled here) --------
 @ensure_csrf_cookie
 @login_required
 def index(request):
     profile, _ = Profile.objects.get_or_create(user=request.user)
+    request.session[PROFILE_CACHE_KEY] = _profile_cache_entry(profile.preferred_name)
     preferred = profile.preferred_name or request.user.first_name or ""
-    return render(request, "chat/index.html", {"preferred_name": preferred})
+    return render(request, "chat/index.html", {"preferred_name": preferred, "poll_token": issue_token(request.user.id)})
 
-@login_required
+HISTORY_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def _parse_limit(value, default: int) -> int:
+    try:
+        limit = int(value)
+    except (ValueError, TypeError):
+        return default
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+@poll_login_required
 @require_GET
-def api_history(request):
-    msgs = Message.objects.filter(user=request.user).order_by("id")[:200]
-    return JsonResponse({"messages": [m.as_dict() for m in msgs]})
+@admission("poll")
+@reads_from_replica
+async def api_history(request):
+    """One keyset page of history on the (user, id) index, oldest first.
 
-@login_required
+    No cursor: the newest `limit` messages. `before=ID`: the page just older
+    than ID. `after=ID`: the page just newer than ID. `next_cursor` is the id
+    to pass back in the same parameter for the next page (null at the end).
+    `archived=1` also reads messages moved to the archive table.
+    """
+    user_id = request.chat_user_id
+    limit = _parse_limit(request.GET.get("limit"), HISTORY_PAGE_SIZE)
+    archived = request.GET.get("archived") == "1"
+    if request.GET.get("after") is not None:
+        page = await _fetch_messages(user_id, after=_parse_id(request.GET.get("after")), limit=limit + 1, archived=archived)
+        has_more = len(page) > limit
+        page = page[:limit]
+        next_cursor = page[-1]["id"] if has_more else None
+    else:
+        before = request.GET.get("before")
+        before_id = _parse_id(before) if before is not None else None
+        page = await _fetch_messages(user_id, before=before_id, limit=limit + 1, newest_first=True, archived=archived)
+        has_more = len(page) > limit
+        page = page[:limit][::-1]
+        next_cursor = page[0]["id"] if has_more else None
+    return JsonResponse({"messages": page, "next_cursor": next_cursor, "has_more": has_more})
+
+@poll_login_required
 @require_GET
-def api_messages(request):
+@admission("poll")
+@reads_from_replica
+async def api_messages(request):
     after = request.GET.get("after", "0")
     try:
         after_id = int(after)
     except (ValueError, TypeError):
         after_id = 0
-    msgs = Message.objects.filter(user=request.user, id__gt=after_id).order_by("id")
-    return JsonResponse({"messages": [m.as_dict() for m in msgs]})
+    limit = _parse_limit(request.GET.get("limit"), MAX_PAGE_SIZE)
+    user_id = request.chat_user_id
+
+    # Fast path: nothing newer than the user's high-water mark can exist, and
+    # an unchanged mark means an unchanged response (ETag / 304). With a poll
+    # token that makes an empty poll query-free.
+    mark = await HIGH_WATER_MARKS.aget(user_id)
+    if mark is None:
+        newest = await Message.objects.filter(user_id=user_id).aaggregate(m=Max("id"))
+        mark = await HIGH_WATER_MARKS.aadvance(user_id, newest["m"] or 0)
+    etag = f'"{user_id}-{after_id}-{limit}-{mark}"'
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    elif after_id >= mark:
+        response = JsonResponse({"messages": []})
+    else:
+        response = JsonResponse({"messages": await _fetch_messages(user_id, after=after_id, limit=limit)})
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+def _range(qs, after, before, limit, newest_first):
+    if after is not None:
+        qs = qs.filter(id__gt=after)
+    if before is not None:
+        qs = qs.filter(id__lt=before)
+    qs = qs.order_by("-id" if newest_first else "id")
+    return qs[:limit] if limit is not None else qs
+
+async def _fetch_messages(user_id, after=None, before=None, limit=None, newest_first=False, archived=False):
+    """Message dicts for the user with after < id < before, in id order.
+
+    Rows still waiting in the write-behind queue are merged in; they are
+    snapshotted before the query so a row flushed in between is not missed.
+    With `archived`, rows moved out by archive_messages are merged in too.
+    """
+    wb = write_behind.WRITE_BEHIND
+    pending = wb.pending(user_id) if wb is not None else []
+    msgs = _range(Message.objects.filter(user_id=user_id), after, before, limit, newest_first)
+    rows = [m.as_dict() async for m in msgs]
+    if archived:
+        old = _range(ArchivedMessage.objects.filter(user_id=user_id), after, before, limit, newest_first)
+        rows = sorted(rows + [m.as_dict() async for m in old], key=lambda m: m["id"], reverse=newest_first)[:limit]
+    pending = [
+        m.as_dict() for m in pending
+        if (after is None or m.id > after) and (before is None or m.id < before)
+    ]
+    if pending:
+        merged = {m["id"]: m for m in pending}
+        merged.update((m["id"], m) for m in rows)
+        rows = sorted(merged.values(), key=lambda m: m["id"], reverse=newest_first)[:limit]
+    return rows
+
+def _parse_id(value) -> int:
+    try:
+        return max(int(value), 0)
+    except (ValueError, TypeError):
+        return 0
+
+def _sse_event(m) -> str:
+    return f"id: {m['id']}\nevent: message\ndata: {json.dumps(m)}\n\n"
+
+@login_required
+@require_GET
+@admission("poll")
+async def api_stream(request):
+    """Push new messages as Server-Sent Events (or one long-poll reply).
+
+    EventSource clients (Accept: text/event-stream) get a stream that resumes
+    after Last-Event-ID; anything else gets {"messages": [...]} as soon as a
+    message newer than `after` exists, or an empty list after `timeout`.
+
+    Under WSGI (e.g. runserver) Django buffers an async streaming body until
+    it ends, so EventSource clients get 204 instead, which tells the browser
+    not to reconnect; app.js then polls /api/messages.
+    """
+    user = await request.auser()
+    after_id = _parse_id(request.headers.get("Last-Event-ID") or request.GET.get("after"))
+
+    wants_stream = "text/event-stream" in request.headers.get("Accept", "")
+    if wants_stream and not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    if not wants_stream:
+        timeout = min(_parse_id(request.GET.get("timeout")) or 25, 55)
+        msgs = await _fetch_messages(user.id, after=after_id)
+        if not msgs and await NOTIFIER.wait(user.id, after_id, timeout):
+            msgs = await _fetch_messages(user.id, after=after_id)
+        return JsonResponse({"messages": msgs})
+
+    heartbeat = getattr(settings, "CHAT_STREAM_HEARTBEAT", 15)
+    resync = getattr(settings, "CHAT_STREAM_RESYNC", 60)
+    max_age = getattr(settings, "CHAT_STREAM_MAX_AGE", 300)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        started = last_sync = loop.time()
+        last = after_id
+        yield "retry: 3000\n\n"
+        msgs = await _fetch_messages(user.id, after=last)
+        while True:
+            for m in msgs:
+                yield _sse_event(m)
+                last = m["id"]
+            if loop.time() - started >= max_age:
+                return  # the browser reconnects with Last-Event-ID
+            woke = await NOTIFIER.wait(user.id, last, heartbeat)
+            if woke or loop.time() - last_sync >= resync:
+                last_sync = loop.time()
+                published = NOTIFIER.latest(user.id)
+                msgs = await _fetch_messages(user.id, after=last)
+                # ids published before the query are either returned or gone
+                last = max(last, published)
+            else:
+                msgs = []
+                yield ": ping\n\n"
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+def _store_messages(rows, intent=None, also=None):
+    """Insert `rows` and count them in the rollups, in one transaction with
+    `also()` (the request's other writes, if any). `intent` tags rows that do
+    not carry one yet.
+
+    With write-behind the rows are queued after that transaction instead (the
+    flusher counts them): a full queue waits for the flusher, which could not
+    write while this request held SQLite's write lock.
+    """
+    if intent is not None:
+        for row in rows:
+            row.intent = intent
+    wb = write_behind.WRITE_BEHIND
+    if wb is not None:
+        if also is not None:
+            with transaction.atomic():
+                also()
+        return wb.enqueue(rows)
+    with transaction.atomic():
+        if also is not None:
+            also()
+        rows = Message.objects.bulk_create(rows)
+        record_messages(rows)
+    return rows
+
+def _messages_written(user_id: int, last_id: int) -> None:
+    """Tell pollers and streams that `last_id` is now stored for the user."""
+    HIGH_WATER_MARKS.advance(user_id, last_id)
+    NOTIFIER.publish(user_id, last_id)
+
+async def _amessages_written(user_id: int, last_id: int) -> None:
+    """_messages_written() for async views."""
+    await HIGH_WATER_MARKS.aadvance(user_id, last_id)
+    NOTIFIER.publish(user_id, last_id)
+
+def _parse_bound(value, end=False):
+    """ISO date or datetime → aware datetime; a bare `end` date covers that whole day."""
+    if not value:
+        return None
+    # a bare date first: parse_datetime() also accepts one (as midnight)
+    d = parse_date(value)
+    if d is not None:
+        dt = datetime.combine(d + timedelta(days=1) if end else d, datetime.min.time())
+    else:
+        dt = parse_datetime(value)
+        if dt is None:
+            raise ValueError(f"Invalid date: {value!r}")
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+@login_required
+@require_GET
+async def api_export(request):
+    """Download the user's messages as NDJSON (default) or CSV.
+
+    ?format=ndjson|csv, ?gzip=1, ?since= / ?until= (ISO date or datetime),
+    ?archived=1 to include archived messages (exported first).
+    """
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+    try:
+        since = _parse_bound(request.GET.get("since"))
+        until = _parse_bound(request.GET.get("until"), end=True)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    user = await request.auser()
+    models = [ArchivedMessage, Message] if request.GET.get("archived") == "1" else [Message]
+    querysets = []
+    for model in models:
+        qs = model.objects.filter(user=user)
+        if since:
+            qs = qs.filter(created_at__gte=since)
+        if until:
+            qs = qs.filter(created_at__lt=until)
+        querysets.append(qs)
+    return export_response(request, querysets, fmt=fmt, gzip=request.GET.get("gzip") == "1",
+                           filename=f"chat-{user.username}")
+
+SEARCH_PAGE_SIZE = 20
+
+@login_required
+@require_GET
+async def api_search(request):
+    """Full-text search of the user's messages (FTS5 index, see chat/search.py).
+
+    ?q= words to find (the last one matches as a prefix), ?order=rank|recent,
+    ?limit=, ?cursor= the `next_cursor` of the previous page.
+    """
+    if not fts_available():
+        return JsonResponse({"error": "search is not available on this database"}, status=501)
+    order = request.GET.get("order", "rank")
+    if order not in ("rank", "recent"):
+        return JsonResponse({"error": "order must be rank or recent"}, status=400)
+    user = await request.auser()
+    try:
+        results, next_cursor = await sync_to_async(search_messages)(
+            user.id, request.GET.get("q", ""), _parse_limit(request.GET.get("limit"), SEARCH_PAGE_SIZE),
+            request.GET.get("cursor") or None, order,
+        )
+    except ValueError:
+        return JsonResponse({"error": "invalid cursor"}, status=400)
+    return JsonResponse({"results": results, "next_cursor": next_cursor})
 
 def _get_profile(user):
     profile, _ = Profile.objects.get_or_create(user=user)
     return profile
 
-def _try_extract_name(text: str):
-    m = re.search(r"\b(?:my name is|i am|i'm|call me)\s+([A-Za-z][A-Za-z\s'-]{0,40})\b", text, re.I)
-    if not m:
-        return None
-    name = m.group(1).strip()
-    name = re.sub(r"[^\w\s'-]", "", name).strip()
-    return " ".join(w.capitalize() for w in re.split(r"\s+", name))
+def _safe_reply(text: str, name):
+    """(intent, reply) from the bot engine; errors become an apology."""
+    try:
+        return bot_reply_with_intent(text, name=name)
+    except Exception as e:
+        log.exception("bot_reply_with_intent failed")
+        return ERROR_INTENT, f"Sorry, I hit an error: {e}"
+
+def _safe_replies(texts, name):
+    try:
+        return bot_replies_with_intents(texts, name=name)
+    except Exception:
+        log.exception("bot_replies_with_intents failed; falling back to one by one")
+        return [_safe_reply(t, name) for t in texts]
+
+# The preferred name is cached in the session so a send does not have to
+# read chat_profile; our own name changes rewrite the entry, and it expires
+# after PROFILE_CACHE_TTL seconds to pick up edits made elsewhere.
+PROFILE_CACHE_KEY = "chat_profile"
+PROFILE_CACHE_TTL = 300
+
+def _profile_cache_entry(preferred_name):
+    return {"name": preferred_name, "at": time.time()}
+
+def _load_preferred_name(user, cached):
+    """Return (preferred_name, new_cache_entry or None if `cached` was used)."""
+    if cached and time.time() - cached.get("at", 0) < PROFILE_CACHE_TTL:
+        return cached.get("name"), None
+    profile = _get_profile(user)
+    return profile.preferred_name, _profile_cache_entry(profile.preferred_name)
+
+def _set_preferred_name(user, name):
+    if not Profile.objects.filter(user=user).update(preferred_name=name, updated_at=timezone.now()):
+        Profile.objects.create(user=user, preferred_name=name)
 
-def _is_asking_name(text: str) -> bool:
-    t = text.lower()
-    return bool(re.search(r"\b(what('?s| is)\s+my\s+name|who\s+am\s+i|do\s+you\s+remember\s+my\s+name)\b", t))
+def _process_send(user, text: str, cached_profile=None):
+    """Work out the reply to `text`, then store both messages in one transaction.
 
-def _is_reset(text: str) -> bool:
-    t = text.lower()
-    return any(p in t for p in ["reset", "clear chat", "clear history", "forget my name"])
+    Returns (user_msg, bot_msg, typed, profile_cache) where `typed` marks
+    replies that came from the bot engine and get the typing delay, and
+    `profile_cache` is a new session cache entry (None if unchanged).
+    """
+    profile_cache = None
+    new_name, changed = None, False
+    typed = False
+
+    if is_reset(text):
+        new_name, changed = None, True
+        intent, reply = NAME_RESET_INTENT, "Okay, I’ve cleared your name."
+    elif (maybe_name := extract_name(text)):
+        new_name, changed = maybe_name, True
+        intent, reply = NAME_SET_INTENT, f"Nice to meet you, {maybe_name}! I’ll remember your name."
+    else:
+        preferred, profile_cache = _load_preferred_name(user, cached_profile)
+        if is_asking_name(text):
+            intent = NAME_ASK_INTENT
+            if preferred or user.first_name:
+                known = preferred or user.first_name
+                reply = f"Your name is {known}."
+            else:
+                reply = "I don't know your name yet. Tell me by saying “My name is <YourName>”."
+        else:
+            name = preferred or user.first_name or None
+            intent, reply = _safe_reply(text, name)
+            typed = True
+
+    user_msg, bot_msg = _store_messages([
+        Message(user=user, sender=Message.USER, message=text),
+        Message(user=user, sender=Message.BOT, message=reply),
+    ], intent, also=(lambda: _set_preferred_name(user, new_name)) if changed else None)
+    if changed:
+        profile_cache = _profile_cache_entry(new_name)
+    return user_msg, bot_msg, typed, profile_cache
 
 @login_required
 @require_POST
-def api_send(request):
-    profile = _get_profile(request.user)
+@admission("send")
+async def api_send(request):
     try:
         data = json.loads((request.body or b"{}").decode("utf-8"))
     except Exception as e:
@@ -109,39 +451,94 @@ def api_send(request):
     if not text:
         return JsonResponse({"error": "Message cannot be empty"}, status=400)
 
-    user_msg = Message.objects.create(user=request.user, sender=Message.USER, message=text)
-
-    if _is_reset(text):
-        profile.preferred_name = None
-        profile.save(update_fields=["preferred_name", "updated_at"])
-        reply = "Okay, I’ve cleared your name."
-        bot_msg = Message.objects.create(user=request.user, sender=Message.BOT, message=reply)
-        return JsonResponse({"user_message": user_msg.as_dict(), "bot_message": bot_msg.as_dict()})
-
-    maybe_name = _try_extract_name(text)
-    if maybe_name:
-        profile.preferred_name = maybe_name
-        profile.save(update_fields=["preferred_name", "updated_at"])
-        reply = f"Nice to meet you, {maybe_name}! I’ll remember your name."
-        bot_msg = Message.objects.create(user=request.user, sender=Message.BOT, message=reply)
-        return JsonResponse({"user_message": user_msg.as_dict(), "bot_message": bot_msg.as_dict()})
-
-    if _is_asking_name(text):
-        if profile.preferred_name or request.user.first_name:
-            known = profile.preferred_name or request.user.first_name
-            reply = f"Your name is {known}."
-        else:
-            reply = "I don't know your name yet. Tell me by saying “My name is <YourName>”."
-        bot_msg = Message.objects.create(user=request.user, sender=Message.BOT, message=reply)
-        return JsonResponse({"user_message": user_msg.as_dict(), "bot_message": bot_msg.as_dict()})
+    user = await request.auser()
+    cached_profile = await request.session.aget(PROFILE_CACHE_KEY)
+    # ORM writes and the bot engine run in the sync thread; the event loop
+    # only waits, so a slow send never pins a worker thread.
+    user_msg, bot_msg, typed, profile_cache = await sync_to_async(_process_send)(user, text, cached_profile)
+    if profile_cache is not None:
+        await request.session.aset(PROFILE_CACHE_KEY, profile_cache)
+    await _amessages_written(user.id, bot_msg.id)
+
+    delay = getattr(settings, "CHAT_TYPING_DELAY", 0)
+    if typed and delay:
+        await asyncio.sleep(delay)
+    return JsonResponse({"user_message": user_msg.as_dict(), "bot_message": bot_msg.as_dict()})
 
+MAX_BATCH_MESSAGES = 100
+
+def _batch_cost(request) -> int:
+    """One send token per message in the batch (malformed bodies cost one)."""
     try:
-        name = profile.preferred_name or request.user.first_name or None
-        reply = generate_bot_reply(text, name=name)
+        raw = json.loads((request.body or b"{}").decode("utf-8")).get("messages")
+    except Exception:
+        return 1
+    return len(raw) if isinstance(raw, list) and raw else 1
+
+@login_required
+@require_POST
+@admission("send", cost=_batch_cost)
+def api_send_batch(request):
+    try:
+        data = json.loads((request.body or b"{}").decode("utf-8"))
     except Exception as e:
-        log.exception("generate_bot_reply failed")
-        reply = f"Sorry, I hit an error: {e}"
+        return HttpResponseBadRequest(f"Invalid JSON: {e}")
+
+    raw = data.get("messages") if isinstance(data, dict) else None
+    if not isinstance(raw, list) or not raw:
+        return JsonResponse({"error": "messages must be a non-empty list"}, status=400)
+    if len(raw) > MAX_BATCH_MESSAGES:
+        return JsonResponse({"error": f"At most {MAX_BATCH_MESSAGES} messages per batch"}, status=400)
+    texts = [(m if isinstance(m, str) else "").strip() for m in raw]
+    if not all(texts):
+        return JsonResponse({"error": "Message cannot be empty"}, status=400)
+
+    profile = _get_profile(request.user)
+    original_name = profile.preferred_name
+
+    # Walk the batch in order so name changes apply to later messages; plain
+    # messages are grouped by the name in effect and answered in bulk.
+    replies = [None] * len(texts)
+    pending = {}
+    for i, text in enumerate(texts):
+        if is_reset(text):
+            profile.preferred_name = None
+            replies[i] = NAME_RESET_INTENT, "Okay, I’ve cleared your name."
+            continue
+        maybe_name = extract_name(text)
+        if maybe_name:
+            profile.preferred_name = maybe_name
+            replies[i] = NAME_SET_INTENT, f"Nice to meet you, {maybe_name}! I’ll remember your name."
+            continue
+        if is_asking_name(text):
+            known = profile.preferred_name or request.user.first_name
+            if known:
+                replies[i] = NAME_ASK_INTENT, f"Your name is {known}."
+            else:
+                replies[i] = NAME_ASK_INTENT, "I don't know your name yet. Tell me by saying “My name is <YourName>”."
+            continue
+        name = profile.preferred_name or request.user.first_name or None
+        pending.setdefault(name, []).append(i)
+
+    for name, idxs in pending.items():
+        for i, reply in zip(idxs, _safe_replies([texts[i] for i in idxs], name)):
+            replies[i] = reply
+
+    rows = []
+    for text, (intent, reply) in zip(texts, replies):
+        for sender, body in ((Message.USER, text), (Message.BOT, reply)):
+            row = Message(user=request.user, sender=sender, message=body)
+            row.intent = intent
+            rows.append(row)
+    renamed = profile.preferred_name != original_name
+    rows = _store_messages(rows, also=(lambda: profile.save(update_fields=["preferred_name", "updated_at"]))
+                           if renamed else None)
+    if renamed:
+        request.session[PROFILE_CACHE_KEY] = _profile_cache_entry(profile.preferred_name)
+    _messages_written(request.user.id, rows[-1].id)
 
-    time.sleep(0.2)
-    bot_msg = Message.objects.create(user=request.user, sender=Message.BOT, message=reply)
-    return JsonResponse({"user_message": user_msg.as_dict(), "bot_message": bot_msg.as_dict()})
\ No newline at end of file
+    pairs = [
+        {"user_message": rows[j].as_dict(), "bot_message": rows[j + 1].as_dict()}
+        for j in range(0, len(rows), 2)
+    ]
+    return JsonResponse({"pairs": pairs})
@@ -0,0 +1,111 @@
+"""Per-user message high-water marks for the /api/messages fast path.
+
+The mark is the highest message id known to exist for a user. A poll with
+``after >= mark`` cannot return anything, so the view answers it without
+querying ``chat_message``. Writers advance the mark after committing; a
+missing mark is seeded once from ``MAX(id)`` on the (user, id) index.
+
+The default store is per process. Every send handled by the process
+advances its mark, so in a single-process deployment the mark is exact and
+never needs re-seeding: empty polls stay query-free however long the client
+waits between them. It cannot see sends handled by other workers, so with
+several workers ``CHAT_HWM_CACHE`` must name a shared cache (e.g. Redis or
+Memcached) so writes in one worker are seen at once by polls in another.
+``CHAT_HWM_LOCAL_TTL`` can instead bound how long a local mark is trusted
+before it is re-seeded, so polls lag other workers' sends by up to that
+long, but every poll after the TTL pays for a ``MAX(id)`` query. Async views
+use ``aget``/``aadvance``, which go through the cache's async API.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LocalHighWaterMarks:
+    def __init__(self, ttl: Optional[float] = None, max_keys: int = 100000):
+        self.ttl = ttl if ttl is not None else math.inf
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._marks: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()   # user id -> (mark, expires)
+
+    def get(self, user_id: int) -> Optional[int]:
+        entry = self._marks.get(user_id)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def advance(self, user_id: int, message_id: int) -> int:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._marks.get(user_id)
+            if entry is None or entry[1] <= now:
+                # a fresh mark; advancing a live one keeps its expiry, since
+                # this worker's own writes say nothing about the others'
+                entry = (message_id, now + self.ttl)
+            mark = max(entry[0], message_id)
+            self._marks[user_id] = (mark, entry[1])
+            self._marks.move_to_end(user_id)
+            # least recently written first; an evicted mark is simply re-seeded
+            while len(self._marks) > self.max_keys:
+                self._marks.popitem(last=False)
+            return mark
+
+    # in-process and non-blocking, so the event loop can run these itself
+    async def aget(self, user_id: int) -> Optional[int]:
+        return self.get(user_id)
+
+    async def aadvance(self, user_id: int, message_id: int) -> int:
+        return self.advance(user_id, message_id)
+
+
+class CacheHighWaterMarks:
+    """Marks kept in a Django cache shared by all workers.
+
+    Caches have no atomic max, so advance() re-reads after writing and
+    retries if a concurrent writer stored a lower id; entries also expire
+    after `timeout` seconds, so a lost race heals itself on the next seed.
+    """
+
+    def __init__(self, alias: str, timeout: int = 3600, prefix: str = "chat:hwm:"):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def get(self, user_id: int) -> Optional[int]:
+        return self.cache.get(f"{self.prefix}{user_id}")
+
+    def advance(self, user_id: int, message_id: int) -> int:
+        key = f"{self.prefix}{user_id}"
+        for _ in range(3):
+            mark = max(self.cache.get(key) or 0, message_id)
+            self.cache.set(key, mark, self.timeout)
+            if (self.cache.get(key) or 0) >= message_id:
+                break
+        return mark
+
+    async def aget(self, user_id: int) -> Optional[int]:
+        return await self.cache.aget(f"{self.prefix}{user_id}")
+
+    async def aadvance(self, user_id: int, message_id: int) -> int:
+        key = f"{self.prefix}{user_id}"
+        for _ in range(3):
+            mark = max(await self.cache.aget(key) or 0, message_id)
+            await self.cache.aset(key, mark, self.timeout)
+            if (await self.cache.aget(key) or 0) >= message_id:
+                break
+        return mark
+
+
+def _build():
+    alias = getattr(settings, "CHAT_HWM_CACHE", None)
+    if alias:
+        return CacheHighWaterMarks(alias)
+    return LocalHighWaterMarks(getattr(settings, "CHAT_HWM_LOCAL_TTL", None))
+
+
+HIGH_WATER_MARKS = _build()
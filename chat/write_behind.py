@@ -0,0 +1,197 @@
+"""Optional write-behind persistence for chat messages.
+
+With ``CHAT_WRITE_BEHIND`` set, views hand new Message rows to a bounded
+in-process queue instead of inserting them. Ids are assigned up front (above
+every id used so far, hot or archived, at first use, then sequentially), so responses, high-water marks and
+SSE events can use them immediately. A background thread writes the queue
+with ``bulk_create`` whenever ``batch_size`` rows are waiting or
+``flush_interval`` seconds have passed; whatever is left is flushed at
+interpreter exit. Each batch updates the analytics rollups in the same
+transaction. Readers merge ``pending()`` rows with their query results,
+so unflushed messages are still visible.
+
+A batch that fails is retried with exponential backoff. After
+``max_attempts`` failures its rows are written one at a time, and any row
+that still fails is logged and dropped (counted in ``dropped``), so one
+bad row cannot hold up every later write.
+
+Caveats: ids are allocated per process, so only one process may write
+messages while this is enabled. ``created_at`` is stamped again when the
+row is flushed (auto_now_add), normally a few milliseconds later.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from django.db import close_old_connections, connection, connections, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .analytics import record_messages
+from .models import ArchivedMessage, Message
+
+log = logging.getLogger(__name__)
+
+
+class MessageWriteBehind:
+    def __init__(self, batch_size: int = 500, flush_interval: float = 0.05, max_pending: int = 10000,
+                 max_attempts: int = 5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.dropped = 0
+        self._failures = 0      # consecutive failed attempts at the head batch
+        self._cond = threading.Condition()
+        self._queue: Deque[Message] = deque()       # not yet written
+        self._by_user: Dict[int, Dict[int, Message]] = {}  # queued or being written
+        self._next_id: Optional[int] = None
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    # -- writers -------------------------------------------------------
+    def _allocate(self, n: int) -> int:
+        if self._next_id is None:
+            self._next_id = _max_message_id() + 1
+        first = self._next_id
+        self._next_id += n
+        return first
+
+    def enqueue(self, rows: List[Message]) -> List[Message]:
+        """Assign ids/timestamps to `rows` and queue them; blocks while full.
+
+        Never call this inside a transaction: the flusher needs the write
+        lock that transaction may hold to make room.
+        """
+        with self._cond:
+            while len(self._queue) + len(rows) > self.max_pending and not self._stopping:
+                self._cond.notify_all()
+                self._cond.wait()
+            first = self._allocate(len(rows))
+            now = timezone.now()
+            for offset, row in enumerate(rows):
+                row.id = first + offset
+                row.created_at = now
+                self._queue.append(row)
+                self._by_user.setdefault(row.user_id, {})[row.id] = row
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return rows
+
+    # -- readers -------------------------------------------------------
+    def pending(self, user_id: int) -> List[Message]:
+        """Unflushed rows for the user (take this before querying the DB)."""
+        with self._cond:
+            return list(self._by_user.get(user_id, {}).values())
+
+    # -- flusher -------------------------------------------------------
+    def _take_batch(self) -> List[Message]:
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        return batch
+
+    @staticmethod
+    def _insert(rows: List[Message]) -> None:
+        with transaction.atomic():
+            Message.objects.bulk_create(rows)
+            record_messages(rows)
+
+    def _write(self, batch: List[Message]) -> bool:
+        try:
+            self._insert(batch)
+        except Exception:
+            self._failures += 1
+            if self._failures < self.max_attempts:
+                log.warning("write-behind flush of %d messages failed (attempt %d of %d); will retry",
+                            len(batch), self._failures, self.max_attempts, exc_info=True)
+                with self._cond:
+                    self._queue.extendleft(reversed(batch))
+                return False
+            log.exception("write-behind flush of %d messages failed %d times; writing them one by one",
+                          len(batch), self._failures)
+            self._write_each(batch)
+        self._failures = 0
+        with self._cond:
+            for row in batch:
+                bucket = self._by_user.get(row.user_id)
+                if bucket is not None:
+                    bucket.pop(row.id, None)
+                    if not bucket:
+                        del self._by_user[row.user_id]
+            self._cond.notify_all()
+        return True
+
+    def _write_each(self, batch: List[Message]) -> None:
+        for row in batch:
+            try:
+                self._insert([row])
+            except Exception:
+                self.dropped += 1
+                log.exception("write-behind dropped message %s (user %s, %s): %r",
+                              row.id, row.user_id, row.sender, row.message[:200])
+
+    def _backoff(self) -> float:
+        return min(5.0, self.flush_interval * 10 * 2 ** (self._failures - 1))
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    if len(self._queue) < self.batch_size and not self._stopping:
+                        self._cond.wait(self.flush_interval)
+                    batch = self._take_batch()
+                    done = self._stopping and not batch
+                if done:
+                    return
+                if batch:
+                    close_old_connections()
+                    if not self._write(batch):
+                        time.sleep(self._backoff())
+        finally:
+            connection.close()
+
+    def flush(self) -> None:
+        """Write everything queued so far from the calling thread."""
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch or not self._write(batch):
+                return
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout=30)
+
+
+def _max_message_id() -> int:
+    """The highest message id ever handed out: archived rows keep their ids,
+    and on SQLite the AUTOINCREMENT counter also covers deleted rows."""
+    db = router.db_for_write(Message)
+    newest = max(Message.objects.using(db).aggregate(m=Max("id"))["m"] or 0,
+                 ArchivedMessage.objects.using(db).aggregate(m=Max("id"))["m"] or 0)
+    conn = connections[db]
+    if conn.vendor == "sqlite":
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [Message._meta.db_table])
+            row = cursor.fetchone()
+        newest = max(newest, row[0] if row else 0)
+    return newest
+
+
+WRITE_BEHIND: Optional[MessageWriteBehind] = None
+
+
+def configure(options: Optional[dict]) -> Optional[MessageWriteBehind]:
+    global WRITE_BEHIND
+    if WRITE_BEHIND is not None:
+        WRITE_BEHIND.stop()
+    WRITE_BEHIND = MessageWriteBehind(**options) if options is not None else None
+    return WRITE_BEHIND
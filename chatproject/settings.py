@@ -18,6 +18,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,12 +46,44 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'chatproject.wsgi.application'
+ASGI_APPLICATION = 'chatproject.asgi.application'
 
+# CONN_MAX_AGE: seconds to reuse a connection across requests (0 = new one per
+# request). Reuse helps under WSGI; under ASGI keep 0 (connections are per
+# thread there). "replica" opens the same SQLite file read-only: with WAL it
+# reads without blocking the writer. Point it at a real replica in production.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        # Take the write lock at BEGIN so concurrent sends wait on busy_timeout
+        # instead of failing with "database is locked" on lock upgrade.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['chat.db.ReadReplicaRouter']
+
+# Alias used for the read-only history/polling APIs (None = default).
+CHAT_READ_REPLICA = 'replica'
+
+# PRAGMAs applied to every new SQLite connection (see chat/db.py).
+CHAT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
 }
 
 # EXACTLY 6-character alphanumeric password rule
@@ -70,4 +103,73 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Auth redirects
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
-LOGOUT_REDIRECT_URL = '/login/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/login/'
+
+# KB matching engine for the bot: "jaccard" (token overlap, default) or
+# "vector" (hashed TF-IDF + LSH, needs numpy). Options go to VectorKnowledgeIndex.
+CHAT_KB_ENGINE = 'jaccard'
+CHAT_KB_VECTOR_OPTIONS = {}
+
+# Bot content (KB, project Q&A, jokes, quotes) from a JSON or SQLite file
+# instead of the literals in chat/bot_logic.py (see chat/kb_loader.py).
+# CHAT_KB_ARTIFACT caches the precompiled index (`manage.py build_kb`) and is
+# memory-mapped, so workers on one host share the KB pages; either may be
+# set alone. Workers re-check both files every
+# CHAT_KB_RELOAD_INTERVAL seconds and swap in changes (None = load once).
+CHAT_KB_SOURCE = None
+CHAT_KB_ARTIFACT = None
+CHAT_KB_RELOAD_INTERVAL = 5
+
+# LRU cache for deterministic bot replies (project Q&A, calculator, KB).
+# maxsize=0 disables it; ttl is in seconds (None = no expiry).
+CHAT_REPLY_CACHE = {'maxsize': 2048, 'ttl': None}
+
+# Cosmetic "typing" pause (seconds) before /api/send answers with a bot-engine
+# reply. Awaited with asyncio.sleep, so it holds no worker thread.
+CHAT_TYPING_DELAY = 0.2
+
+# /api/stream (Server-Sent Events): heartbeat comment interval, database
+# resync interval for rows written by other processes, and max stream age
+# before the browser reconnects with Last-Event-ID (all seconds).
+CHAT_STREAM_HEARTBEAT = 15
+CHAT_STREAM_RESYNC = 60
+CHAT_STREAM_MAX_AGE = 300
+
+# Cache alias holding per-user message high-water marks for the /api/messages
+# "nothing new" fast path. None keeps them per process, kept exact by this
+# process's own sends: right for a single worker only. With several workers
+# this MUST name a shared cache, or polls miss sends handled by other workers.
+# CHAT_HWM_LOCAL_TTL (seconds, None = never) re-seeds per-process marks from
+# the database once they are that old, a stopgap that bounds the lag but makes
+# every poll after it run a MAX(id) query.
+CHAT_HWM_CACHE = None
+CHAT_HWM_LOCAL_TTL = None
+
+# Write-behind message persistence: None writes each send synchronously.
+# A dict such as {'batch_size': 500, 'flush_interval': 0.05, 'max_pending': 10000}
+# queues rows in memory and bulk-inserts them from a background thread; a
+# batch failing 'max_attempts' times (default 5) is written row by row and
+# rows that still fail are logged and dropped.
+# Single writer process only (ids are allocated in-process).
+CHAT_WRITE_BEHIND = None
+
+# Per-user token buckets (see chat/ratelimit.py): "burst" requests at once,
+# refilled at "rate" per second; "concurrency" caps requests in flight.
+# Over budget answers 429 with Retry-After. "send" covers api_send and
+# api_send_batch (one token per message), "poll" api_messages, api_history
+# and api_stream. Drop a scope to leave it unlimited. Buckets live per
+# process unless CHAT_RATE_LIMIT_CACHE names a shared cache alias.
+CHAT_RATE_LIMITS = {
+    'send': {'rate': 1.0, 'burst': 20, 'concurrency': 3},
+    'poll': {'rate': 3.0, 'burst': 30},
+}
+CHAT_RATE_LIMIT_CACHE = None
+
+# Lifetime (seconds) of the signed poll token the chat page sends with
+# /api/messages and /api/history instead of its session (chat/polltoken.py);
+# also how long polling keeps working after logout. 0 disables tokens.
+CHAT_POLL_TOKEN_MAX_AGE = 300
+
+# /metrics (Prometheus text format, per process). When set, scrapers must send
+# "Authorization: Bearer <token>"; None leaves the endpoint open.
+CHAT_METRICS_TOKEN = None